@@ -4,6 +4,7 @@ from baseball.stats import stat_loader
 from . import optimizer
 from .player_customizations import PlayerCustomizations
 from .historical_game_details import HistoricalGameDetails
+from baseball.simulator.simulator import MIN_ITERATIONS
 
 import numpy as np
 
@@ -12,10 +13,13 @@ import random
 import csv
 
 
-def backtest(year, num_simulations=50):
+def backtest(year, num_simulations=50, target_error=None,
+             min_simulations=MIN_ITERATIONS):
     """
     For each day in <year> builds the optimal lineup.
     Simulates each game <num_simulations> times to get player projections
+    With <target_error> games stop early once the projections are that
+        precise, see optimizer.build_predictions
     Prints and outputs to csv the date, actual lineup score, and
         predicted lineup score.
     Assumes players can be picked from any game on a date but only the later
@@ -40,7 +44,8 @@ def backtest(year, num_simulations=50):
         player_data, _ = optimizer.prepare_player_data(year, date)
 
         player_predictions, cov_dict, pitcher_stats = optimizer.build_predictions(
-            data_handler, player_data, date, num_simulations, player_customizations)
+            data_handler, player_data, date, num_simulations, player_customizations,
+            target_error=target_error, min_simulations=min_simulations)
 
         baseline_predictions = generate_baseline_predictions(player_predictions)
 
@@ -116,6 +121,13 @@ if __name__ == '__main__':
                         help="the year to collect data for")
     parser.add_argument("--num_simulations", nargs='?', default='1000',
                         type=int, help="number of times to simulate each game")
+    parser.add_argument("--target_error", nargs='?', default=None, type=float,
+                        help="stop simulating a game once every player's DK "
+                             "pts standard error is below this")
+    parser.add_argument("--min_simulations", nargs='?', default=MIN_ITERATIONS,
+                        type=int, help="fewest simulations per game when "
+                                       "using --target_error")
     args = parser.parse_args()
 
-    backtest(args.year, args.num_simulations)
+    backtest(args.year, args.num_simulations, args.target_error,
+             args.min_simulations)
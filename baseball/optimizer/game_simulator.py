@@ -24,7 +24,8 @@ def simulate_year(year, num_simulations, num_games):
         iteration += 1
 
         results = simulate(teams_info['home_team'],
-                           teams_info['away_team'], num_simulations)
+                           teams_info['away_team'], num_simulations,
+                           keep_dk_scores=True)
 
         output_file = "dk_scores_home_%s_%s.csv" % (iteration, num_simulations)
         with open(output_file, "w") as f:
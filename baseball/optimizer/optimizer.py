@@ -1,8 +1,13 @@
 #!/usr/bin/python
 
+import numpy as np
 import pandas as pd
 
-from baseball.simulator.simulator import simulate
+from baseball.simulator.slate import (simulate_slate, simulate_slate_budget,
+                                      PILOT_ITERATIONS)
+from baseball.simulator.simulator import MIN_ITERATIONS
+from baseball.simulator.accumulators import QUANTILE_HEADERS
+from baseball.simulator.surrogate import SurrogateProjector
 from baseball.simulator import utils
 
 from baseball.stats import stat_loader
@@ -29,30 +34,136 @@ rotoguru_pos_dict = {ord('1'): 'P',
                      ord('7'): 'OF',
                      }
 
+# Perturbed projections solved to weigh each game's simulation budget
+DECISION_DRAWS = 20
+
 
 def build_predictions(data_handler, player_data, date, num_simulations=1000,
-                      player_customizations=None):
+                      player_customizations=None, engine="game", workers=1,
+                      seed=None, common_random_numbers=False,
+                      variance_reduction=None, target_error=None,
+                      min_simulations=MIN_ITERATIONS, score_thresholds=(),
+                      simulation_budget=None,
+                      pilot_simulations=PILOT_ITERATIONS,
+                      decision_draws=DECISION_DRAWS, surrogate=None):
     """
     Uses data_handler to project dfs scores for <date>
 
     :param player_data: player info for <date> like DK salary, team etc.
+    :param engine: simulation engine passed through to simulate
+    :param workers: number of processes to simulate the slate's games on
+    :param seed: makes the simulations reproducible
+    :param common_random_numbers: simulate every run with the same seed on the
+        same draws so two player_customizations can be compared directly
+    :param variance_reduction: passed through to simulate. The effective sample
+        size of each prediction is stored in the ESS column.
+    :param target_error: simulate each game until every player's DK pts pred
+        has at most this standard error, using between <min_simulations> and
+        <num_simulations> simulations. The simulations run and the largest
+        standard error of each game are stored in the num sims and sim error
+        columns.
+    :param score_thresholds: DK scores to store each player's probability of
+        scoring at least, in a "P >= threshold" column per threshold. The
+        P10, P50 and P90 of each player's simulated DK scores are always
+        stored next to DK pts pred.
+    :param simulation_budget: total simulations for the whole slate instead of
+        <num_simulations> per game. Every game gets <pilot_simulations> and
+        the rest go to the games whose players' uncertainty most changes the
+        optimal lineup, see decision_weights with <decision_draws>.
+    :param surrogate: a surrogate.SurrogateProjector to project the slate
+        with first, once it has training games. Only the games of
+        shortlist_games are simulated, the others keep their surrogate
+        projections with 0 num sims, see add_surrogate_games. Every
+        simulated game is added to its training games.
     :type player_data: Pandas DataFrame
     Stores projected dfs points for each player in data frame with other info
     Returns data frame of player info and points
     """
+    if simulation_budget is not None and target_error is not None:
+        raise ValueError("Use either a simulation_budget or a target_error")
+
+    games = []
+
+    def customized_games():
+        # Loops through each game on <date>
+        for game_result, teams_info in data_handler.get_games([date]):
+            player_customizations.adjust_rates(teams_info['home_team'])
+            player_customizations.adjust_rates(teams_info['away_team'])
+            yield game_result, teams_info
+
+    candidates = customized_games()
+    unsimulated = []
+    if surrogate is not None and surrogate.num_games() > 0:
+        candidates = list(candidates)
+        first_pass = surrogate_predictions(candidates, surrogate, player_data)
+        shortlist = shortlist_games(first_pass, first_pass["surrogate error"],
+                                    decision_draws, seed)
+        unsimulated = [game_result["game_id"]
+                       for game_result, teams_info in candidates
+                       if game_result["game_id"] not in shortlist]
+        candidates = [(game_result, teams_info)
+                      for game_result, teams_info in candidates
+                      if game_result["game_id"] in shortlist]
+
+    def prepared_matchups():
+        for game_result, teams_info in candidates:
+            games.append((game_result, teams_info))
+            yield teams_info['home_team'], teams_info['away_team']
+
+    def allocate(pilot_results):
+        pilot, pilot_cov_dict, _ = assemble_predictions(
+            games, pilot_results, player_data, score_thresholds)
+        weights = decision_weights(pilot,
+                                   simulation_errors(pilot, pilot_cov_dict),
+                                   decision_draws, seed)
+        return [weights.get(game_result["game_id"], 0)
+                for game_result, teams_info in games]
+
+    if simulation_budget is None:
+        slate_results = simulate_slate(
+            prepared_matchups(), num_simulations, engine=engine,
+            workers=workers, seed=seed,
+            common_random_numbers=common_random_numbers,
+            variance_reduction=variance_reduction, target_error=target_error,
+            min_iterations=min_simulations)
+    else:
+        slate_results = simulate_slate_budget(
+            prepared_matchups(), simulation_budget, allocate,
+            pilot_simulations, engine=engine, workers=workers, seed=seed,
+            common_random_numbers=common_random_numbers,
+            variance_reduction=variance_reduction)
+
+    if surrogate is not None:
+        for (game_result, teams_info), results in zip(games, slate_results):
+            surrogate.add_game(teams_info['home_team'],
+                               teams_info['away_team'], results)
+
+    predictions = assemble_predictions(games, slate_results, player_data,
+                                       score_thresholds)
+    if unsimulated:
+        predictions = add_surrogate_games(
+            *predictions, first_pass[first_pass["game_id"].isin(unsimulated)])
+    return predictions
+
+
+def assemble_predictions(games, slate_results, player_data,
+                         score_thresholds=()):
+    """
+    Joins the simulate info dict of each of the (game_result, teams_info)
+        <games> with <player_data>, see build_predictions
+    Returns data frame of player info and points, the cov_dict of every
+        player and the pitchers' projected stats
+    """
     games_info = None
     pitcher_stats = None
 
     cov_dict = {}
-    # Loops through each game on <date>
-    for game_result, teams_info in data_handler.get_games([date]):
-        player_customizations.adjust_rates(teams_info['home_team'])
-        player_customizations.adjust_rates(teams_info['away_team'])
+    effective_sample_size = {}
 
-        results = simulate(teams_info['home_team'],
-                           teams_info['away_team'], num_simulations)
+    for (game_result, teams_info), results in zip(games, slate_results):
         predictions = results['avg_results']
         cov_dict.update(results['cov_dict'])
+        effective_sample_size.update(results['effective_sample_size'])
 
         away_rates = teams_info['away_team'].team_info_dataframe()
         away_info = pd.concat([away_rates, predictions["away_playerstats"]], axis=1)
@@ -62,6 +173,9 @@ def build_predictions(data_handler, player_data, date, num_simulations=1000,
         home_info = pd.concat([home_rates, predictions["home_playerstats"]], axis=1)
         home_info.ix[9, "DK pts pred"] = predictions['home_pitcher'].get_stat('dk_score')
 
+        for side_info, side in ((away_info, 'away'), (home_info, 'home')):
+            add_score_distribution(side_info, results, side, score_thresholds)
+
         home_pitcher_stats = pd.Series(predictions['home_pitcher'].stats)
         home_pitcher_id = teams_info['home_team'].starter.pid
         away_pitcher_stats = pd.Series(predictions['away_pitcher'].stats)
@@ -71,6 +185,8 @@ def build_predictions(data_handler, player_data, date, num_simulations=1000,
 
         info = away_info.append(home_info)
         info["game_id"] = game_result["game_id"]
+        info["num sims"] = results['num_iterations']
+        info["sim error"] = results['standard_error']
 
         pitcher_info = info.loc[9]
         # To handle NL: Remove batting stats for both home and away pitchers.
@@ -94,10 +210,15 @@ def build_predictions(data_handler, player_data, date, num_simulations=1000,
     prediction_data["MLB_ID"] = prediction_data["MLB_ID"].astype(int)
     prediction_data["custom DK pts pred"] = prediction_data["DK pts pred"]
     prediction_data["custom pts per Dollar"] = -1
+    prediction_data["ESS"] = prediction_data["MLB_ID"].map(
+        {int(pid): ess for pid, ess in effective_sample_size.items()})
 
     cols = ["game_id", "Team", "Name", "MLB_ID", "DK sal", "DK posn",
-            "DK posn orig", "DK pts pred", "custom DK pts pred",
-            "custom pts per Dollar"] + prediction_data.columns[2:22].tolist()
+            "DK posn orig", "DK pts pred"] + list(QUANTILE_HEADERS) + \
+        [threshold_column(threshold) for threshold in score_thresholds] + \
+        ["custom DK pts pred", "custom pts per Dollar", "ESS", "num sims",
+         "sim error"] + \
+        prediction_data.columns[2:22].tolist()
 
     # Make two rows for multipos player
     prediction_data = split_multipos_players(prediction_data)
@@ -105,6 +226,154 @@ def build_predictions(data_handler, player_data, date, num_simulations=1000,
     return prediction_data[cols], cov_dict, pitcher_stats
 
 
+def simulation_errors(predictions, cov_dict):
+    """
+    Standard error of each prediction: its variance in <cov_dict> over its
+        ESS simulations
+    """
+    variances = {int(pid): covs[pid] for pid, covs in cov_dict.items()}
+    return np.sqrt(predictions["MLB_ID"].map(variances) / predictions["ESS"])
+
+
+def optimal_lineup_ids(predictions):
+    """
+    MLB_IDs of the optimal lineup for <predictions>, empty if there is none
+    """
+    lineup, status = linearsolver.optimizeLineup(predictions)
+    if status != "Optimal":
+        return set()
+    return set(lineup["MLB_ID"].dropna().astype(int))
+
+
+def decision_weights(predictions, standard_errors, num_draws=DECISION_DRAWS,
+                     seed=None):
+    """
+    How much each game's projection uncertainty changes the optimal lineup.
+    The custom DK pts pred of every player is redrawn <num_draws> times
+        within its <standard_errors>, nan counting as 0, and the lineup
+        re-optimized. A game's weight is how many of its players entered or
+        left the lineup over the draws.
+    Returns a dict of the weight of each game_id
+    """
+    rng = np.random.RandomState(seed)
+    standard_errors = np.asarray(standard_errors, dtype=float)
+    standard_errors = np.where(np.isnan(standard_errors), 0, standard_errors)
+    player_games = dict(zip(predictions["MLB_ID"], predictions["game_id"]))
+
+    optimal_ids = optimal_lineup_ids(predictions)
+    weights = dict.fromkeys(predictions["game_id"].unique(), 0)
+    for _ in range(num_draws):
+        perturbed = predictions.copy()
+        perturbed["custom DK pts pred"] += (
+            standard_errors * rng.standard_normal(len(perturbed)))
+        for pid in optimal_lineup_ids(perturbed) ^ optimal_ids:
+            weights[player_games[pid]] += 1
+    return weights
+
+
+def surrogate_predictions(games, surrogate, player_data):
+    """
+    Projects each of the (game_result, teams_info) <games> with the
+        surrogate.SurrogateProjector <surrogate> instead of simulating
+    Returns data frame of player info and points with the held-out error of
+        each player's role in the surrogate error column
+    """
+    errors = surrogate.projection_errors()
+    games_info = []
+    for game_result, teams_info in games:
+        projection = surrogate.project(teams_info['home_team'],
+                                       teams_info['away_team'])
+        for side, side_projection in zip(("home", "away"), projection):
+            info = teams_info[side + '_team'].team_info_dataframe()
+            info["DK pts pred"] = side_projection[:, 0]
+            info["DK pts var"] = side_projection[:, 1]
+            info["surrogate error"] = errors["batter"]
+            info.loc[9, "surrogate error"] = errors["pitcher"]
+            info["game_id"] = game_result["game_id"]
+            pitcher_info = info.loc[[9]]
+            # To handle NL: Remove batting stats for the pitchers.
+            starters = [teams_info[team].starter.pid
+                        for team in ('home_team', 'away_team')]
+            games_info.extend([info[:9][~info[:9]["MLB_ID"].isin(starters)],
+                               pitcher_info])
+
+    player_info_cols = ["MLB_ID", "Name", "DK posn", "DK sal"]
+    prediction_data = pd.concat(games_info, ignore_index=True).merge(
+        player_data[player_info_cols])
+    prediction_data["MLB_ID"] = prediction_data["MLB_ID"].astype(int)
+    prediction_data["custom DK pts pred"] = prediction_data["DK pts pred"]
+    return split_multipos_players(prediction_data)
+
+
+def add_surrogate_games(prediction_data, cov_dict, pitcher_stats,
+                        surrogate_data):
+    """
+    Adds the rows of surrogate_predictions <surrogate_data>, of games that
+        weren't simulated, to the outputs of assemble_predictions
+    Their num sims are 0 and their sim error is the surrogate error. The
+        columns only simulations give are left empty and the players are
+        uncorrelated, with the projected DK pts var as their variance.
+    """
+    surrogate_data = surrogate_data.copy()
+    surrogate_data["num sims"] = 0
+    surrogate_data["sim error"] = surrogate_data["surrogate error"]
+    surrogate_data["custom pts per Dollar"] = -1
+    prediction_data = pd.concat(
+        [prediction_data,
+         surrogate_data.reindex(columns=prediction_data.columns)])
+
+    players = surrogate_data.drop_duplicates("MLB_ID")
+    for game_id, game_players in players.groupby("game_id"):
+        variances = dict(zip(game_players["MLB_ID"],
+                             game_players["DK pts var"]))
+        for pid in variances:
+            cov_dict[pid] = {other: variances[pid] if other == pid else 0.0
+                             for other in variances}
+
+    pitchers = players[players["DK posn orig"] == "P"]
+    pitcher_stats = pd.concat(
+        [pitcher_stats,
+         pd.DataFrame({"MLB_ID": pitchers["MLB_ID"],
+                       "dk_score": pitchers["DK pts pred"],
+                       "Name": pitchers["Name"],
+                       "DK posn": pitchers["DK posn orig"],
+                       "DK sal": pitchers["DK sal"],
+                       "pts per Dollar": (pitchers["DK pts pred"] /
+                                          pitchers["DK sal"])})],
+        ignore_index=True)
+    return prediction_data, cov_dict, pitcher_stats
+
+
+def shortlist_games(predictions, standard_errors, num_draws=DECISION_DRAWS,
+                    seed=None):
+    """
+    game_ids worth simulating: those of the optimal lineup for
+        <predictions> and those whose players enter it in decision_weights
+    """
+    weights = decision_weights(predictions, standard_errors, num_draws, seed)
+    lineup = predictions[predictions["MLB_ID"].isin(
+        optimal_lineup_ids(predictions))]
+    return (set(game_id for game_id, weight in weights.items() if weight > 0) |
+            set(lineup["game_id"]))
+
+
+def threshold_column(threshold):
+    return "P >= {}".format(threshold)
+
+
+def add_score_distribution(info, results, side, score_thresholds=()):
+    """
+    Adds the quantiles of the DK scores of <side>'s 9 batters and pitcher in
+        <results>, and their probabilities of reaching each threshold
+    """
+    quantiles = results['score_quantiles'][side]
+    for header in QUANTILE_HEADERS:
+        info[header] = quantiles[header].values[:10]
+    for threshold in score_thresholds:
+        info[threshold_column(threshold)] = results['score_sketches'][
+            side].exceedance(threshold)[:10]
+
+
 def prepare_player_data(year, date):
     """Loads in player_data for <date> and handles doubleheaders
 
@@ -150,10 +419,18 @@ def prepare_player_data(year, date):
 
 
 @utils.timing
-def optimize(year, date, num_lineups=3, num_simulations=1000, resimulate=True):
+def optimize(year, date, num_lineups=3, num_simulations=1000, resimulate=True,
+             engine="game", workers=1, seed=None, variance_reduction=None,
+             target_error=None, min_simulations=MIN_ITERATIONS,
+             simulation_budget=None, pilot_simulations=PILOT_ITERATIONS,
+             surrogate_file=None):
     """
     Collects player stats from <year> and uses to project scores on <date>
     Then optimizes over those scores using draftking rules
+    simulation_budget and pilot_simulations are as in build_predictions
+    surrogate_file is a pickled surrogate.SurrogateProjector for
+        build_predictions, created if it doesn't exist and saved with the
+        games simulated added
     Returns the top <num_lineups>, returns None if error
     """
     player_customizations = PlayerCustomizations()
@@ -170,10 +447,25 @@ def optimize(year, date, num_lineups=3, num_simulations=1000, resimulate=True):
     # otherwise don't rerun
     if resimulate or not os.path.isfile(player_prediction_file):
         data_handler = stat_loader.StatLoader(year, str(int(year) - 1), game_details)
+        surrogate = None
+        if surrogate_file is not None and os.path.isfile(surrogate_file):
+            with open(surrogate_file, "rb") as f:
+                surrogate = pickle.load(f)
+        elif surrogate_file is not None:
+            surrogate = SurrogateProjector(seed=seed)
+
         player_predictions, cov_dict, pitcher_stats = build_predictions(
             data_handler, player_data,
             date, num_simulations,
-            player_customizations)
+            player_customizations, engine, workers, seed,
+            variance_reduction=variance_reduction, target_error=target_error,
+            min_simulations=min_simulations,
+            simulation_budget=simulation_budget,
+            pilot_simulations=pilot_simulations, surrogate=surrogate)
+
+        if surrogate is not None:
+            with open(surrogate_file, "wb") as f:
+                pickle.dump(surrogate, f)
 
         pitcher_stats.to_csv("predicted_pitcherscores_{}_{}sims.csv".format(date, num_simulations))
 
@@ -372,13 +664,55 @@ if __name__ == '__main__':
                         type=int, help="number of times to simulate each game")
     parser.add_argument("--resimulate", nargs='?', default='true',
                         help="whether to resimulate the games")
+    parser.add_argument("--engine", nargs='?', default='game',
+                        choices=['game', 'batch', 'cached'],
+                        help="simulation engine: game by game, batched or "
+                             "from cached half innings")
+    parser.add_argument("--workers", nargs='?', default='1', type=int,
+                        help="number of processes to simulate games on")
+    parser.add_argument("--seed", nargs='?', default=None, type=int,
+                        help="random seed to make the simulations reproducible")
+    parser.add_argument("--variance_reduction", nargs='?', default=None,
+                        choices=['antithetic', 'stratified', 'control_variates'],
+                        help="variance reduction technique for the simulations")
+    parser.add_argument("--target_error", nargs='?', default=None, type=float,
+                        help="stop simulating a game once every player's DK "
+                             "pts standard error is below this")
+    parser.add_argument("--min_simulations", nargs='?', default=MIN_ITERATIONS,
+                        type=int, help="fewest simulations per game when "
+                                       "using --target_error")
+    parser.add_argument("--simulation_budget", nargs='?', default=None,
+                        type=int, help="total simulations for the slate, "
+                                       "spent where they change the lineup "
+                                       "most, instead of --num_simulations "
+                                       "per game")
+    parser.add_argument("--pilot_simulations", nargs='?',
+                        default=PILOT_ITERATIONS, type=int,
+                        help="simulations per game before spending the rest "
+                             "of --simulation_budget")
+    parser.add_argument("--surrogate_file", nargs='?', default=None,
+                        help="pickled surrogate projector to shortlist the "
+                             "games to simulate with and train")
 
     args = parser.parse_args()
 
     if args.resimulate.lower() == "true":
-        optimize(args.year, args.date, args.num_lineups, args.num_simulations)
+        optimize(args.year, args.date, args.num_lineups, args.num_simulations,
+                 engine=args.engine, workers=args.workers, seed=args.seed,
+                 variance_reduction=args.variance_reduction,
+                 target_error=args.target_error,
+                 min_simulations=args.min_simulations,
+                 simulation_budget=args.simulation_budget,
+                 pilot_simulations=args.pilot_simulations,
+                 surrogate_file=args.surrogate_file)
     elif args.resimulate.lower() == "false":
         optimize(args.year, args.date, args.num_lineups, args.num_simulations,
-                 resimulate=False)
+                 resimulate=False, engine=args.engine, workers=args.workers,
+                 seed=args.seed, variance_reduction=args.variance_reduction,
+                 target_error=args.target_error,
+                 min_simulations=args.min_simulations,
+                 simulation_budget=args.simulation_budget,
+                 pilot_simulations=args.pilot_simulations,
+                 surrogate_file=args.surrogate_file)
     else:
         print("ERROR in args.resimulate. Input was: ", args.resimulate.lower())
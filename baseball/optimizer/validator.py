@@ -5,7 +5,7 @@ from baseball.stats import stat_loader
 from baseball.stats import stats
 from .historical_game_details import HistoricalGameDetails
 
-from baseball.simulator.simulator import simulate
+from baseball.simulator.simulator import simulate, MIN_ITERATIONS
 from baseball.simulator import batting_rates_index as br
 
 import time
@@ -25,7 +25,8 @@ id_map = pd.read_csv(directory + "sfbb_playeridmap.csv", dtype="str")
 id_map = id_map[["MLBID", "PLAYERNAME"]]
 
 
-def _get_prediction_errors(year, data_handler, num_simulations):
+def _get_prediction_errors(year, data_handler, num_simulations,
+                           target_error=None, min_simulations=MIN_ITERATIONS):
     """
     Get predictions and save it to a csv file
     """
@@ -33,7 +34,8 @@ def _get_prediction_errors(year, data_handler, num_simulations):
 
     # errors is the list that keeps all the statistics for the csv file
     errors = [["home", "away", "home_score", "away_score", "prob_home_win",
-               "pred_home_score", "pred_away_score"]]
+               "pred_home_score", "pred_away_score", "num_simulations",
+               "sim_error"]]
 
     pred_playerstats = None
     pred_pitcherstats = None
@@ -49,7 +51,9 @@ def _get_prediction_errors(year, data_handler, num_simulations):
         iteration += 1
 
         results = simulate(teams_info['home_team'],
-                           teams_info['away_team'], num_simulations)
+                           teams_info['away_team'], num_simulations,
+                           target_error=target_error,
+                           min_iterations=min_simulations)
         predictions = results['avg_results']
         prob_home_win = predictions['prob_home_win']
 
@@ -62,7 +66,8 @@ def _get_prediction_errors(year, data_handler, num_simulations):
         data = [game_result['home_team_id'], game_result['away_team_id'],
                 game_result['home_team_runs'], game_result['away_team_runs'],
                 prob_home_win,
-                predictions['home_score'], predictions['away_score']]
+                predictions['home_score'], predictions['away_score'],
+                results['num_iterations'], results['standard_error']]
         errors.append(data)
 
     output_file = "simulation_error%s_%s.csv" % (year, num_simulations)
@@ -205,10 +210,12 @@ def pred_obs_stat_corr(stat_dict):
     print("\ngame stat correlations:\n", stat_corrs)
 
 
-def simulate_year(year, num_simulations, train_on_test='false'):
+def simulate_year(year, num_simulations, train_on_test='false',
+                  target_error=None, min_simulations=MIN_ITERATIONS):
     """
     Simulates the <year> season
-    Each game is simulated <num_simulations> times
+    Each game is simulated <num_simulations> times, or fewer if <target_error>
+        is reached first
     Predictions are written to simulation_error<year>_<num_simulations>.csv
     """
     if train_on_test.lower() == 'false':
@@ -217,7 +224,8 @@ def simulate_year(year, num_simulations, train_on_test='false'):
         train_year = str(year)
     game_details = HistoricalGameDetails(year)
     data_handler = stat_loader.StatLoader(year, train_year, game_details)
-    _get_prediction_errors(year, data_handler, num_simulations)
+    _get_prediction_errors(year, data_handler, num_simulations, target_error,
+                           min_simulations)
 
 
 def main():
@@ -228,9 +236,16 @@ def main():
                         help="number of times to simulate each game")
     parser.add_argument("--train_on_test", nargs='?', default='false',
                         help="train and test on same year")
+    parser.add_argument("--target_error", nargs='?', default=None, type=float,
+                        help="stop simulating a game once every player's DK "
+                             "pts standard error is below this")
+    parser.add_argument("--min_simulations", nargs='?', default=MIN_ITERATIONS,
+                        type=int, help="fewest simulations per game when "
+                                       "using --target_error")
     args = parser.parse_args()
 
-    return simulate_year(args.year, args.num_simulations, args.train_on_test)
+    return simulate_year(args.year, args.num_simulations, args.train_on_test,
+                         args.target_error, args.min_simulations)
 
 if __name__ == "__main__":
     results = main()
@@ -1,6 +1,6 @@
 import pandas as pd
+import numpy as np
 import math
-import random
 import os
 
 from baseball.simulator import utils
@@ -8,6 +8,9 @@ from baseball.simulator import utils
 
 logger = utils.setup_logger('sb_logger', 'logs/sb.log')
 
+# StolenBases model shared by every game simulated in this process
+_shared_model = None
+
 
 # Converts the logodds into a propbability
 def logodds_to_prob(x):
@@ -16,9 +19,10 @@ def logodds_to_prob(x):
 
 
 # Determines whether a random event occurs with porbability = prob_occur
-def sucess_or_failure(prob_occur):
+# rng is the RandomState to draw from so seeded simulations stay reproducible
+def sucess_or_failure(prob_occur, rng=np.random):
 
-    if random.random() < prob_occur:
+    if rng.random_sample() < prob_occur:
         return True
     else:
         return False
@@ -34,12 +38,24 @@ def createDict(csv_name):
     return reader_dict
 
 
+def shared_stolen_bases():
+    """
+    Returns a StolenBases model that is only loaded once per process
+    Safe to share since its effects are only read while simulating, the
+        unknown pids it logs are kept in its own logged set
+    """
+    global _shared_model
+    if _shared_model is None:
+        _shared_model = StolenBases()
+    return _shared_model
+
+
 class StolenBases:
     def __init__(self):
 
         file_path = os.path.dirname(os.path.abspath(__file__)) + '/../../fixtures/'
-        # TODO: looking in sb.log this is loaded once for each game when using
-        # optimizer. Turn this into singleton to be faster?
+        # NOTE: the game engines use shared_stolen_bases so this is only
+        # loaded once per process
         logger.info("Initializing from path: %s" % file_path)
 
         # fixef dictionaries contain the values of each of the fixed effects
@@ -61,6 +77,9 @@ class StolenBases:
                          "pitcher": success_pitcher,
                          "catcher": success_catcher}
         self.ranef = {"attempt": attempt_ranef, "success": success_ranef}
+        # (steal_phase, position, pid) of the pids without a random effect
+        #   that were already logged
+        self.logged = set()
 
     def calc_prob_sb(self, sb_info, steal_phase):
 
@@ -103,10 +122,10 @@ class StolenBases:
                 random_effects += ranef_dict[position][pid]
             elif position == "runner" and steal_phase == "success":
                 random_effects += 0
-            else:
+            elif (steal_phase, position, pid) not in self.logged:
                 logger.info("SB {} error! + {} ={}".format(steal_phase,
                                                            position, pid))
-                ranef_dict[position][pid] = 0.0  # so it only logs once
+                self.logged.add((steal_phase, position, pid))
 
         return random_effects
 
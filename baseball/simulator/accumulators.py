@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Mergeable accumulators for simulation results.
+Every accumulator only keeps sums or moments so that partial results
+    computed on different workers (or in different chunks) merge exactly
+    into what a single serial run would have produced.
+"""
+
+import numpy as np
+
+from . import stat_index as st
+from .pitcher import Pitcher
+
+
+# Columns of the per iteration DK score rows. Each row holds the 9 batters,
+#   their own pitcher and then the opposing pitcher
+DK_SCORE_HEADERS = ["p1", "p2", "p3", "p4", "p5", "p6", "p7", "p8", "p9",
+                    "pitcher"]
+NUM_DK_SCORES = 11
+
+# Columns of the score histograms: the 9 batters, their own pitcher and then
+#   the team total of the batters
+SKETCH_HEADERS = DK_SCORE_HEADERS + ["team"]
+# DK scores are multiples of 0.05 so bins of 0.5 points keep quantiles within
+#   half a point with a fixed memory of a few kB per team
+SKETCH_BIN_WIDTH = 0.5
+SKETCH_MIN_SCORE = -30.0
+SKETCH_MAX_SCORE = 300.0
+QUANTILES = (0.1, 0.5, 0.9)
+QUANTILE_HEADERS = ("P10", "P50", "P90")
+# Rows added one at a time are binned together once this many scores are
+#   pending, numpy's overhead would dominate binning them one by one
+SKETCH_FLUSH_SIZE = 11000
+
+
+class CoMoments:
+    """
+    Streaming mean and covariance of vectors of scores (Welford's algorithm)
+    Only keeps the count, the mean and the matrix of summed co-moments
+        about the mean, so memory doesn't grow with the number of iterations.
+    Partial moments from different chunks merge exactly with +=
+        (Chan et al's pairwise update)
+    """
+    def __init__(self, size=NUM_DK_SCORES):
+        self.count = 0
+        self.means = np.zeros(size)
+        self.comoments = np.zeros((size, size))
+
+    def __add__(self, other):
+        """
+        Merges other's moments into self
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.means - self.means
+        self.comoments += (other.comoments +
+                           np.outer(delta, delta)*self.count*other.count/count)
+        self.means += delta*other.count/count
+        self.count = count
+        return self
+
+    def add(self, scores):
+        scores = np.asarray(scores, dtype=float)
+        self.count += 1
+        delta = scores - self.means
+        self.means += delta/self.count
+        self.comoments += np.outer(delta, scores - self.means)
+
+    def add_rows(self, scores):
+        """
+        scores is a 2d array with one row per iteration
+        """
+        batch = CoMoments(scores.shape[1])
+        batch.count = scores.shape[0]
+        batch.means = scores.mean(axis=0)
+        centered = scores - batch.means
+        batch.comoments = np.dot(centered.T, centered)
+        self += batch
+
+    def mean(self):
+        return self.means
+
+    def cov(self):
+        """
+        Sample covariance matrix, same normalization as np.cov
+        """
+        return self.comoments/(self.count - 1)
+
+
+class ScoreHistogram:
+    """
+    Fixed bin histograms of several columns of scores, e.g. every player of
+        a team, to stream quantiles and exceedance probabilities from.
+    Scores outside [low, high) are counted in the first or last bin. Counts
+        of histograms with the same bins merge exactly with +=
+    Rows added one at a time are held in pending until flush
+    """
+    def __init__(self, size=len(SKETCH_HEADERS), low=SKETCH_MIN_SCORE,
+                 high=SKETCH_MAX_SCORE, width=SKETCH_BIN_WIDTH):
+        self.low = low
+        self.width = width
+        self.num_bins = int(round((high - low)/width))
+        self.counts = np.zeros((size, self.num_bins), dtype=np.int64)
+        self.pending = []
+
+    def __add__(self, other):
+        """
+        Merges other's counts into self
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        self.flush()
+        other.flush()
+        self.counts += other.counts
+        return self
+
+    def add(self, scores):
+        """
+        scores has one score per histogram
+        """
+        self.pending.extend(scores)
+        if len(self.pending) >= SKETCH_FLUSH_SIZE:
+            self.flush()
+
+    def add_rows(self, scores):
+        """
+        scores is a 2d array with one row per iteration and one column per
+            histogram
+        """
+        bins = np.clip(((scores - self.low)/self.width).astype(int),
+                       0, self.num_bins - 1)
+        bins += np.arange(scores.shape[1])*self.num_bins
+        self.counts += np.bincount(bins.ravel(),
+                                   minlength=self.counts.size).reshape(
+                                       self.counts.shape)
+
+    def flush(self):
+        if self.pending:
+            pending = np.array(self.pending, dtype=float)
+            self.pending = []
+            self.add_rows(pending.reshape(-1, len(self.counts)))
+
+    def count(self):
+        self.flush()
+        return self.counts[0].sum()
+
+    def edges(self):
+        return self.low + self.width*np.arange(self.num_bins + 1)
+
+    def cdfs(self):
+        """
+        Returns the fraction of each column's scores below every bin edge
+        """
+        self.flush()
+        cdfs = np.cumsum(self.counts, axis=1)/float(self.counts[0].sum())
+        return np.hstack((np.zeros((len(cdfs), 1)), cdfs))
+
+    def quantiles(self, probs=QUANTILES):
+        """
+        Returns an array with the <probs> quantiles of every column: the
+            lower edge of the first bin the CDF reaches the probability in.
+            DK scores are discrete, so interpolating within a bin would give
+            scores that can't happen, e.g. a P50 of 0.4 for a batter held
+            scoreless in most games.
+        """
+        cdfs = self.cdfs()
+        edges = self.edges()
+        quantiles = np.zeros((len(self.counts), len(probs)))
+        for i, cdf in enumerate(cdfs):
+            bins = np.searchsorted(cdf[1:], probs)
+            quantiles[i] = edges[np.minimum(bins, self.num_bins - 1)]
+        return quantiles
+
+    def exceedance(self, threshold):
+        """
+        Returns the probability of every column scoring at least <threshold>,
+            exact when <threshold> is on a bin edge
+        """
+        cdfs = self.cdfs()
+        edges = self.edges()
+        return np.array([1 - np.interp(threshold, edges, cdf)
+                         for cdf in cdfs])
+
+
+def sketch_scores(scores):
+    """
+    Returns the columns of SKETCH_HEADERS from a 2d array of DK score rows
+    """
+    return np.column_stack((scores[:, :10], scores[:, :9].sum(axis=1)))
+
+
+def empty_pitcher_totals(starter):
+    """
+    Returns a zeroed Pitcher with <starter>'s info to accumulate stats into
+    """
+    return Pitcher(role=starter.role, pid=starter.pid, hand=starter.hand)
+
+
+class SimulationTotals:
+    """
+    Running totals of simulated games between the same two teams
+    boxscore is in the same format as Game.get_boxscore with a DK pts column
+        after the player stats, except every entry is a sum over games
+    The per iteration DK score rows are only stored if <keep_dk_scores>,
+        their distributions are always kept in the home_sketch and
+        away_sketch ScoreHistograms
+    ties counts the games still tied when they ended after 20 innings
+    variance is the variance.VarianceTotals of the run, if any
+    site_points sums the points of the 9 batters and the pitcher of each team
+        under each rule set in <site_names>
+    engine_stats is the instrumentation.EngineStats of the run, if any
+    pa_record is the reweighting.PlateAppearanceRecord of the run, if any
+    """
+    def __init__(self, home_starter, away_starter, keep_dk_scores=False,
+                 variance=None, site_names=()):
+        self.num_iterations = 0
+        self.ties = 0
+        self.boxscore = [np.zeros((9, st.NUM_STATS + 1)),
+                         np.zeros((9, st.NUM_STATS + 1)),
+                         empty_pitcher_totals(home_starter),
+                         empty_pitcher_totals(away_starter),
+                         0, 0, 0, np.zeros(8), np.zeros(8)]
+        self.home_moments = CoMoments()
+        self.away_moments = CoMoments()
+        self.home_sketch = ScoreHistogram()
+        self.away_sketch = ScoreHistogram()
+        self.keep_dk_scores = keep_dk_scores
+        self.variance = variance
+        self.home_dk_scores = []
+        self.away_dk_scores = []
+        self.site_names = tuple(site_names)
+        self.site_points = [np.zeros((NUM_DK_SCORES - 1, len(site_names))),
+                            np.zeros((NUM_DK_SCORES - 1, len(site_names)))]
+        self.engine_stats = None
+        self.pa_record = None
+
+    def __add__(self, other):
+        """
+        Merges the totals of other into self
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        self.num_iterations += other.num_iterations
+        self.ties += other.ties
+        for i in range(len(self.boxscore)):
+            self.boxscore[i] += other.boxscore[i]
+        self.home_moments += other.home_moments
+        self.away_moments += other.away_moments
+        self.home_sketch += other.home_sketch
+        self.away_sketch += other.away_sketch
+        if self.variance is not None:
+            self.variance += other.variance
+        self.home_dk_scores.extend(other.home_dk_scores)
+        self.away_dk_scores.extend(other.away_dk_scores)
+        self.site_points[0] += other.site_points[0]
+        self.site_points[1] += other.site_points[1]
+        if self.engine_stats is not None:
+            self.engine_stats += other.engine_stats
+        if self.pa_record is not None:
+            self.pa_record += other.pa_record
+        return self
+
+    def add_game(self, boxscore, home_scores, away_scores):
+        """
+        boxscore is a single game's boxscore from Game.get_boxscore
+        home_scores and away_scores are that game's DK score rows, the
+            batters' scores are added to the DK pts column
+        """
+        self.num_iterations += 1
+        self.boxscore[0][:, :st.NUM_STATS] += boxscore[0]
+        self.boxscore[0][:, st.NUM_STATS] += home_scores[:9]
+        self.boxscore[1][:, :st.NUM_STATS] += boxscore[1]
+        self.boxscore[1][:, st.NUM_STATS] += away_scores[:9]
+        for i in range(2, len(self.boxscore)):
+            self.boxscore[i] += boxscore[i]
+        self.ties += int(boxscore[4] == boxscore[5])
+        self.home_moments.add(home_scores)
+        self.away_moments.add(away_scores)
+        self.home_sketch.add(home_scores[:10] + [sum(home_scores[:9])])
+        self.away_sketch.add(away_scores[:10] + [sum(away_scores[:9])])
+        if self.keep_dk_scores:
+            self.home_dk_scores.append(home_scores)
+            self.away_dk_scores.append(away_scores)
+
+    def add_batch(self, results, home_scores, away_scores):
+        """
+        results is the output of BatchGame.simulate_games
+        home_scores and away_scores hold one DK score row per game
+        """
+        self.num_iterations += len(home_scores)
+        self.boxscore[0][:, :st.NUM_STATS] += results['home_playerstats'].sum(
+            axis=0)
+        self.boxscore[0][:, st.NUM_STATS] += home_scores[:, :9].sum(axis=0)
+        self.boxscore[1][:, :st.NUM_STATS] += results['away_playerstats'].sum(
+            axis=0)
+        self.boxscore[1][:, st.NUM_STATS] += away_scores[:, :9].sum(axis=0)
+        add_batch_pitcher_totals(self.boxscore[2], results['home_pitcher'])
+        add_batch_pitcher_totals(self.boxscore[3], results['away_pitcher'])
+        self.boxscore[4] += results['home_score'].sum()
+        self.boxscore[5] += results['away_score'].sum()
+        home_score, away_score = results['home_score'], results['away_score']
+        self.boxscore[6] += (home_score > away_score).sum()
+        self.ties += int((home_score == away_score).sum())
+        self.boxscore[7] += results['pre_state_counts']
+        self.boxscore[8] += results['post_state_counts']
+
+        self.home_moments.add_rows(home_scores)
+        self.away_moments.add_rows(away_scores)
+        self.home_sketch.add_rows(sketch_scores(home_scores))
+        self.away_sketch.add_rows(sketch_scores(away_scores))
+        if self.keep_dk_scores:
+            self.home_dk_scores.extend(home_scores.tolist())
+            self.away_dk_scores.extend(away_scores.tolist())
+
+    def add_site_points(self, home_points, away_points):
+        """
+        The points of a game, or a batch of games stacked along the first
+            axis, with a row per player and a column per site
+        """
+        for totals, points in zip(self.site_points,
+                                  (home_points, away_points)):
+            totals += points.reshape((-1,) + totals.shape).sum(axis=0)
+
+
+def add_batch_pitcher_totals(pitcher, batch_stats):
+    """
+    Adds the per game starter stats from BatchGame into <pitcher>
+    """
+    for key in pitcher.stats:
+        pitcher.stats[key] += batch_stats[key].sum()
+    pitcher.num_pitches += batch_stats['num_pitches'].sum()
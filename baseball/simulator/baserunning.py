@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Baserunning transition tables shared by Game, BatchGame and markov.
+advances[event][base_state][outs] is a list of (probability, destinations)
+    for each way a play can unfold. destinations gives where the
+    (batter, first, second, third) end up: NOT_ON_BASE, a base 1-3 or
+    HOME_PLATE. Destinations of empty bases are ignored and the batter
+    takes no part in a steal.
+A runner sent to NOT_ON_BASE is out, so the table also decides the outs made.
+The default rules are the ones Game has always played by. Another
+    advancement model, e.g. one derived from retrosheet, is just a csv
+    loaded with load_advances.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from . import batting_rates_index as br
+from .sampling import sample_cdf
+
+
+NOT_ON_BASE = 0
+HOME_PLATE = 4
+
+NUM_BASE_STATES = 8
+NUM_OUTS = 3
+
+# Steal attempts of the lead runner are looked up after the batting events
+SB = br.NUM_RATES
+CS = br.NUM_RATES + 1
+EVENTS = br.batting_events + ("SB", "CS")
+
+ADVANCES_CSV_COLUMNS = ("event", "base_state", "outs", "probability",
+                        "batter", "first", "second", "third")
+
+
+def default_outcomes(event, base_state):
+    """
+    The (probability, destinations) outcomes of <event> in <base_state>
+    Mirrors the original handle_single, handle_double, handle_force_advance,
+        advance_home, advance_sb_success and advance_sb_failure of Game
+    """
+    on_first = base_state & 1
+    on_second = base_state & 2
+    on_third = base_state & 4
+    if event == "HR":
+        return [(1.0, (4, 4, 4, 4))]
+    elif event == "TRIPLE":
+        return [(1.0, (3, 4, 4, 4))]
+    elif event == "DOUBLE":
+        return [(.5, (2, 4, 4, 4)), (.5, (2, 3, 4, 4))]
+    elif event == "SINGLE":
+        if not on_second:
+            return [(.5, (1, 3, 2, 4)), (.5, (1, 2, 2, 4))]
+        elif not on_first:
+            return [(.5, (1, 1, 4, 4)), (.5, (1, 1, 3, 4))]
+        elif not on_third:
+            return [(.5, (1, 2, 3, 3)), (1/6.0, (1, 2, 4, 4)),
+                    (1/3.0, (1, 3, 4, 4))]
+        else:
+            return [(.5, (1, 3, 4, 4)), (.5, (1, 2, 3, 4))]
+    elif event in ("BB", "HBP"):
+        first = 2 if on_first else 1
+        second = 3 if on_first and on_second else 2
+        third = 4 if on_first and on_second and on_third else 3
+        return [(1.0, (1, first, second, third))]
+    elif event in ("SO", "OUT"):
+        return [(1.0, (NOT_ON_BASE, 1, 2, 3))]
+    elif event == "SB":
+        # The runners on first and second go, a runner on third holds
+        if base_state in (1, 5):
+            return [(1.0, (NOT_ON_BASE, 2, 2, 3))]
+        elif base_state == 2:
+            return [(1.0, (NOT_ON_BASE, 1, 3, 3))]
+        elif base_state == 3:
+            return [(1.0, (NOT_ON_BASE, 2, 3, 3))]
+    elif event == "CS":
+        # The lead runner is thrown out. When runners are on 1st and 2nd,
+        #   assumes the runner on first still makes it to second
+        if base_state in (1, 5):
+            return [(1.0, (NOT_ON_BASE, NOT_ON_BASE, 2, 3))]
+        elif base_state == 2:
+            return [(1.0, (NOT_ON_BASE, 1, NOT_ON_BASE, 3))]
+        elif base_state == 3:
+            return [(1.0, (NOT_ON_BASE, 2, NOT_ON_BASE, 3))]
+    else:
+        raise ValueError("That is not a valid event! " + str(event))
+    # No steal is attempted from the other base states
+    return [(1.0, (NOT_ON_BASE, 1, 2, 3))]
+
+
+def default_advances():
+    return [[[default_outcomes(event, base_state) for outs in range(NUM_OUTS)]
+             for base_state in range(NUM_BASE_STATES)]
+            for event in EVENTS]
+
+
+def load_advances(csv_path, advances=None):
+    """
+    Reads an advancement model from a csv with ADVANCES_CSV_COLUMNS, one row
+        per outcome. Events are named as in EVENTS and destinations use
+        NOT_ON_BASE, 1-3 and HOME_PLATE.
+    The rows of each (event, base_state, outs) replace its outcomes in
+        <advances> (the default rules if None) and are normalized to sum to 1
+    """
+    if advances is None:
+        advances = default_advances()
+    rows = pd.read_csv(csv_path)
+    missing = set(ADVANCES_CSV_COLUMNS) - set(rows.columns)
+    if missing:
+        raise ValueError("Advances csv is missing columns: " +
+                         ", ".join(sorted(missing)))
+
+    for (event, base_state, outs), group in rows.groupby(["event",
+                                                           "base_state",
+                                                           "outs"]):
+        if event not in EVENTS:
+            raise ValueError("That is not a valid event! " + str(event))
+        total = group.probability.sum()
+        advances[EVENTS.index(event)][int(base_state)][int(outs)] = [
+            (row.probability/total,
+             (int(row.batter), int(row.first), int(row.second),
+              int(row.third)))
+            for row in group.itertuples()]
+    return advances
+
+
+class TransitionTable:
+    """
+    advances compiled for one lookup per event
+    entries[event][base_state][outs] is a list of
+        (probability, destinations, next_base_state, runs, outs_made)
+    plays[event][base_state][outs] is (cdf, [(moves, outs_made), ...]) for
+        Game, where moves are the (origin, destination) of every batter or
+        runner who changes base, lead runner first so they can be applied
+        in place
+    The same outcomes are packed into arrays indexed by
+        [event, base_state, outs, outcome] for the vectorized engine,
+        padded with a cumulative probability of 1
+    random_steals is whether any steal has more than one outcome, if not
+        steals don't need a uniform drawn
+    """
+    def __init__(self, advances=None):
+        if advances is None:
+            advances = default_advances()
+        self.entries = []
+        self.cdfs = []
+        self.plays = []
+        for event, per_state in enumerate(advances):
+            event_entries = []
+            event_cdfs = []
+            event_plays = []
+            for base_state, per_outs in enumerate(per_state):
+                state_entries = []
+                state_cdfs = []
+                state_plays = []
+                for outs, outcomes in enumerate(per_outs):
+                    entries = [compile_outcome(event, base_state, outs,
+                                               prob, dests)
+                               for prob, dests in outcomes]
+                    cdf = np.cumsum([entry[0] for entry in entries]).tolist()
+                    cdf[-1] = 1.0
+                    state_entries.append(entries)
+                    state_cdfs.append(cdf)
+                    state_plays.append((cdf, [
+                        (occupied_moves(event, base_state, entry[1]),
+                         entry[4]) for entry in entries]))
+                event_entries.append(state_entries)
+                event_cdfs.append(state_cdfs)
+                event_plays.append(state_plays)
+            self.entries.append(event_entries)
+            self.cdfs.append(event_cdfs)
+            self.plays.append(event_plays)
+        self.compile_arrays()
+        self.random_steals = bool((self.cum_probs[[SB, CS], ..., 0] < 1).any())
+
+    def compile_arrays(self):
+        max_outcomes = max(len(entries) for per_state in self.entries
+                           for per_outs in per_state for entries in per_outs)
+        shape = (len(EVENTS), NUM_BASE_STATES, NUM_OUTS, max_outcomes)
+        self.cum_probs = np.ones(shape)
+        self.dests = np.zeros(shape + (4,), dtype=np.int8)
+        self.runs = np.zeros(shape, dtype=int)
+        self.outs_made = np.zeros(shape, dtype=int)
+        for event, per_state in enumerate(self.entries):
+            for base_state, per_outs in enumerate(per_state):
+                for outs, entries in enumerate(per_outs):
+                    index = (event, base_state, outs)
+                    self.cum_probs[index][:len(entries)] = (
+                        self.cdfs[event][base_state][outs])
+                    for k in range(max_outcomes):
+                        _, dests, _, runs, outs_made = entries[
+                            min(k, len(entries) - 1)]
+                        self.dests[index][k] = dests
+                        self.runs[index][k] = runs
+                        self.outs_made[index][k] = outs_made
+
+    def sample_play(self, event, base_state, outs, uniforms):
+        """
+        Returns the (moves, outs_made) of a random outcome of <event>, only
+            draws from the UniformBuffer <uniforms> when there is more than one
+        """
+        cdf, outcomes = self.plays[event][base_state][outs]
+        if len(cdf) == 1:
+            return outcomes[0]
+        return outcomes[bisect_left(cdf, uniforms.next())]
+
+    def sample_many(self, events, base_states, outs, uniforms):
+        """
+        Vectorized sample with one uniform per play
+        """
+        return sample_cdf(self.cum_probs[events, base_states, outs], uniforms)
+
+
+def occupied_bases(event, base_state):
+    """
+    Whether the batter and each base take part in a play
+    """
+    return (event < SB, base_state & 1, base_state & 2, base_state & 4)
+
+
+def occupied_moves(event, base_state, dests):
+    occupied = occupied_bases(event, base_state)
+    moves = [(origin, dest) for origin, dest in enumerate(dests)
+             if occupied[origin] and dest != origin]
+    return tuple(reversed(moves))
+
+
+def compile_outcome(event, base_state, outs, prob, dests):
+    occupied = occupied_bases(event, base_state)
+    next_base_state = 0
+    runs = 0
+    outs_made = 0
+    for origin, dest in enumerate(dests):
+        if not occupied[origin]:
+            continue
+        if dest == NOT_ON_BASE:
+            outs_made += 1
+        elif dest == HOME_PLATE:
+            runs += 1
+        else:
+            next_base_state |= 1 << (dest - 1)
+    if outs + outs_made > NUM_OUTS:
+        raise ValueError("{} with {} outs in base state {} makes too many "
+                         "outs".format(EVENTS[event], outs, base_state))
+    return (prob, tuple(dests), next_base_state, runs, outs_made)
+
+
+DEFAULT_TRANSITIONS = TransitionTable()
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+import numpy as np
+
+from . import stat_index as st
+from . import batting_rates_index as br
+from .game import sb_info_dict, PITCH_COUNT_PMFS
+from .sampling import compile_cdf, sample_cdf
+from .player import SP_RATES, RP_RATES, PINCH_RATES, NUM_RATE_MODES
+from .pitcher import (PITCHER_STATS, scored_stats_array,
+                      DK_multiplier as pitcher_DK_multiplier)
+from .variance import coupled_pa_draws, PA_DRAWS_PER_BATTER
+from .baserunning import (DEFAULT_TRANSITIONS, NOT_ON_BASE, HOME_PLATE, SB,
+                          CS)
+
+from baseball.sbModel.stolen_bases import shared_stolen_bases
+
+
+HOME = 0
+AWAY = 1
+
+STARTER = 0
+RELIEVER = 1
+
+EMPTY = -1
+
+SB_OPPORTUNITIES = (1, 2, 3, 5)
+
+# Stat credited to the batter for each batting event
+BATTER_STAT = np.array([st.SINGLE, st.DOUBLE, st.TRIPLE, st.HR,
+                        st.BB, st.HBP, st.OUT, st.OUT])
+
+
+def _pitch_count_cdfs():
+    """
+    Cumulative pitch count distributions indexed by batting event
+    """
+    length = max(len(pmf) for pmf in PITCH_COUNT_PMFS.values())
+    cdfs = np.ones((br.NUM_RATES, length))
+    for event_index, event in enumerate(br.batting_events):
+        pmf = PITCH_COUNT_PMFS[event]
+        cdfs[event_index, :len(pmf)] = compile_cdf(pmf)
+    return cdfs
+
+
+PITCH_COUNT_CDFS = _pitch_count_cdfs()
+
+
+def pull_due(hits, earned_runs, ip, pitches, pitch_limit):
+    """
+    Game.pitcher_pull_due for arrays of starter stats
+    """
+    stay_in = (hits == 0) | ((earned_runs == 0) &
+                             (pitches < pitch_limit + 20))
+    sub_out = (((ip < 4) & (earned_runs > 4)) |
+               ((4 <= ip) & (ip < 5) & (earned_runs > 5)) |
+               ((ip >= 5) & (earned_runs > 6)) |
+               (pitches >= pitch_limit))
+    return sub_out & ~stay_in
+
+
+class BatchGame:
+    """
+    Plays many copies of the same matchup in lock-step.
+    All of the game state lives in numpy arrays indexed by [side, game] and
+        every still active game gets its next plate appearance sampled in one
+        vectorized step.
+    Follows the same rules as Game. Only starter stats are tracked since they
+        are all that get reported in the boxscore.
+    rng is the RandomState to draw from, defaults to numpy's global state
+    variance_reduction couples the plate appearance draws of consecutive
+        games, see variance.coupled_uniforms
+    transitions is the baserunning.TransitionTable the runners move by
+    """
+    def __init__(self, home_team, away_team, rng=None,
+                 variance_reduction=None, transitions=None):
+        self.rng = np.random if rng is None else rng
+        self.transitions = transitions or DEFAULT_TRANSITIONS
+        self.coupled_draws = variance_reduction in ("antithetic", "stratified")
+        self.variance_reduction = variance_reduction
+        self.home_team = home_team
+        self.away_team = away_team
+        self.teams = (home_team, away_team)
+
+        self.sb = shared_stolen_bases()
+
+        self.rate_cdfs = np.zeros((2, NUM_RATE_MODES, 9, br.NUM_RATES))
+        # Expected DK points of the batting event for each set of rates
+        self.rate_expected_pts = np.zeros((2, NUM_RATE_MODES, 9))
+        self.pitcher_batting_pos = np.full(2, EMPTY, dtype=int)
+        self.pitch_limits = np.zeros(2)
+        for side, team in enumerate(self.teams):
+            # team.rates is indexed by [slot, event, mode]
+            rates = team.rates.transpose((2, 0, 1))
+            for mode in range(NUM_RATE_MODES):
+                for slot in range(9):
+                    self.rate_cdfs[side, mode, slot] = compile_cdf(
+                        rates[mode, slot])
+            self.rate_expected_pts[side] = np.dot(rates, br.DK_points)
+            if team.starter.batting_pos is not None:
+                self.pitcher_batting_pos[side] = team.starter.batting_pos
+            self.pitch_limits[side] = team.starter.get_pitch_limit()
+
+        self.attempt_probs, self.success_probs = self.steal_tables()
+
+    def steal_tables(self):
+        """
+        Precomputes the SB model probabilities for every situation that
+            can come up in this matchup.
+        Indexed by [batting side, pitcher role, runner slot, base_state, outs]
+        """
+        shape = (2, 2, 9, 8, 3)
+        attempt_probs = np.zeros(shape)
+        success_probs = np.zeros(shape)
+        for side, batting_team in enumerate(self.teams):
+            fielding_team = self.teams[1 - side]
+            pitchers = (fielding_team.starter, fielding_team.reliever)
+            for role, pitcher in enumerate(pitchers):
+                for slot, runner in enumerate(batting_team.lineup):
+                    for base_state in SB_OPPORTUNITIES:
+                        for outs in range(3):
+                            sb_info = sb_info_dict(base_state, outs, pitcher,
+                                                   fielding_team.catcher,
+                                                   batting_team.team_id,
+                                                   runner)
+                            index = (side, role, slot, base_state, outs)
+                            attempt_probs[index] = self.sb.calc_prob_sb(
+                                sb_info, "attempt")
+                            success_probs[index] = self.sb.calc_prob_sb(
+                                sb_info, "success")
+        return attempt_probs, success_probs
+
+    def reset_state(self, num_games):
+        n = num_games
+        self.num_games = n
+        self.active = np.ones(n, dtype=bool)
+
+        self.batting = np.full(n, AWAY, dtype=int)
+        self.inning_num = np.ones(n, dtype=int)
+        self.outs = np.zeros(n, dtype=int)
+        self.score = np.zeros((2, n), dtype=int)
+        self.at_bat_index = np.zeros((2, n), dtype=int)
+
+        # Lineup slot of the runner on each base and the pitcher role
+        #   responsible for him
+        self.bases = np.full((3, n), EMPTY, dtype=int)
+        self.resp = np.zeros((3, n), dtype=int)
+
+        self.reliever_in = np.zeros((2, n), dtype=bool)
+        self.meets_win_requirements = np.zeros((2, n), dtype=bool)
+
+        self.player_stats = np.zeros((2, n, 9, st.NUM_STATS))
+        self.expected_pts = np.zeros((2, n, 9))
+        self.plate_appearances = np.zeros((2, n, 9), dtype=int)
+        if self.coupled_draws:
+            self.coupled_pa_draws = coupled_pa_draws(
+                self.rng, self.variance_reduction, n)
+        self.starter_stats = {key: np.zeros((2, n)) for key in PITCHER_STATS}
+        self.starter_outs = np.zeros((2, n), dtype=int)
+        self.starter_pitches = np.zeros((2, n))
+
+        self.pre_state_counts = np.zeros(8)
+        self.post_state_counts = np.zeros(8)
+
+    def simulate_games(self, num_games):
+        """
+        Simulates <num_games> games in lock-step
+        Returns a dictionary of per game results:
+            home/away_playerstats: (num_games, 9, NUM_STATS)
+            home/away_expected_pts: (num_games, 9) summed expected DK points
+                of each batter's plate appearances
+            home/away_pitcher: dict of starter stats, each of size num_games
+            home/away_score: (num_games, )
+            pre/post_state_counts: summed over all games
+        """
+        self.reset_state(num_games)
+
+        games = np.arange(num_games)
+        while len(games) > 0:
+            self.handle_pitcher_sub(games)
+            np.add.at(self.pre_state_counts, self.base_state(games), 1)
+            games = self.handle_steals(games)
+            self.handle_plate_appearance(games)
+            games = np.flatnonzero(self.active)
+
+        self.handle_end_stats()
+        return self.get_results()
+
+    def base_state(self, games):
+        return ((self.bases[0, games] != EMPTY) +
+                2*(self.bases[1, games] != EMPTY) +
+                4*(self.bases[2, games] != EMPTY))
+
+    def pitcher_role(self, fielding, games):
+        return self.reliever_in[fielding, games].astype(int)
+
+    def credit_starter(self, fielding, games, stat, increment=1):
+        """
+        Credits <stat> to the fielding pitcher if he is still the starter
+        """
+        starter_in = ~self.reliever_in[fielding, games]
+        self.starter_stats[stat][fielding[starter_in],
+                                 games[starter_in]] += increment
+
+    def credit_out(self, fielding, games, outs=1):
+        self.outs[games] += outs
+        starter_in = ~self.reliever_in[fielding, games]
+        if not np.isscalar(outs):
+            outs = outs[starter_in]
+        self.starter_outs[fielding[starter_in], games[starter_in]] += outs
+
+    def credit_pitches(self, fielding, games, num_pitches):
+        starter_in = ~self.reliever_in[fielding, games]
+        self.starter_pitches[fielding[starter_in],
+                             games[starter_in]] += num_pitches[starter_in]
+
+    def handle_pitcher_sub(self, games):
+        """
+        Same criteria as Game.handle_pitcher_sub applied to every game.
+        Only starters can be subbed out since relievers pitch the rest of the
+            game
+        """
+        fielding = 1 - self.batting[games]
+        stats = self.starter_stats
+        sub_out = pull_due(stats['H'][fielding, games],
+                           stats['ER'][fielding, games],
+                           self.starter_outs[fielding, games]/3.0,
+                           self.starter_pitches[fielding, games],
+                           self.pitch_limits[fielding])
+        sub_out &= ~self.reliever_in[fielding, games]
+
+        fielding = fielding[sub_out]
+        games = games[sub_out]
+        self.meets_win_requirements[fielding, games] = (
+            self.score[fielding, games] > self.score[1 - fielding, games])
+        self.reliever_in[fielding, games] = True
+
+    def handle_steals(self, games):
+        """
+        Loops through stolen base opportunities like Game.handle_steals
+        Returns the games that still need a plate appearance
+        """
+        at_plate = np.ones(len(games), dtype=bool)
+        pending = np.arange(len(games))
+        while len(pending) > 0:
+            current = games[pending]
+            base_state = self.base_state(current)
+            opportunity = np.in1d(base_state, SB_OPPORTUNITIES)
+
+            batting = self.batting[current]
+            role = self.pitcher_role(1 - batting, current)
+            lead_base = np.where((base_state == 1) | (base_state == 5), 0, 1)
+            runner = self.bases[lead_base, current]
+            index = (batting, role, np.maximum(runner, 0),
+                     base_state, np.minimum(self.outs[current], 2))
+
+            attempt = opportunity & (self.rng.random_sample(len(current)) <
+                                     self.attempt_probs[index])
+            np.add.at(self.post_state_counts, base_state[~attempt], 1)
+
+            success = (self.rng.random_sample(len(current)) <
+                       self.success_probs[index])
+            self.move_runners(current[attempt], batting[attempt], None,
+                              np.where(success[attempt], SB, CS))
+
+            inning_over = attempt & (self.outs[current] >= 3)
+            if inning_over.any():
+                ended = current[inning_over]
+                self.credit_pitches(1 - self.batting[ended], ended,
+                                    np.full(len(ended), 2.0))
+                self.handle_half_inning(ended)
+                still_playing = ended[self.active[ended]]
+                self.handle_pitcher_sub(still_playing)
+                at_plate[pending[inning_over]] = self.active[ended]
+
+            pending = pending[attempt & ~inning_over]
+        return games[at_plate]
+
+    def batting_rate_mode(self, batting, games, slot):
+        """
+        Picks each batter's rates: pinch hitter if his own starter was
+            pulled from his batting spot, reliever rates if the opposing
+            starter was pulled and starter rates otherwise
+        """
+        mode = np.where(self.reliever_in[1 - batting, games], RP_RATES,
+                        SP_RATES)
+        pinch_hitting = (self.reliever_in[batting, games] &
+                         (slot == self.pitcher_batting_pos[batting]))
+        mode[pinch_hitting] = PINCH_RATES
+        return mode
+
+    def pa_uniforms(self, batting, games, slot):
+        """
+        Uniforms for the plate appearance outcomes of <games>
+        Coupled draws are looked up by the batter's plate appearance number
+        """
+        uniforms = self.rng.random_sample(len(games))
+        if self.coupled_draws:
+            number = self.plate_appearances[batting, games, slot]
+            coupled = number < PA_DRAWS_PER_BATTER
+            uniforms[coupled] = self.coupled_pa_draws[
+                games[coupled], batting[coupled], slot[coupled],
+                number[coupled]]
+            self.plate_appearances[batting, games, slot] += 1
+        return uniforms
+
+    def handle_plate_appearance(self, games):
+        n = len(games)
+        batting = self.batting[games]
+        fielding = 1 - batting
+        slot = self.at_bat_index[batting, games]
+
+        mode = self.batting_rate_mode(batting, games, slot)
+        self.expected_pts[batting, games, slot] += (
+            self.rate_expected_pts[batting, mode, slot])
+        events = sample_cdf(self.rate_cdfs[batting, mode, slot],
+                            self.pa_uniforms(batting, games, slot))
+
+        self.player_stats[batting, games, slot, BATTER_STAT[events]] += 1
+        hit = events <= br.HR
+        self.credit_starter(fielding[hit], games[hit], 'H')
+        for event, stat in ((br.BB, 'BB'), (br.HBP, 'HBP'), (br.SO, 'SO')):
+            is_event = events == event
+            self.credit_starter(fielding[is_event], games[is_event], stat)
+
+        self.move_runners(games, batting, slot, events,
+                          self.rng.random_sample(n))
+
+        num_pitches = sample_cdf(PITCH_COUNT_CDFS[events],
+                                 self.rng.random_sample(n))
+        self.credit_pitches(fielding, games, num_pitches.astype(float))
+
+        self.at_bat_index[batting, games] = (slot + 1) % 9
+
+        inning_over = self.outs[games] >= 3
+        self.handle_half_inning(games[inning_over])
+
+    def move_runners(self, games, batting, slot, events, uniforms=None):
+        """
+        Moves the batter in <slot> and the runners to where the transition
+            table sends them on <events>, indices into baserunning.EVENTS.
+            slot is None for steals, which the batter takes no part in.
+        uniforms pick between the table's outcomes, steals only draw them
+            when the table has more than one
+        Credits runs, earned runs and outs, plus RBIs on batting events and
+            SB/CS on steals
+        """
+        n = len(games)
+        base_state = self.base_state(games)
+        outs = self.outs[games]
+        if uniforms is None:
+            uniforms = (self.rng.random_sample(n)
+                        if self.transitions.random_steals else np.zeros(n))
+        outcome = self.transitions.sample_many(events, base_state, outs,
+                                               uniforms)
+        index = (events, base_state, outs, outcome)
+        dests = self.transitions.dests[index]
+
+        fielding = 1 - batting
+        if slot is None:
+            batter = np.full(n, EMPTY, dtype=int)
+        else:
+            batter = slot
+        occupants = [batter] + [self.bases[b, games] for b in range(3)]
+        resps = ([self.pitcher_role(fielding, games)] +
+                 [self.resp[b, games] for b in range(3)])
+
+        new_bases = np.full((3, n), EMPTY, dtype=int)
+        new_resp = np.zeros((3, n), dtype=int)
+        runs = np.zeros(n, dtype=int)
+        stats = self.player_stats
+        for origin in range(4):
+            occupied = occupants[origin] != EMPTY
+            dest = dests[:, origin]
+            for base in range(3):
+                moved = occupied & (dest == base + 1)
+                new_bases[base, moved] = occupants[origin][moved]
+                new_resp[base, moved] = resps[origin][moved]
+
+            scored = occupied & (dest == HOME_PLATE)
+            stats[batting[scored], games[scored],
+                  occupants[origin][scored], st.RUN] += 1
+            runs += scored
+            earned_on_starter = scored & (resps[origin] == STARTER)
+            self.starter_stats['ER'][fielding[earned_on_starter],
+                                     games[earned_on_starter]] += 1
+
+            if slot is None and origin > 0:
+                stole = occupied & (events == SB) & (dest > origin)
+                stats[batting[stole], games[stole],
+                      occupants[origin][stole], st.SB] += 1
+                caught = occupied & (events == CS) & (dest == NOT_ON_BASE)
+                stats[batting[caught], games[caught],
+                      occupants[origin][caught], st.CS] += 1
+
+        self.bases[:, games] = new_bases
+        self.resp[:, games] = new_resp
+        if slot is not None:
+            stats[batting, games, slot, st.RBI] += runs
+        self.score[batting, games] += runs
+        self.credit_out(fielding, games, self.transitions.outs_made[index])
+
+    def handle_half_inning(self, games):
+        """
+        Same logic as Game.handle_half_inning for every game in <games>
+        """
+        batting = self.batting[games]
+        fielding = 1 - batting
+        own_score = self.score[fielding, games]
+        opponent_score = self.score[batting, games]
+        # The fielding team's starter loses his claim to the win if the lead
+        #   was given up
+        lead_lost = own_score <= opponent_score
+        self.meets_win_requirements[fielding[lead_lost],
+                                    games[lead_lost]] = False
+
+        away_at_bat = batting == AWAY
+        away_score = self.score[AWAY, games]
+        home_score = self.score[HOME, games]
+        game_over = ((self.inning_num[games] >= 9) &
+                     ((away_at_bat & (away_score < home_score)) |
+                      (~away_at_bat & (away_score != home_score))))
+        self.active[games[game_over]] = False
+
+        games = games[~game_over]
+        new_inning = games[self.batting[games] == HOME]
+        self.inning_num[new_inning] += 1
+        # Cutoff game after 20 innings regardless.
+        self.active[new_inning[self.inning_num[new_inning] > 20]] = False
+
+        self.batting[games] = 1 - self.batting[games]
+        self.outs[games] = 0
+        self.bases[:, games] = EMPTY
+
+    def handle_end_stats(self):
+        """
+        Mirrors Team.handle_end_stats for the starters of both teams
+        """
+        games = np.arange(self.num_games)
+        stats = self.starter_stats
+        stats['IP'][:] = self.starter_outs/3.0
+        for side in (HOME, AWAY):
+            own_score = self.score[side]
+            opponent_score = self.score[1 - side]
+            starter_in = ~self.reliever_in[side]
+            # Game is over so the starter "leaves" with the current lead
+            self.meets_win_requirements[side, starter_in] = (
+                own_score > opponent_score)[starter_in]
+            wins = ((own_score > opponent_score) &
+                    self.meets_win_requirements[side] &
+                    (stats['IP'][side] >= 4.9))
+            stats['W'][side, wins] += 1
+
+            # Bonuses only count when the starter pitched the whole game
+            stats['CG'][side, starter_in] += 1
+            no_hitter = (starter_in & (stats['H'][side] == 0) &
+                         (self.inning_num[games] >= 9))
+            stats['NH'][side, no_hitter] += 1
+            shutout = starter_in & (opponent_score == 0)
+            stats['CGSO'][side, shutout] += 1
+
+        stats['dk_score'][:] = np.dot(scored_stats_array(stats),
+                                      pitcher_DK_multiplier)
+
+    def get_results(self):
+        results = {}
+        for side, name in ((HOME, 'home'), (AWAY, 'away')):
+            results[name + '_playerstats'] = self.player_stats[side]
+            results[name + '_expected_pts'] = self.expected_pts[side]
+            pitcher = {key: val[side]
+                       for key, val in self.starter_stats.items()}
+            pitcher['num_pitches'] = self.starter_pitches[side]
+            results[name + '_pitcher'] = pitcher
+            results[name + '_score'] = self.score[side]
+        results['pre_state_counts'] = self.pre_state_counts
+        results['post_state_counts'] = self.post_state_counts
+        return results
@@ -11,3 +11,6 @@ OUT = 7
 
 # Make sure this is kept in sync with definitions above
 batting_events = ('SINGLE', 'DOUBLE', 'TRIPLE', 'HR', 'BB', 'HBP', 'SO', 'OUT')
+
+# DK points the batter gets for each event itself, not counting R and RBI
+DK_points = [3, 5, 8, 10, 2, 2, 0, 0]
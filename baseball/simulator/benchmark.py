@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Micro-benchmarks of the simulator on synthetic teams, no database needed.
+Run it with python -m baseball.simulator.benchmark [--quick] [--output FILE]
+    and compare the JSON it writes between commits. Every benchmark is
+    seeded so two commits play the same games as long as the engine's draws
+    haven't changed.
+The matchups cover the engine's slow paths: lineups with varied rates, NL
+    games where the pitchers bat and get pinch hit for, and a lineup of the
+    stolen base model's most frequent base stealers.
+CPython doesn't count allocations, so each game's memory is reported as the
+    peak traced by tracemalloc above what was allocated before it (python
+    and numpy) and the blocks still held once the games are over, which
+    should stay near 0.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from .game import Game, choice, sb_info_dict
+from .instrumentation import EngineStats
+from .player import Player
+from .team import Team
+from .simulator import simulate
+from baseball.sbModel.stolen_bases import shared_stolen_bases
+from . import batting_rates_index as br
+
+
+# Rates of an average batter and a batting pitcher in batting_events order,
+#   SINGLE, DOUBLE, TRIPLE, HR, BB, HBP, SO, OUT
+LEAGUE_RATES = [0.150, 0.045, 0.005, 0.030, 0.080, 0.010, 0.200, 0.480]
+PITCHER_RATES = [0.090, 0.020, 0.000, 0.005, 0.040, 0.005, 0.400, 0.440]
+
+# Higher concentrations draw batters closer to LEAGUE_RATES
+RATE_CONCENTRATION = 200
+
+# Sizes of the full suite and of a --quick run
+SUITE_SIZES = {"games": 2000, "memory_games": 200,
+               "simulate_iterations": (100, 1000, 10000), "calls": 100000}
+QUICK_SIZES = {"games": 100, "memory_games": 20,
+               "simulate_iterations": (50, 200), "calls": 2000}
+
+SIMULATE_ENGINES = ("game", "batch")
+
+
+def synthetic_lineup(rng, pids=None):
+    """
+    Returns 9 Players whose rates are drawn around LEAGUE_RATES
+    """
+    lineup = []
+    for slot in range(9):
+        player = Player(pid="" if pids is None else pids[slot])
+        rates = rng.dirichlet(np.array(LEAGUE_RATES)*RATE_CONCENTRATION)
+        rates = pd.Series(rates, index=br.batting_events)
+        player.set_sp_batting_rates(rates)
+        player.set_rp_batting_rates(rates)
+        lineup.append(player)
+    return lineup
+
+
+def top_base_stealers(num_runners=9):
+    """
+    Returns the pids of the runners the stolen base model expects to attempt
+        the most steals. Runners the model doesn't know are padded with ""
+    """
+    runners = shared_stolen_bases().ranef["attempt"]["runner"]
+    pids = sorted(runners, key=runners.get, reverse=True)[:num_runners]
+    return pids + [""]*(num_runners - len(pids))
+
+
+def synthetic_team(rng, team_id, pitcher_bats=False, steal_heavy=False):
+    """
+    Returns a Team of synthetic batters drawn from <rng>
+    pitcher_bats makes the 9th slot the starter's, with a pinch hitter once
+        he's pulled, like an NL lineup
+    steal_heavy gives the lineup the pids of top_base_stealers
+    """
+    pids = top_base_stealers() if steal_heavy else None
+    team = Team(synthetic_lineup(rng, pids), team_id=team_id)
+    if pitcher_bats:
+        pitcher_slot = team.lineup[8]
+        pitcher_slot.set_pinch_hitter_rates(pitcher_slot.get_batting_rates())
+        rates = pd.Series(PITCHER_RATES, index=br.batting_events)
+        pitcher_slot.set_sp_batting_rates(rates)
+        pitcher_slot.set_rp_batting_rates(rates)
+        team.starter.batting_pos = 8
+    return team
+
+
+def benchmark_matchups(seed=0):
+    """
+    Returns a dict of the (home_team, away_team) of each benchmark matchup
+    """
+    rng = np.random.RandomState(seed)
+    return {"AL": (synthetic_team(rng, "NYA"), synthetic_team(rng, "BOS")),
+            "NL": (synthetic_team(rng, "CHN", pitcher_bats=True),
+                   synthetic_team(rng, "SLN", pitcher_bats=True)),
+            "steal_heavy": (synthetic_team(rng, "KCA", steal_heavy=True),
+                            synthetic_team(rng, "DET"))}
+
+
+def time_games(home_team, away_team, num_games, seed=0):
+    """
+    Times Game.simulate_game over <num_games> seeded games
+    Returns the EngineStats report of the games
+    """
+    curr_game = Game(home_team, away_team, np.random.RandomState(seed))
+    engine_stats = EngineStats()
+    clock = time.perf_counter
+    for _ in range(num_games):
+        curr_game.reset_game()
+        start = clock()
+        curr_game.simulate_game(copy_stats=False)
+        engine_stats.count_game(curr_game, clock() - start)
+    return engine_stats.report()
+
+
+def game_memory(home_team, away_team, num_games, seed=0):
+    """
+    Returns the mean tracemalloc peak of a game in bytes and the number of
+        memory blocks still held per game after <num_games> games
+    """
+    curr_game = Game(home_team, away_team, np.random.RandomState(seed))
+    # The first game fills the uniform buffers and caches
+    curr_game.simulate_game(copy_stats=False)
+    blocks = sys.getallocatedblocks()
+    for _ in range(num_games):
+        curr_game.reset_game()
+        curr_game.simulate_game(copy_stats=False)
+    blocks = sys.getallocatedblocks() - blocks
+
+    peak_bytes = 0
+    tracemalloc.start()
+    try:
+        for _ in range(num_games):
+            curr_game.reset_game()
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            curr_game.simulate_game(copy_stats=False)
+            peak_bytes += tracemalloc.get_traced_memory()[1] - start_bytes
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes_per_game": peak_bytes/float(num_games),
+            "blocks_held_per_game": blocks/float(num_games)}
+
+
+def time_simulate(home_team, away_team, num_iterations, engine, seed=0):
+    start = time.perf_counter()
+    simulate(home_team, away_team, num_iterations, engine=engine, seed=seed)
+    seconds = time.perf_counter() - start
+    return {"iterations": num_iterations, "seconds": seconds,
+            "games_per_sec": num_iterations/seconds}
+
+
+def time_calls(function, args, num_calls):
+    """
+    Returns the ns per call of <function> called with <args>
+    """
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        function(*args)
+    return {"calls": num_calls,
+            "ns_per_call": (time.perf_counter() - start)*1e9/num_calls}
+
+
+def steal_opportunity_info(home_team, away_team):
+    """
+    Returns the sb_info of the first runner of <away_team> on first against
+        <home_team> with no outs, for timing calc_prob_sb
+    """
+    return sb_info_dict(1, 0, home_team.starter, home_team.catcher,
+                        away_team.team_id, away_team.lineup[0])
+
+
+def run_suite(quick=False, seed=0):
+    """
+    Runs every benchmark and returns the results as a json serializable dict
+    """
+    sizes = QUICK_SIZES if quick else SUITE_SIZES
+    matchups = benchmark_matchups(seed)
+    results = {"environment": environment(), "quick": quick, "seed": seed,
+               "simulate_game": {}, "simulate": {}}
+
+    for name, (home_team, away_team) in matchups.items():
+        results["simulate_game"][name] = time_games(home_team, away_team,
+                                                    sizes["games"], seed)
+        results["simulate_game"][name].update(
+            game_memory(home_team, away_team, sizes["memory_games"], seed))
+
+    home_team, away_team = matchups["AL"]
+    for engine in SIMULATE_ENGINES:
+        results["simulate"][engine] = [
+            time_simulate(home_team, away_team, num_iterations, engine, seed)
+            for num_iterations in sizes["simulate_iterations"]]
+
+    home_team, away_team = matchups["steal_heavy"]
+    sb_info = steal_opportunity_info(away_team, home_team)
+    results["calc_prob_sb"] = {
+        steal_phase: time_calls(shared_stolen_bases().calc_prob_sb,
+                                (sb_info, steal_phase), sizes["calls"])
+        for steal_phase in ("attempt", "success")}
+    results["choice"] = time_calls(choice, (br.batting_events, LEAGUE_RATES),
+                                   sizes["calls"])
+    return results
+
+
+def environment():
+    """
+    What the numbers were measured on, including the commit if run from a
+        git checkout
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "platform": platform.platform()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the simulator and writes the results as JSON")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes, for checking the suite runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick, args.seed)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Importance sampling of a starter's rare bonus events, see
+    Team.handle_bonus_stats.
+A complete game, shutout or no hitter happens in a few percent of the games
+    at most, so plain simulations see too few of them for a steady estimate
+    of their probability. estimate_bonuses instead simulates the opposing
+    lineup with its hit and walk rates scaled down by <tilt>, which makes
+    the events common, and weights each game back by its likelihood ratio
+    under the real rates, see reweighting.PlateAppearanceRecord.
+The weights are exact, only plate appearance outcomes depend on the batting
+    rates. The stronger the tilt the more bonus games are seen but the more
+    uneven the weights. The effective iterations estimate_bonuses reports
+    say how much the tilt gained over plain simulations.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .pitcher import SCORED_STATS, DK_multiplier
+from .reweighting import team_rates
+from .simulator import simulate
+from . import batting_rates_index as br
+
+
+BONUS_STATS = ("CG", "CGSO", "NH")
+
+# Batting events that break up a shutout or no hitter or lengthen a start
+TILTED_EVENTS = [br.SINGLE, br.DOUBLE, br.TRIPLE, br.HR, br.BB, br.HBP]
+
+# Factor on the opposing lineup's TILTED_EVENTS rates
+DEFAULT_TILT = 0.8
+
+BONUS_HEADERS = ("probability", "standard error", "DK pts",
+                 "effective iterations")
+
+
+def tilt_rates(team, tilt):
+    """
+    Scales every set of rates of <team>'s batters' TILTED_EVENTS by <tilt>,
+        OUT taking up the difference
+    """
+    for player in team.lineup:
+        for mode in range(player.rates.shape[1]):
+            rates = player.rates[:, mode].copy()
+            rates[TILTED_EVENTS] *= tilt
+            player.set_rates(mode, rates)
+
+
+def restore_rates(team, rates):
+    team.rates[:] = rates
+    for player in team.lineup:
+        player.compile_rates()
+
+
+def estimate_bonuses(pitching_team, batting_team, num_iterations, home=True,
+                     tilt=DEFAULT_TILT, seed=None, workers=1):
+    """
+    Estimates the probability of each of BONUS_STATS for the starter of
+        <pitching_team>, at home if <home>, against <batting_team>
+    The games are simulated with batting_team's rates tilted, see
+        tilt_rates, which are restored afterwards
+    Returns a dict of the estimates in bonuses, a DataFrame indexed by
+        BONUS_STATS with BONUS_HEADERS columns: each probability, its
+        standard error, the DK points it adds to the starter's dk_score and
+        the plain simulations that would give the same standard error. The
+        effective_sample_size of the weights is also returned.
+    """
+    if home:
+        home_team, away_team = pitching_team, batting_team
+    else:
+        home_team, away_team = batting_team, pitching_team
+    rates = team_rates(home_team, away_team)
+
+    original_rates = batting_team.rates.copy()
+    tilt_rates(batting_team, tilt)
+    try:
+        record = simulate(home_team, away_team, num_iterations, seed=seed,
+                          workers=workers, keep_pa_counts=True)['pa_record']
+    finally:
+        restore_rates(batting_team, original_rates)
+
+    # The weights are uneven by design, the effective iterations of each
+    #   bonus say how well it was estimated
+    weights, effective_sample_size = record.weights(rates, warn=False)
+    columns = [SCORED_STATS.index(stat) for stat in BONUS_STATS]
+    bonuses = record.pitcher_stats[:, 0 if home else 1, columns]
+    probabilities = np.dot(weights, bonuses)
+    standard_errors = np.sqrt(np.dot(weights**2,
+                                     (bonuses - probabilities)**2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        effective_iterations = (probabilities*(1 - probabilities) /
+                                standard_errors**2)
+    points = np.array(DK_multiplier)[columns]*probabilities
+    bonuses = pd.DataFrame(np.column_stack((probabilities, standard_errors,
+                                            points, effective_iterations)),
+                           index=BONUS_STATS, columns=BONUS_HEADERS)
+    return {'bonuses': bonuses,
+            'effective_sample_size': effective_sample_size}
@@ -10,7 +10,18 @@ BASE_EMPTY = -1
 from . import stat_index as st
 from . import batting_rates_index as br
 
-from baseball.sbModel.stolen_bases import StolenBases
+from .sampling import CategoricalTable, UniformBuffer, GAME_BLOCK_SIZE
+from .baserunning import (DEFAULT_TRANSITIONS, NOT_ON_BASE, HOME_PLATE, SB,
+                          CS)
+
+from baseball.sbModel.stolen_bases import shared_stolen_bases
+
+
+SB_OPPORTUNITIES = (1, 2, 3, 5)
+
+# Attribute holding the runner on each base, indexed like the destinations
+#   of the baserunning tables
+BASES = (None, "first_base", "second_base", "third_base")
 
 
 def drand48():
@@ -22,6 +33,7 @@ def choice(a, p):
     a: A list of objects to be sampled by corresponding probabilities in p
     PREREQUISITES: p is a list of probabilties that sums to 1
     Faster version of np.random.choice without any sanity checks
+    NOTE: Game samples with precompiled sampling.CategoricalTables instead
     """
     assert(len(a) == len(p)), (a, p)
     x = drand48()
@@ -37,6 +49,69 @@ def choice(a, p):
     print("no event selected? a: ", a, "\nprob: ", p)
 
 
+HIT_PITCH_PMF = [0.0, 0.1535, 0.2218, 0.2029, 0.1613, 0.1244, 0.0798, 0.0339,
+                 0.0141, 0.0053, 0.0020, 0.0006, 0.0002, 0.0001, 0.0001]
+
+# PITCH_COUNT_PMFS[event][i] = Prob(plate appearance lasts i pitches | event)
+PITCH_COUNT_PMFS = {
+    "SINGLE": HIT_PITCH_PMF,
+    "DOUBLE": HIT_PITCH_PMF,
+    "TRIPLE": HIT_PITCH_PMF,
+    "HR": HIT_PITCH_PMF,
+    "OUT": [0.0, 0.1529, 0.2240, 0.2045, 0.1623, 0.1247, 0.0776, 0.0333,
+            0.0127, 0.0049, 0.0019, 0.0007, 0.0003, 0.0001, 0.0001],
+    "BB": [0.0, 0.0, 0.0, 0.0, 0.1812, 0.3071, 0.2809, 0.1369, 0.0574,
+           0.0227, 0.0090, 0.0031, 0.0012, 0.0004, 0.0001],
+    "SO": [0.0, 0.0, 0.0, 0.1795, 0.2840, 0.2596, 0.1707, 0.0663,
+           0.0255, 0.0092, 0.0035, 0.0013, 0.0003, 0.0001],
+    "HBP": [0.0, 0.1916, 0.2125, 0.2023, 0.1826, 0.1175, 0.0594, 0.0224,
+            0.0079, 0.0026, 0.0004, 0.0006, 0.0002],
+}
+
+PITCH_COUNT_TABLES = {event: CategoricalTable(range(len(pmf)), pmf)
+                      for event, pmf in PITCH_COUNT_PMFS.items()}
+
+# Stat credited to the batter and to the pitcher for each batting event,
+#   plus the event's index in the baserunning tables
+EVENT_STATS = {
+    "SINGLE": (st.SINGLE, "H", br.SINGLE),
+    "DOUBLE": (st.DOUBLE, "H", br.DOUBLE),
+    "TRIPLE": (st.TRIPLE, "H", br.TRIPLE),
+    "HR": (st.HR, "H", br.HR),
+    "BB": (st.BB, "BB", br.BB),
+    "HBP": (st.HBP, "HBP", br.HBP),
+    "SO": (st.OUT, "SO", br.SO),
+    "OUT": (st.OUT, None, br.OUT),
+}
+
+
+def sb_info_dict(base_state, outs, pitcher, catcher, runner_team_id, runner):
+    """
+    Packs the situation of a stolen base opportunity into the dict of
+        fields expected by StolenBases.calc_prob_sb
+    """
+    sb_info = {}
+
+    sb_info['base_state'] = base_state
+    sb_info['pitcher'] = pitcher.pid
+    sb_info['catcher'] = catcher.pid
+    sb_info['runner_team'] = "runner_team"+runner_team_id
+    sb_info['pitcher_hand'] = "hand"+pitcher.hand
+    sb_info['inning_state'] = "state"+str(base_state)+"_"+str(outs)
+    sb_info['runner'] = runner.pid
+    sb_info['runner_team:pitcher_hand'] = (sb_info['runner_team'] + ":" +
+                                           sb_info['pitcher_hand'])
+    sb_info['runner_team:inning_state'] = (sb_info['runner_team'] + ":" +
+                                           sb_info['inning_state'])
+    sb_info['pitcher_hand:inning_state'] = (sb_info['pitcher_hand'] + ":" +
+                                            sb_info['inning_state'])
+    sb_info['runner_team:pitcher_hand:inning_state'] = (
+        sb_info['runner_team'] + ":" + sb_info['pitcher_hand'] + ":" +
+        sb_info['inning_state'])
+
+    return sb_info
+
+
 def get_boxscore_indexes():
         index = {}
         index['home_playerstats'] = 0
@@ -53,21 +128,117 @@ def get_boxscore_indexes():
         return index
 
 
+class TeamState:
+    """
+    One team's side of a GameState
+    stats is the (9, NUM_STATS) array of its batters' stats so far
+    starter_stats is a dict of its starter's stats so far, see
+        pitcher.PITCHER_STATS, and starter_pitches his pitch count
+    reliever_in is whether the starter has been pulled, in which case
+        meets_win_requirements is whether he left in line for the win
+    """
+    def __init__(self, score=0, at_bat_index=0, stats=None,
+                 starter_stats=None, starter_pitches=0, reliever_in=False,
+                 meets_win_requirements=False):
+        if not 0 <= at_bat_index < 9:
+            raise ValueError("Invalid at_bat_index: " + str(at_bat_index))
+        self.score = score
+        self.at_bat_index = at_bat_index
+        if stats is None:
+            stats = np.zeros((9, st.NUM_STATS))
+        self.stats = np.array(stats, dtype=float)
+        self.starter_stats = dict(starter_stats or {})
+        self.starter_pitches = starter_pitches
+        self.reliever_in = reliever_in
+        self.meets_win_requirements = meets_win_requirements
+
+    def restore(self, team, facing_reliever):
+        """
+        Puts <team> in this state in place, <facing_reliever> is whether the
+            other team's starter has been pulled
+        """
+        team.stats[:] = self.stats
+        team.score = self.score
+        team.at_bat_index = self.at_bat_index
+
+        starter = team.starter
+        starter.reset()
+        starter.stats.update(self.starter_stats)
+        starter.num_pitches = self.starter_pitches
+        starter.meets_win_requirements = self.meets_win_requirements
+        team.reliever.reset()
+        team.reliever_in = self.reliever_in
+        team.pitcher = team.reliever if self.reliever_in else starter
+
+        for player in team.lineup:
+            player.reset_state()
+            if facing_reliever:
+                player.set_facing_reliever()
+        if self.reliever_in and starter.batting_pos is not None:
+            team.lineup[starter.batting_pos].set_pinch_hitter_sub()
+
+
+def team_state(team):
+    """
+    Returns the TeamState <team> is in
+    """
+    return TeamState(team.score, team.at_bat_index, team.stats,
+                     team.starter.stats, team.starter.num_pitches,
+                     team.reliever_in, team.starter.meets_win_requirements)
+
+
+class GameState:
+    """
+    A game in progress, e.g. a live game, to fork simulations from with
+        Game.restore
+    away_at_bat is whether it's the top of <inning_num> and outs are the
+        outs so far in the half inning
+    runners holds the lineup slots of the batting team's runners on first,
+        second and third, None for an empty base. They're charged to the
+        current pitcher if they score.
+    home and away are TeamStates, a new game's by default
+    """
+    def __init__(self, inning_num=1, away_at_bat=True, outs=0,
+                 runners=(None, None, None), home=None, away=None):
+        if inning_num < 1 or not 0 <= outs < 3 or len(runners) != 3:
+            raise ValueError("Invalid game state: inning {}, {} outs, "
+                             "runners {}".format(inning_num, outs, runners))
+        self.inning_num = inning_num
+        self.away_at_bat = away_at_bat
+        self.outs = outs
+        self.runners = tuple(runners)
+        self.home = home or TeamState()
+        self.away = away or TeamState()
+
+
 class Game:
     """
     Keeps track of whos on each base, numOuts, which team is batting
     """
-    def __init__(self, home_team, away_team):
+    def __init__(self, home_team, away_team, rng=None, transitions=None):
         """
         PRECONDITIONS:
             home_team is expected to be a team class
             away_team is expected to be a team class
+        rng is the RandomState to draw from, defaults to numpy's global state
+        transitions is the baserunning.TransitionTable the runners move by,
+            defaults to the standard rules
         """
         # Home team always bats second
         self.home_team = home_team
         self.away_team = away_team
 
-        self.sb = StolenBases()
+        self.sb = shared_stolen_bases()
+        self.transitions = transitions or DEFAULT_TRANSITIONS
+        self.uniforms = UniformBuffer(rng)
+        # Plate appearance outcomes share the buffer unless reseed_streams
+        #   splits them onto their own stream
+        self.set_pa_uniforms(self.uniforms)
+        # Whether random_PA sums the expected DK points, see
+        #   track_expected_pts
+        self.tracking_expected_pts = False
+        # Observers of every plate appearance, see add_plate_appearance_hook
+        self.plate_appearance_hooks = []
 
         # Called at end of init to initialize all the fields
         self.reset_state()
@@ -97,6 +268,46 @@ class Game:
         self.away_at_bat = True
         self.game_over = False
 
+    def reseed_streams(self, pa_seed, other_seed):
+        """
+        Draws plate appearance outcomes from a stream seeded with <pa_seed>
+            and everything else (steals, baserunning, pitch counts) from one
+            seeded with <other_seed>
+        Used to give each game its own common random numbers
+        """
+        if self.pa_uniforms is self.uniforms:
+            self.uniforms = UniformBuffer(np.random.RandomState(other_seed),
+                                          GAME_BLOCK_SIZE)
+            self.set_pa_uniforms(UniformBuffer(
+                np.random.RandomState(pa_seed), GAME_BLOCK_SIZE))
+        else:
+            self.pa_uniforms.reseed(pa_seed)
+            self.uniforms.reseed(other_seed)
+
+    def set_pa_uniforms(self, uniforms):
+        """
+        Makes every lineup slot draw its plate appearances from <uniforms>
+        slot_uniforms[away_at_bat][slot] is the buffer the batter in <slot>
+            of the batting team draws from
+        """
+        self.pa_uniforms = uniforms
+        self.slot_uniforms = {True: [uniforms]*9, False: [uniforms]*9}
+
+    def preload_pa_draws(self, draws):
+        """
+        draws[side][slot] are the uniforms for the plate appearances of the
+            batter in <slot> of the home (side 0) or away (side 1) lineup,
+            e.g. coupled draws for variance reduction. Once a slot's draws
+            are used up it goes back to the rng.
+        """
+        for side, away_at_bat in enumerate((False, True)):
+            slot_uniforms = self.slot_uniforms[away_at_bat]
+            for slot, uniforms in enumerate(slot_uniforms):
+                if uniforms is self.pa_uniforms:
+                    uniforms = slot_uniforms[slot] = UniformBuffer(
+                        self.uniforms.rng)
+                uniforms.preload(draws[side][slot])
+
     def reset_game(self):
         """
         Resets state variables for the beginning of a new game.
@@ -108,7 +319,51 @@ class Game:
 
         self.reset_state()
 
-    def get_boxscore(self):
+    def restore(self, state):
+        """
+        Puts the game in the GameState <state>, after which simulate_game
+            plays out the rest of it and returns the whole game's boxscore
+        The teams are updated in place, so restoring before every game is
+            a cheap way to fork many simulations from the same state
+        """
+        state.home.restore(self.home_team, state.away.reliever_in)
+        state.away.restore(self.away_team, state.home.reliever_in)
+        self.reset_state()
+
+        self.away_at_bat = state.away_at_bat
+        if not state.away_at_bat:
+            self.batting_team = self.home_team
+            self.fielding_team = self.away_team
+        self.pitcher = self.fielding_team.pitcher
+        self.at_bat = self.batting_team.at_bat()
+        self.inning_num = state.inning_num
+        self.outs = state.outs
+        for base, slot in zip(BASES[1:], state.runners):
+            if slot is not None:
+                runner = self.batting_team.lineup[slot]
+                runner.resp_pitcher = self.pitcher
+                setattr(self, base, runner)
+
+    def snapshot(self):
+        """
+        Returns the GameState the game is in
+        """
+        runners = []
+        for base in BASES[1:]:
+            runner = getattr(self, base)
+            if runner == BASE_EMPTY:
+                runners.append(None)
+            else:
+                runners.append(self.batting_team.lineup.index(runner))
+        return GameState(self.inning_num, self.away_at_bat, self.outs,
+                         runners, team_state(self.home_team),
+                         team_state(self.away_team))
+
+    def get_boxscore(self, copy_stats=True):
+        """
+        Without <copy_stats> the batter stats are the teams' own buffers,
+            which the next reset zeroes
+        """
         # TODO: make sure to update get_boxscore_index if change what is return
         home_score = self.home_team.score
         away_score = self.away_team.score
@@ -119,8 +374,13 @@ class Game:
             pre_state_counts = np.zeros(8)
             post_state_counts = np.zeros(8)
 
-        return [self.home_team.get_boxscore(),
-                self.away_team.get_boxscore(),
+        if copy_stats:
+            home_stats = self.home_team.get_boxscore()
+            away_stats = self.away_team.get_boxscore()
+        else:
+            home_stats = self.home_team.stats_view()
+            away_stats = self.away_team.stats_view()
+        return [home_stats, away_stats,
                 self.home_team.starter, self.away_team.starter,
                 home_score, away_score,
                 home_score > away_score,
@@ -135,10 +395,10 @@ class Game:
     def get_away_pitcher(self):
         return self.away_team.starter
 
-    def simulate_game(self):
+    def simulate_game(self, copy_stats=True):
         """
         Simulates a game
-        Returns the boxscore
+        Returns the boxscore, see get_boxscore for <copy_stats>
         """
         self.pre_state_counts = np.zeros(8)
         self.post_state_counts = np.zeros(8)
@@ -152,21 +412,69 @@ class Game:
             #   and by number of outs
             self.pre_state_counts[self.get_base_state()] += 1
             self.handle_steals()
-            self.handle_event(self.random_PA())
+            # A caught stealing can end the game before the plate appearance
+            if not self.game_over:
+                event = self.random_PA()
+                if self.plate_appearance_hooks:
+                    self.handle_hooked_event(event)
+                else:
+                    self.handle_event(event)
+
+        return self.finish_game(copy_stats)
 
+    def finish_game(self, copy_stats=True):
+        """
+        Credits the end of game pitcher stats and returns the boxscore
+        """
         self.home_team.handle_end_stats(self.home_team.score,
                                         self.away_team.score, self.inning_num)
         self.away_team.handle_end_stats(self.away_team.score,
                                         self.home_team.score, self.inning_num)
 
-        return self.get_boxscore()
+        return self.get_boxscore(copy_stats)
 
     def random_PA(self):
         """
         Simulates a random Plate Appearance using the probability tables
         of whoever is at bat and on base
+        When tracking_expected_pts the expected DK points of the batter's
+            rates are added to his expected_pts
+        """
+        batting_table = self.at_bat.batting_table
+        if self.tracking_expected_pts:
+            self.at_bat.expected_pts += batting_table.mean
+        return batting_table.sample(
+            self.slot_uniforms[self.away_at_bat][
+                self.batting_team.at_bat_index])
+
+    def add_plate_appearance_hook(self, hook):
+        """
+        Makes this game call hook.before_event(game, event) and then
+            hook.after_event(game, event) around every plate appearance it
+            plays. Other games skip the hooks.
+        """
+        if hook in self.plate_appearance_hooks:
+            raise ValueError("The hook is already added to this game")
+        self.plate_appearance_hooks.append(hook)
+
+    def handle_hooked_event(self, event):
         """
-        return choice(br.batting_events, self.at_bat.get_batting_rates())
+        handle_event with the plate_appearance_hooks called around it
+        """
+        hooks = self.plate_appearance_hooks
+        for hook in hooks:
+            hook.before_event(self, event)
+        self.handle_event(event)
+        for hook in hooks:
+            hook.after_event(self, event)
+
+    def track_expected_pts(self):
+        """
+        Makes this game sum each batter's expected DK points per plate
+            appearance into his expected_pts, the control variates need them.
+            Other games skip it.
+        """
+        self.tracking_expected_pts = True
 
     def switch_teams(self):
         """
@@ -243,10 +551,10 @@ class Game:
 
             # probability of attempt for all runners on first or second
             prob_attempt = self.sb.calc_prob_sb(sb_info, "attempt")
-            if drand48() < prob_attempt:
+            if self.uniforms.next() < prob_attempt:
                 # probability of success for the lead runner
                 prob_success = self.sb.calc_prob_sb(sb_info, "success")
-                if drand48() < prob_success:
+                if self.uniforms.next() < prob_success:
                     self.advance_sb_success(sb_info['base_state'])
                 else:
                     self.advance_sb_failure(sb_info['base_state'])
@@ -265,44 +573,18 @@ class Game:
     def handle_event(self, event):
         """
         Implements the game logic for the mutually exclusive batting events
+        The baserunning comes from the transition table
         """
-        if event == "HR":
-            self.pitcher.increment_stat("H", 1)
-            self.at_bat.increment_stat(st.HR)
-            self.advance_home()
-        elif event == "TRIPLE":
-            # TODO: Do the error rates differ at third than in other states
-            self.pitcher.increment_stat("H", 1)
-            self.at_bat.increment_stat(st.TRIPLE)
-            self.at_bat.resp_pitcher = self.pitcher
-            self.advance_home(False, True, True, True)
-            self.third_base = self.at_bat
-            # TODO: handle errors which would allow the batter to make it home
-        elif event == "DOUBLE":
-            self.handle_double()
-        elif event == "SINGLE":
-            self.handle_single()
-        elif event == "BB":
-            self.pitcher.increment_stat("BB", 1)
-            self.at_bat.increment_stat(st.BB)
-            self.at_bat.resp_pitcher = self.pitcher
-            self.handle_force_advance()
-        elif event == "HBP":
-            self.pitcher.increment_stat("HBP", 1)
-            self.at_bat.increment_stat(st.HBP)
-            self.at_bat.resp_pitcher = self.pitcher
-            self.handle_force_advance()
-        elif event == "SO":
-            self.pitcher.increment_stat("SO", 1)
-            self.at_bat.increment_stat(st.OUT)
-            self.update_outs()
-        elif event == "OUT":
-            self.at_bat.increment_stat(st.OUT)
-            self.update_outs()
-        else:
+        if event not in EVENT_STATS:
             print(self.home_team)
             print(self.away_team)
             raise ValueError("That is not a valid event! " + event)
+        batter_stat, pitcher_stat, event_index = EVENT_STATS[event]
+        if pitcher_stat is not None:
+            self.pitcher.increment_stat(pitcher_stat, 1)
+        self.at_bat.increment_stat(batter_stat)
+        self.at_bat.resp_pitcher = self.pitcher
+        self.move_runners(event_index)
 
         self.handle_pitch_count(event)
 
@@ -312,6 +594,31 @@ class Game:
             self.handle_half_inning()
         return
 
+    def move_runners(self, event):
+        """
+        Moves the batter and runners to where the transition table sends
+            them on <event>, an index into baserunning.EVENTS
+        Runners who score get credit for a run and, on batting events, the
+            batter for an rbi
+        Returns the table's moves
+        """
+        moves, outs_made = self.transitions.sample_play(
+            event, self.get_base_state(), self.outs, self.uniforms)
+        rbi = event < SB
+        for origin, dest in moves:
+            if origin == 0:
+                runner = self.at_bat
+            else:
+                runner = getattr(self, BASES[origin])
+                setattr(self, BASES[origin], BASE_EMPTY)
+            if dest == HOME_PLATE:
+                self.handle_player_scores(runner, rbi)
+            elif dest != NOT_ON_BASE:
+                setattr(self, BASES[dest], runner)
+        for _ in range(outs_made):
+            self.update_outs()
+        return moves
+
     def update_outs(self):
         """
         Increments number of outs and updates pither statistics
@@ -328,102 +635,6 @@ class Game:
         self.second_base = BASE_EMPTY
         self.third_base = BASE_EMPTY
 
-    def handle_force_advance(self):
-        """
-        Implements the logic for a walk or hbp
-        """
-        if self.first_base != BASE_EMPTY:
-            if self.second_base != BASE_EMPTY:
-                if self.third_base != BASE_EMPTY:
-                    self.handle_player_scores(self.third_base)
-                self.third_base = self.second_base
-            self.second_base = self.first_base
-        self.first_base = self.at_bat
-
-    def handle_single(self):
-        self.pitcher.increment_stat("H", 1)
-        self.at_bat.increment_stat(st.SINGLE)
-        self.at_bat.resp_pitcher = self.pitcher
-        if self.second_base == BASE_EMPTY:
-            self.advance_home(False, False, False, True)
-            event_generator = drand48()
-            if event_generator < .5:
-                self.third_base = self.first_base
-            else:
-                self.second_base = self.first_base
-            self.first_base = self.at_bat
-        elif self.first_base == BASE_EMPTY:
-            event_generator = drand48()
-            if event_generator < .5:
-                self.advance_home(False, False, True, True)
-            else:
-                self.advance_home(False, False, False, True)
-                self.third_base = self.second_base
-                self.second_base = BASE_EMPTY
-            self.first_base = self.at_bat
-        elif self.third_base == BASE_EMPTY:
-            # Handle the case of man on 1st and 2nd
-            event_generator = drand48()
-            if event_generator < .5:
-                self.advance_home(False, False, False, True)
-                self.third_base = self.second_base
-                self.second_base = self.first_base
-            elif event_generator < (2/3.0):
-                # 1/6 chance of it ending with first and second
-                self.advance_home(False, False, True, True)
-                self.second_base = self.first_base
-            else:
-                # 1/3 chance of ending with first and third
-                self.advance_home(False, False, True, True)
-                self.third_base = self.first_base
-            self.first_base = self.at_bat
-        else:
-            # Handle the case of bases loaded
-            event_generator = drand48()
-            if event_generator < .5:
-                self.advance_home(False, False, True, True)
-                self.third_base = self.first_base
-            else:
-                self.advance_home(False, False, False, True)
-                self.third_base = self.second_base
-                self.second_base = self.first_base
-            self.first_base = self.at_bat
-
-    def handle_double(self):
-        self.pitcher.increment_stat("H", 1)
-        self.at_bat.increment_stat(st.DOUBLE)
-        self.at_bat.resp_pitcher = self.pitcher
-        event_generator = drand48()
-        if event_generator < .5:
-            self.advance_home(False, True, True, True)
-            self.second_base = self.at_bat
-        else:
-            self.advance_home(False, False, True, True)
-            self.third_base = self.first_base
-            self.first_base = BASE_EMPTY
-            self.second_base = self.at_bat
-
-    def advance_home(self, at_bat=True, first=True,
-                     second=True, third=True):
-        """
-        For each base takes a boolean flag for whether or not to advance that
-            runner home.
-        Gives any runners advanced credit for a run and the batter for an rbi.
-        It increments the score and clears the bases of the advanced players
-        """
-        if at_bat:
-            self.at_bat.resp_pitcher = self.pitcher
-            self.handle_player_scores(self.at_bat)
-        if first and self.first_base != BASE_EMPTY:
-            self.handle_player_scores(self.first_base)
-            self.first_base = BASE_EMPTY
-        if second and self.second_base != BASE_EMPTY:
-            self.handle_player_scores(self.second_base)
-            self.second_base = BASE_EMPTY
-        if third and self.third_base != BASE_EMPTY:
-            self.handle_player_scores(self.third_base)
-            self.third_base = BASE_EMPTY
-
     def increment_score(self, increment):
         # TODO: should this method be inline?
         self.batting_team.score += increment
@@ -441,41 +652,24 @@ class Game:
                 }
 
     def advance_sb_success(self, base_state):
-
-        if base_state in [1, 5]:
-            self.first_base.increment_stat(st.SB)
-            self.second_base = self.first_base
-            self.first_base = BASE_EMPTY
-        elif base_state == 2:
-            self.second_base.increment_stat(st.SB)
-            self.third_base = self.second_base
-            self.second_base = BASE_EMPTY
-        elif base_state == 3:
-            self.first_base.increment_stat(st.SB)
-            self.second_base.increment_stat(st.SB)
-            self.third_base = self.second_base
-            self.second_base = self.first_base
-            self.first_base = BASE_EMPTY
-        else:
+        if base_state not in SB_OPPORTUNITIES:
             raise ValueError("sb_success: invalid base state! " + str(base_state))
+        runners = self.runners()
+        for origin, dest in self.move_runners(SB):
+            if dest > origin:
+                runners[origin].increment_stat(st.SB)
 
     def advance_sb_failure(self, base_state):
+        if base_state not in SB_OPPORTUNITIES:
+            raise ValueError("sb_failure: invalid base state! " + str(base_state))
+        runners = self.runners()
+        for origin, dest in self.move_runners(CS):
+            if dest == NOT_ON_BASE:
+                runners[origin].increment_stat(st.CS)
 
-        if base_state in [1, 5]:
-            self.first_base.increment_stat(st.CS)
-            self.first_base = BASE_EMPTY
-        elif base_state == 2:
-            self.second_base.increment_stat(st.CS)
-            self.second_base = BASE_EMPTY
-        # When runners are on 1st and 2nd, assumes the runner at second is
-        #   always thrown out and the runner on first advances to second
-        elif base_state == 3:
-            self.second_base.increment_stat(st.CS)
-            self.second_base = self.first_base
-            self.first_base = BASE_EMPTY
-        else:
-            raise ValueError("sb_failure: invalid base state! " + base_state)
-        self.update_outs()
+    def runners(self):
+        return (self.at_bat, self.first_base, self.second_base,
+                self.third_base)
 
     def get_base_state(self):
         """
@@ -499,69 +693,60 @@ class Game:
         return base_state
 
     def steal_opportunity(self):
-
-        SB_OPPORTUNITIES = [1, 2, 3, 5]
         if self.get_base_state() in SB_OPPORTUNITIES:
             return True
         else:
             return False
 
     def get_sb_info(self):
-
-        sb_info = {}
-
-        sb_info['base_state'] = self.get_base_state()
-        sb_info['pitcher'] = self.pitcher.pid
-        sb_info['catcher'] = self.fielding_team.catcher.pid
-        sb_info['runner_team'] = "runner_team"+self.batting_team.team_id
-        sb_info['pitcher_hand'] = "hand"+self.pitcher.hand
-        sb_info['inning_state'] = "state"+str(sb_info['base_state'])+"_"+str(self.outs)
-        if sb_info['base_state'] in [1, 5]:
-            sb_info['runner'] = self.first_base.pid
+        base_state = self.get_base_state()
+        if base_state in [1, 5]:
+            runner = self.first_base
         else:
-            sb_info['runner'] = self.second_base.pid
-        sb_info['runner_team:pitcher_hand'] = (sb_info['runner_team'] + ":" +
-                                               sb_info['pitcher_hand'])
-        sb_info['runner_team:inning_state'] = (sb_info['runner_team'] + ":" +
-                                               sb_info['inning_state'])
-        sb_info['pitcher_hand:inning_state'] = (sb_info['pitcher_hand'] + ":" +
-                                                sb_info['inning_state'])
-        sb_info['runner_team:pitcher_hand:inning_state'] = (sb_info['runner_team'] + ":" +
-                                                            sb_info['pitcher_hand'] + ":" +
-                                                            sb_info['inning_state'])
-
-        return sb_info
+            runner = self.second_base
+
+        return sb_info_dict(base_state, self.outs, self.pitcher,
+                            self.fielding_team.catcher,
+                            self.batting_team.team_id, runner)
 
     def handle_pitcher_sub(self):
         """
         Check if pitcher should be switched out before plate appearance
         """
+        if self.pitcher_pull_due():
+            self.sub_out_pitcher()
+
+    def pitcher_pull_due(self):
+        """
+        Whether the current pitcher should be pulled given his stats so far
+        The answer only gets more likely with more H, ER and pitches and with
+            fewer IP, which CachedGame relies on
+        """
         # NOTE: IP/ER criteria was somewhat arbitrarily selected.
         # TODO: Verify this doesn't affect pitchers earning wins.
         # TODO: Examine the variabililty of pitch counts around the pitch limit
         #       when pitchers are pulled
         if self.pitcher.get_stat('H') == 0:
-            return
+            return False
         elif self.pitcher.get_stat('ER') == 0 and not self.pitcher.reached_pitch_limit(extra_pitches=20):
-            return
+            return False
         elif self.pitcher.get_stat('IP') < 4 and self.pitcher.get_stat('ER') > 4:
-            self.sub_out_pitcher()
+            return True
         elif 4 <= self.pitcher.get_stat('IP') < 5 and self.pitcher.get_stat('ER') > 5:
-            self.sub_out_pitcher()
+            return True
         elif self.pitcher.get_stat('IP') >= 5 and self.pitcher.get_stat('ER') > 6:
-            self.sub_out_pitcher()
-        elif self.pitcher.reached_pitch_limit():
-            self.sub_out_pitcher()
+            return True
+        return self.pitcher.reached_pitch_limit()
 
-    def handle_player_scores(self, player):
+    def handle_player_scores(self, player, rbi=True):
         """
         Increments the necessary statistics. Assumes not a result of an error
+        The batter only gets an RBI if <rbi>, e.g. not for a runner who steals
         """
         player.resp_pitcher.increment_stat("ER", 1)
         player.increment_stat(st.RUN)
-        # TODO: this should maybe go outside the method. cause for steals AT bat
-        # doesn't get an RBI
-        self.at_bat.increment_stat(st.RBI)
+        if rbi:
+            self.at_bat.increment_stat(st.RBI)
         self.increment_score(1)
 
     def handle_pitch_count(self, event):
@@ -569,33 +754,8 @@ class Game:
         Increments the pitch count of <pitcher> appropriately.
         '''
 
-        # pmf[i] = Prob(plate appearance lasts i pitches | <event>)
-        if event in ("SINGLE", "DOUBLE", "TRIPLE", "HR"):
-            # TODO: takes lots of time cause need to make the random.choice
-            pmf = [0.0, 0.1535, 0.2218, 0.2029, 0.1613, 0.1244, 0.0798, 0.0339,
-                   0.0141, 0.0053, 0.0020, 0.0006, 0.0002, 0.0001, 0.0001]
-            num_pitches = choice(list(range(len(pmf))), pmf)
-            self.pitcher.increment_pitches(num_pitches)
-        elif event == "OUT":
-            pmf = [0.0, 0.1529, 0.2240, 0.2045, 0.1623, 0.1247, 0.0776, 0.0333,
-                   0.0127, 0.0049, 0.0019, 0.0007, 0.0003, 0.0001, 0.0001]
-            num_pitches = choice(list(range(len(pmf))), pmf)
-            self.pitcher.increment_pitches(num_pitches)
-        elif event == "BB":
-            pmf = [0.0, 0.0, 0.0, 0.0, 0.1812, 0.3071, 0.2809, 0.1369, 0.0574,
-                   0.0227, 0.0090, 0.0031, 0.0012, 0.0004, 0.0001]
-            num_pitches = choice(list(range(len(pmf))), pmf)
-            self.pitcher.increment_pitches(num_pitches)
-        elif event == "SO":
-            pmf = [0.0, 0.0, 0.0, 0.1795, 0.2840, 0.2596, 0.1707, 0.0663,
-                   0.0255, 0.0092, 0.0035, 0.0013, 0.0003, 0.0001]
-            num_pitches = choice(list(range(len(pmf))), pmf)
-            self.pitcher.increment_pitches(num_pitches)
-        else:  # event == "HBP"
-            pmf = [0.0, 0.1916, 0.2125, 0.2023, 0.1826, 0.1175, 0.0594, 0.0224,
-                   0.0079, 0.0026, 0.0004, 0.0006, 0.0002]
-            num_pitches = choice(list(range(len(pmf))), pmf)
-            self.pitcher.increment_pitches(num_pitches)
+        num_pitches = PITCH_COUNT_TABLES[event].sample(self.uniforms)
+        self.pitcher.increment_pitches(num_pitches)
 
     def sub_out_pitcher(self):
         '''
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Fast engine that assembles games from cached half innings.
+A half inning's outcome only depends on who leads off and which rates the
+    batters use: against the starter or a reliever, with or without a pinch
+    hitter for their own pitcher. Before simulating, each team plays a
+    library of half innings with the full engine for every such key.
+    CachedGame then plays games in lock-step like BatchGame, a half inning
+    at a time: every active game samples a library entry, which adds its
+    batter stats, runs, starter stats and pitches and hands the lead off to
+    the entry's next batter.
+The one thing an entry can't know is the starter being pulled in the middle
+    of it, which depends on his hits, runs and pitches from earlier innings.
+    Entries keep the starter's line at each of their pull checks, so a game
+    finds the check he is pulled at and credits him with the line up to it,
+    plus the runners he left on base who score later. The rest of the half
+    inning is the entry's own, so its batters keep their rates against the
+    starter until the next half inning.
+Every game samples the same <size> entries per key so the library's own
+    sampling noise doesn't average out over iterations, see
+    simulator.compare_engines for its effect on the means.
+"""
+
+import numpy as np
+
+from .game import Game
+from .batch_game import BatchGame, pull_due, HOME, AWAY
+from . import stat_index as st
+
+
+# Half innings played for each key of a batting team. Smaller libraries
+#   build faster but shift the means by more
+LIBRARY_SIZE = 1000
+
+STARTER = 0
+RELIEVER = 1
+NUM_KEYS = 2*2*9
+
+# Pitcher stats a half inning can change besides his outs and pitches
+PITCHER_FIELDS = ('SO', 'ER', 'H', 'BB', 'HBP')
+
+# A half inning's record is its batters' (9, NUM_STATS) stats, its pre and
+#   then post steal base state counts and then RECORD_FIELDS, the pitcher
+#   fields being those of the pitcher it was played against
+RECORD_FIELDS = ('runs', 'next_leadoff') + PITCHER_FIELDS + ('outs',
+                                                             'pitches')
+STATS_SIZE = 9*st.NUM_STATS
+FIELDS_START = STATS_SIZE + 16
+RECORD_SIZE = FIELDS_START + len(RECORD_FIELDS)
+FIELD = {name: FIELDS_START + i for i, name in enumerate(RECORD_FIELDS)}
+
+# The pitcher's line in the half inning at each of its pull checks, runs
+#   being those scored so far and inherited_ER those that his runners on
+#   base at the check go on to score
+CHECK_FIELDS = PITCHER_FIELDS + ('outs', 'pitches', 'runs', 'inherited_ER')
+CHECK = {name: i for i, name in enumerate(CHECK_FIELDS)}
+# The starter's line in a record and in the checks
+LINE_FIELDS = PITCHER_FIELDS + ('outs', 'pitches')
+
+
+def library_key(role, pinch_hitter, leadoff):
+    """
+    role is whether the batters face the STARTER or a RELIEVER
+    pinch_hitter is whether their own pitcher's slot is pinch hit for
+    Works on arrays as well
+    """
+    return (role*2 + pinch_hitter)*9 + leadoff
+
+
+class HalfInningLibrary:
+    """
+    Sampled half innings of one batting team, size entries for each key.
+    Only teams whose pitcher bats have pinch hitter keys.
+    Entry k*size + i is the ith half inning of key k:
+        records[entry]: its record, see RECORD_FIELDS
+        checks[check_starts[entry]:check_starts[entry + 1]]: the pitcher's
+            CHECK_FIELDS at each of its pull checks, the first one before
+            anything happened
+    """
+    def __init__(self, size, has_pinch_hitter):
+        self.size = size
+        self.has_pinch_hitter = has_pinch_hitter
+        self.records = np.zeros((NUM_KEYS*size, RECORD_SIZE))
+        self.entry_checks = [None]*(NUM_KEYS*size)
+
+    def record(self, entry, game, batting, pitcher):
+        """
+        Records the half inning <game> just played between <batting> and
+            <pitcher>, whose stats only hold that half inning
+        """
+        record = self.records[entry]
+        record[:STATS_SIZE] = batting.stats.ravel()
+        record[STATS_SIZE:STATS_SIZE + 8] = game.pre_state_counts
+        record[STATS_SIZE + 8:FIELDS_START] = game.post_state_counts
+        record[FIELDS_START:] = ((batting.score, batting.at_bat_index) +
+                                 tuple(pitcher.stats[stat]
+                                       for stat in PITCHER_FIELDS) +
+                                 (round(pitcher.stats['IP']*3),
+                                  pitcher.num_pitches))
+        self.entry_checks[entry] = game.checks
+
+    def finish(self):
+        """
+        Packs the recorded checks into one array once every key is built
+        Entries of keys that weren't built, e.g. pinch hitter keys of a team
+            whose pitcher doesn't bat, have no checks and are never sampled
+        """
+        self.check_starts = np.cumsum(
+            [0] + [0 if checks is None else len(checks)
+                   for checks in self.entry_checks])
+        self.checks = np.array([check for checks in self.entry_checks
+                                if checks is not None
+                                for check in checks], dtype=float)
+        self.entry_checks = None
+
+
+class HalfInningGame(Game):
+    """
+    Game that plays the half innings of the libraries with the full engine
+    libraries[away_at_bat] is the HalfInningLibrary of the away (True) or
+        home (False) team batting, built on construction
+    """
+    def __init__(self, home_team, away_team, rng=None, transitions=None,
+                 library_size=LIBRARY_SIZE):
+        Game.__init__(self, home_team, away_team, rng, transitions)
+        self.library_size = library_size
+        self.checks = []
+        self.reached = {}
+        self.scored = []
+        self.build_libraries()
+        self.reset_game()
+
+    def build_libraries(self):
+        self.libraries = {}
+        for away_at_bat in (True, False):
+            batting = self.batting_side(away_at_bat)[0]
+            library = HalfInningLibrary(self.library_size,
+                                        batting.starter.batting_pos is not None)
+            for role in (STARTER, RELIEVER):
+                for pinch_hitter in set((False, library.has_pinch_hitter)):
+                    for leadoff in range(9):
+                        self.build_key(library, away_at_bat, role,
+                                       pinch_hitter, leadoff)
+            library.finish()
+            self.libraries[away_at_bat] = library
+
+    def batting_side(self, away_at_bat):
+        """
+        Returns the (batting, fielding) teams of a half inning
+        """
+        if away_at_bat:
+            return self.away_team, self.home_team
+        return self.home_team, self.away_team
+
+    def build_key(self, library, away_at_bat, role, pinch_hitter, leadoff):
+        self.reset_game()
+        batting, fielding = self.batting_side(away_at_bat)
+        pitcher = fielding.reliever if role == RELIEVER else fielding.starter
+        first_entry = library_key(role, pinch_hitter, leadoff)*library.size
+        for entry in range(first_entry, first_entry + library.size):
+            batting.stats.fill(0)
+            for player in batting.lineup:
+                player.reset_state()
+                if role == RELIEVER:
+                    player.set_facing_reliever()
+            if pinch_hitter:
+                batting.lineup[batting.starter.batting_pos].set_pinch_hitter_sub()
+            batting.score = 0
+            batting.at_bat_index = leadoff
+            pitcher.reset()
+            fielding.pitcher = pitcher
+
+            self.batting_team = batting
+            self.fielding_team = fielding
+            self.away_at_bat = away_at_bat
+            self.pitcher = pitcher
+            self.inning_num = 1
+            self.outs = 0
+            self.clear_bases()
+            self.pre_state_counts = np.zeros(8)
+            self.post_state_counts = np.zeros(8)
+            self.play_half_inning(pitcher_subs=False)
+            library.record(entry, self, batting, pitcher)
+
+    def play_half_inning(self, pitcher_subs=True):
+        """
+        Plays the current half inning out with the full engine
+        Library half innings are played without <pitcher_subs> so that they
+            only hold plate appearances against the one pitcher. Instead his
+            CHECK_FIELDS at each check for a pull are kept in checks.
+        """
+        away_at_bat = self.away_at_bat
+        checks = self.checks = []
+        self.reached = {}
+        self.scored = []
+        while not self.game_over and self.away_at_bat == away_at_bat:
+            if pitcher_subs:
+                self.handle_pitcher_sub()
+            else:
+                stats = self.pitcher.stats
+                checks.append([stats[stat] for stat in PITCHER_FIELDS] +
+                              [self.outs, self.pitcher.num_pitches,
+                               self.batting_team.score, 0])
+            self.at_bat = self.batting_team.at_bat()
+            self.pre_state_counts[self.get_base_state()] += 1
+            self.handle_steals()
+            if not self.game_over and self.away_at_bat == away_at_bat:
+                self.handle_event(self.random_PA())
+
+        # A runner who reached base after check i and scored after check j
+        #   is inherited by a reliever who comes in at the checks in between
+        for reached, scored in self.scored:
+            for check in checks[reached + 1:scored + 1]:
+                check[CHECK['inherited_ER']] += 1
+
+    def handle_event(self, event):
+        self.reached[self.at_bat] = len(self.checks) - 1
+        Game.handle_event(self, event)
+
+    def handle_player_scores(self, player, rbi=True):
+        Game.handle_player_scores(self, player, rbi)
+        self.scored.append((self.reached.get(player, -1),
+                            len(self.checks) - 1))
+
+
+class CachedGame(BatchGame):
+    """
+    Plays many copies of the same matchup in lock-step from the half innings
+        of a HalfInningGame's libraries, see the module docstring
+    Games are played from <start_state> if given, see Game.restore. The half
+        inning it is in the middle of is finished by the full engine, game
+        by game.
+    Only starter stats are tracked, like BatchGame
+    """
+    def __init__(self, home_team, away_team, rng=None, transitions=None,
+                 library_size=LIBRARY_SIZE, start_state=None):
+        BatchGame.__init__(self, home_team, away_team, rng,
+                           transitions=transitions)
+        self.half_innings = HalfInningGame(home_team, away_team, rng,
+                                           transitions, library_size)
+        self.start_state = start_state
+
+    def simulate_games(self, num_games):
+        """
+        Simulates <num_games> games in lock-step, a half inning at a time
+        Returns the results of BatchGame.simulate_games, without the expected
+            points
+        """
+        self.reset_state(num_games)
+        if self.start_state is not None:
+            self.restore_games()
+
+        games = np.flatnonzero(self.active)
+        while len(games) > 0:
+            self.handle_pitcher_sub(games)
+            batting = self.batting[games]
+            for side in (HOME, AWAY):
+                self.replay_half_innings(games[batting == side], side)
+            games = np.flatnonzero(self.active)
+
+        self.handle_end_stats()
+        return self.get_results()
+
+    def restore_games(self):
+        """
+        Puts every game in start_state
+        """
+        state = self.start_state
+        game = self.half_innings
+        mid_inning = state.outs > 0 or state.runners != (None, None, None)
+        # Games at the start of a half inning are all in the same state
+        indexes = range(self.num_games) if mid_inning else [slice(None)]
+        for index in indexes:
+            game.restore(state)
+            game.pre_state_counts = np.zeros(8)
+            game.post_state_counts = np.zeros(8)
+            if mid_inning:
+                game.play_half_inning()
+            self.load_game(index, game)
+
+    def load_game(self, index, game):
+        """
+        Copies the state of the Game <game> into the games at <index>
+        """
+        for side, team in ((HOME, game.home_team), (AWAY, game.away_team)):
+            starter = team.starter
+            self.score[side, index] = team.score
+            self.at_bat_index[side, index] = team.at_bat_index
+            self.player_stats[side, index] = team.stats
+            self.reliever_in[side, index] = team.reliever_in
+            self.meets_win_requirements[side, index] = (
+                starter.meets_win_requirements)
+            for stat in PITCHER_FIELDS:
+                self.starter_stats[stat][side, index] = starter.stats[stat]
+            self.starter_outs[side, index] = round(starter.stats['IP']*3)
+            self.starter_pitches[side, index] = starter.num_pitches
+        self.batting[index] = AWAY if game.away_at_bat else HOME
+        self.inning_num[index] = game.inning_num
+        self.active[index] = not game.game_over
+        self.pre_state_counts += game.pre_state_counts
+        self.post_state_counts += game.post_state_counts
+
+    def replay_half_innings(self, games, batting):
+        """
+        Applies a random library entry for the half inning of <games>, whose
+            <batting> side is up
+        """
+        if len(games) == 0:
+            return
+        fielding = 1 - batting
+        library = self.half_innings.libraries[batting == AWAY]
+        role = self.reliever_in[fielding, games].astype(int)
+        pinch_hitter = (self.reliever_in[batting, games] &
+                        library.has_pinch_hitter)
+        keys = library_key(role, pinch_hitter,
+                           self.at_bat_index[batting, games])
+        entries = keys*library.size + (self.rng.random_sample(len(games)) *
+                                       library.size).astype(int)
+        records = library.records[entries]
+
+        self.player_stats[batting, games] += records[:, :STATS_SIZE].reshape(
+            len(games), 9, st.NUM_STATS)
+        counts = records[:, STATS_SIZE:FIELDS_START].sum(axis=0)
+        self.pre_state_counts += counts[:8]
+        self.post_state_counts += counts[8:]
+
+        starter_in = role == STARTER
+        starters = games[starter_in]
+        lines = records[starter_in, FIELD[LINE_FIELDS[0]]:]
+        rows = self.pull_rows(starters, fielding, library,
+                              entries[starter_in])
+        pulled = rows >= 0
+        checks = library.checks[rows[pulled]]
+        lines[pulled] = checks[:, :len(LINE_FIELDS)]
+        lines[pulled, LINE_FIELDS.index('ER')] += checks[
+            :, CHECK['inherited_ER']]
+
+        for stat in PITCHER_FIELDS:
+            self.starter_stats[stat][fielding, starters] += lines[
+                :, LINE_FIELDS.index(stat)]
+        self.starter_outs[fielding, starters] += lines[
+            :, LINE_FIELDS.index('outs')].astype(int)
+        self.starter_pitches[fielding, starters] += lines[
+            :, LINE_FIELDS.index('pitches')]
+
+        # Pulled starters leave with the lead they had at the check
+        pulled_games = starters[pulled]
+        self.meets_win_requirements[fielding, pulled_games] = (
+            self.score[fielding, pulled_games] >
+            self.score[batting, pulled_games] + checks[:, CHECK['runs']])
+        self.reliever_in[fielding, pulled_games] = True
+
+        self.score[batting, games] += records[:, FIELD['runs']].astype(int)
+        self.at_bat_index[batting, games] = records[
+            :, FIELD['next_leadoff']].astype(int)
+        self.handle_half_inning(games)
+
+    def pull_rows(self, games, fielding, library, entries):
+        """
+        Returns the row of library.checks at which the <fielding> starter of
+            each of <games> is pulled in its entry, -1 if he pitches all of it
+        Pulls only get more likely with more H, ER and pitches and fewer IP,
+            so only entries whose last check would be due with the IP the
+            game starts the half inning with are checked one by one
+        """
+        stats = self.starter_stats
+        hits = stats['H'][fielding, games]
+        earned_runs = stats['ER'][fielding, games]
+        outs = self.starter_outs[fielding, games]
+        pitches = self.starter_pitches[fielding, games]
+        limit = self.pitch_limits[fielding]
+        starts = library.check_starts[entries]
+        ends = library.check_starts[entries + 1]
+
+        rows = np.full(len(games), -1)
+        last = library.checks[ends - 1]
+        pending = np.flatnonzero(pull_due(
+            hits + last[:, CHECK['H']], earned_runs + last[:, CHECK['ER']],
+            outs/3.0, pitches + last[:, CHECK['pitches']], limit))
+        # The first check is before the half inning, which handle_pitcher_sub
+        #   already made
+        offset = 1
+        while len(pending) > 0:
+            pending = pending[starts[pending] + offset < ends[pending]]
+            row = starts[pending] + offset
+            check = library.checks[row]
+            due = pull_due(hits[pending] + check[:, CHECK['H']],
+                           earned_runs[pending] + check[:, CHECK['ER']],
+                           (outs[pending] + check[:, CHECK['outs']])/3.0,
+                           pitches[pending] + check[:, CHECK['pitches']],
+                           limit)
+            rows[pending[due]] = row[due]
+            pending = pending[~due]
+            offset += 1
+        return rows
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Opt-in counters and per-phase timers for the game engines.
+The counters are read off each game once it's over (its stats, whether the
+    starters were pulled and the last inning) so they cost next to nothing.
+The timers wrap the hot methods of one engine instance with timed versions.
+    The classes aren't touched, so engines that aren't timed run exactly the
+    code they always did. Timing costs roughly a microsecond per plate
+    appearance, so the phases add up to a little more than they'd take
+    untimed.
+"""
+
+import time
+
+import numpy as np
+
+from . import stat_index as st
+
+
+# "counters" or "timers", which also counts
+INSTRUMENT_LEVELS = ("counters", "timers")
+
+# Steal attempts are counted per runner, a double steal is two
+COUNTERS = ("plate_appearances", "steal_attempts", "pitcher_subs",
+            "extra_innings")
+
+# Batter stats that end a plate appearance
+PA_STATS = [st.SINGLE, st.DOUBLE, st.TRIPLE, st.HR, st.BB, st.HBP, st.OUT]
+
+# Timed methods of Game and of BatchGame. Game's calc_prob_sb time is part
+#   of handle_steals' and the rest of a game's time is bookkeeping.
+GAME_PHASES = ("random_PA", "handle_steals", "handle_pitch_count",
+               "handle_pitcher_sub")
+BATCH_PHASES = ("handle_plate_appearance", "handle_steals",
+                "handle_pitcher_sub")
+NESTED_PHASES = ("calc_prob_sb", )
+
+
+def check_instrument(instrument):
+    if instrument not in (None, ) + INSTRUMENT_LEVELS:
+        raise ValueError("Unknown instrumentation: " + str(instrument))
+
+
+def timed(method, phase_seconds, phase):
+    """
+    Returns <method> wrapped to add the time of each call to
+        phase_seconds[phase]
+    """
+    clock = time.perf_counter
+
+    def timed_method(*args):
+        start = clock()
+        result = method(*args)
+        phase_seconds[phase] += clock() - start
+        return result
+    return timed_method
+
+
+class TimedStolenBases:
+    """
+    Stands in for a Game's shared StolenBases to time calc_prob_sb
+    """
+    def __init__(self, sb, phase_seconds):
+        self.calc_prob_sb = timed(sb.calc_prob_sb, phase_seconds,
+                                  "calc_prob_sb")
+
+
+class EngineStats:
+    """
+    Counts and times of the games of a run, partial stats merge with +=
+    seconds is the time spent in the engine's simulate calls and
+        phase_seconds the part of it spent in each timed phase
+    """
+    def __init__(self, instrument="counters"):
+        check_instrument(instrument)
+        self.instrument = instrument
+        self.num_games = 0
+        self.seconds = 0.0
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.phase_seconds = {}
+
+    def __add__(self, other):
+        """
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        self.num_games += other.num_games
+        self.seconds += other.seconds
+        for counter, count in other.counts.items():
+            self.counts[counter] += count
+        for phase, seconds in other.phase_seconds.items():
+            self.phase_seconds[phase] = (self.phase_seconds.get(phase, 0.0) +
+                                         seconds)
+        return self
+
+    def time_game(self, game):
+        """
+        Times the phases of <game>, a Game, from now on
+        """
+        if self.instrument != "timers":
+            return
+        for phase in GAME_PHASES + NESTED_PHASES:
+            self.phase_seconds.setdefault(phase, 0.0)
+        for phase in GAME_PHASES:
+            setattr(game, phase, timed(getattr(game, phase),
+                                       self.phase_seconds, phase))
+        game.sb = TimedStolenBases(game.sb, self.phase_seconds)
+
+    def time_batch(self, batch_game):
+        if self.instrument != "timers":
+            return
+        for phase in BATCH_PHASES:
+            self.phase_seconds.setdefault(phase, 0.0)
+            setattr(batch_game, phase, timed(getattr(batch_game, phase),
+                                             self.phase_seconds, phase))
+
+    def count_game(self, game, seconds):
+        """
+        Counts <game>, which has just finished in <seconds>
+        """
+        self.num_games += 1
+        self.seconds += seconds
+        counts = self.counts
+        for team in (game.home_team, game.away_team):
+            stats = team.stats
+            counts["plate_appearances"] += stats[:, PA_STATS].sum()
+            counts["steal_attempts"] += (stats[:, st.SB].sum() +
+                                         stats[:, st.CS].sum())
+            counts["pitcher_subs"] += team.reliever_in
+        counts["extra_innings"] += max(game.inning_num - 9, 0)
+
+    def count_batch(self, batch_game, results, seconds):
+        """
+        Counts the games of <results> that <batch_game> just played in
+            <seconds>
+        """
+        self.num_games += len(results['home_score'])
+        self.seconds += seconds
+        counts = self.counts
+        for name in ('home_playerstats', 'away_playerstats'):
+            stats = results[name]
+            counts["plate_appearances"] += stats[..., PA_STATS].sum()
+            counts["steal_attempts"] += (stats[..., st.SB].sum() +
+                                         stats[..., st.CS].sum())
+        counts["pitcher_subs"] += batch_game.reliever_in.sum()
+        counts["extra_innings"] += np.maximum(batch_game.inning_num - 9,
+                                              0).sum()
+
+    def report(self):
+        """
+        Returns a dict of the games per second and the counts per game, plus
+            the nanoseconds per game in each phase if they were timed
+        games_per_sec is per process, the seconds of parallel workers add up
+        """
+        report = {"games": self.num_games,
+                  "games_per_sec": self.num_games/max(self.seconds, 1e-12)}
+        games = max(self.num_games, 1)
+        for counter in COUNTERS:
+            report[counter + "_per_game"] = self.counts[counter]/float(games)
+        if self.phase_seconds:
+            untimed = self.seconds
+            for phase, seconds in self.phase_seconds.items():
+                report[phase + "_ns_per_game"] = seconds*1e9/games
+                if phase not in NESTED_PHASES:
+                    untimed -= seconds
+            report["bookkeeping_ns_per_game"] = untimed*1e9/games
+        return report
+
+
+def format_report(report):
+    """
+    One line summary of an EngineStats report for the logs
+    """
+    return ", ".join("{}={:.4g}".format(key, float(report[key]))
+                     for key in sorted(report))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Expected batting stats of a lineup from the base-out Markov chain.
+A half inning is an absorbing Markov chain over the 24 base-out states and
+    the lineup slot due up. The plate appearance outcomes come from each
+    batter's rates and the runners move by the same baserunning tables as
+    the game engines, so the expectations are exact without any sampling.
+The chain leaves out steals, mid inning pitching changes, pinch hitters,
+    extra innings and the home team skipping the bottom of the 9th, so it is
+    a fast first pass and a cross-check on simulate, not a replacement.
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import stat_index as st
+from . import batting_rates_index as br
+from .batch_game import BATTER_STAT
+from .player import SP_RATES, RP_RATES
+from .baserunning import (DEFAULT_TRANSITIONS, NOT_ON_BASE, HOME_PLATE,
+                          NUM_OUTS, NUM_BASE_STATES)
+
+
+NUM_SLOTS = 9
+NUM_STATES = NUM_OUTS*NUM_BASE_STATES*NUM_SLOTS
+
+# Column of the expected plate appearances, after the stats
+PA = st.NUM_STATS
+PROJECTION_HEADERS = st.stats + ("PA", "DK pts pred")
+
+
+def state_index(outs, base_state, slot):
+    return (outs*NUM_BASE_STATES + base_state)*NUM_SLOTS + slot
+
+
+def runner_score_probs(rates, transitions=DEFAULT_TRANSITIONS):
+    """
+    rates is the (9, NUM_RATES) array of the lineup's batting rates
+    Returns scores where scores[outs, base_state, base, slot] is the
+        probability that the runner on <base> (0 is first) comes around to
+        score before the inning ends, with <slot> due up
+    """
+    marked = {}
+    for outs in range(NUM_OUTS):
+        for base_state in range(NUM_BASE_STATES):
+            for base in range(3):
+                if base_state & (1 << base):
+                    for slot in range(NUM_SLOTS):
+                        marked[(outs, base_state, base, slot)] = len(marked)
+
+    moves = np.zeros((len(marked), len(marked)))
+    scored = np.zeros(len(marked))
+    for (outs, base_state, base, slot), i in marked.items():
+        next_slot = (slot + 1) % NUM_SLOTS
+        for event in range(br.NUM_RATES):
+            rate = rates[slot, event]
+            if rate == 0:
+                continue
+            for (prob, dests, new_base_state, _,
+                 outs_made) in transitions.entries[event][base_state][outs]:
+                dest = dests[base + 1]
+                new_outs = outs + outs_made
+                if dest == HOME_PLATE:
+                    scored[i] += rate*prob
+                elif dest != NOT_ON_BASE and new_outs < NUM_OUTS:
+                    j = marked[(new_outs, new_base_state, dest - 1, next_slot)]
+                    moves[i, j] += rate*prob
+
+    probs = np.linalg.solve(np.eye(len(marked)) - moves, scored)
+    scores = np.zeros((NUM_OUTS, NUM_BASE_STATES, 3, NUM_SLOTS))
+    for key, i in marked.items():
+        scores[key] = probs[i]
+    return scores
+
+
+def half_inning_expectations(rates, transitions=DEFAULT_TRANSITIONS):
+    """
+    rates is the (9, NUM_RATES) array of the lineup's batting rates
+    transitions is the baserunning.TransitionTable the runners move by
+    Returns (stats, next_leadoff):
+        stats[leadoff, slot] holds the expected stats and plate appearances
+            (PROJECTION_HEADERS without DK) of each slot in a half inning
+            that <leadoff> starts
+        next_leadoff[leadoff, slot] is the probability <slot> leads off the
+            team's next inning
+    """
+    runner_scores = runner_score_probs(rates, transitions)
+    moves = np.zeros((NUM_STATES, NUM_STATES))
+    ends = np.zeros((NUM_STATES, NUM_SLOTS))
+    rewards = np.zeros((NUM_STATES, st.NUM_STATS + 1))
+    for outs in range(NUM_OUTS):
+        for base_state in range(NUM_BASE_STATES):
+            for slot in range(NUM_SLOTS):
+                i = state_index(outs, base_state, slot)
+                next_slot = (slot + 1) % NUM_SLOTS
+                rewards[i, PA] = 1
+                for event in range(br.NUM_RATES):
+                    rate = rates[slot, event]
+                    if rate == 0:
+                        continue
+                    rewards[i, BATTER_STAT[event]] += rate
+                    for (prob, dests, new_base_state, runs,
+                         outs_made) in transitions.entries[event][
+                             base_state][outs]:
+                        weight = rate*prob
+                        new_outs = outs + outs_made
+                        rewards[i, st.RBI] += weight*runs
+                        if dests[0] == HOME_PLATE:
+                            rewards[i, st.RUN] += weight
+                        elif dests[0] != NOT_ON_BASE:
+                            rewards[i, st.RUN] += weight*runner_scores[
+                                new_outs, new_base_state, dests[0] - 1,
+                                next_slot]
+                        if new_outs == NUM_OUTS:
+                            ends[i, next_slot] += weight
+                        else:
+                            moves[i, state_index(new_outs, new_base_state,
+                                                 next_slot)] += weight
+
+    # Expected number of visits to each state from each leadoff's start
+    starts = [state_index(0, 0, slot) for slot in range(NUM_SLOTS)]
+    visits = np.linalg.solve(np.eye(NUM_STATES) - moves.T,
+                             np.eye(NUM_STATES)[:, starts]).T
+
+    state_slots = np.arange(NUM_STATES) % NUM_SLOTS
+    stats = np.zeros((NUM_SLOTS, NUM_SLOTS, st.NUM_STATS + 1))
+    for slot in range(NUM_SLOTS):
+        batting = state_slots == slot
+        stats[:, slot] = np.dot(visits[:, batting], rewards[batting])
+    return stats, np.dot(visits, ends)
+
+
+def lineup_rates(team, mode=SP_RATES):
+    """
+    Returns the (9, NUM_RATES) array of <team>'s rates in <mode>, one of
+        the player module's SP_RATES, RP_RATES or PINCH_RATES
+    """
+    return team.rates[:, :, mode]
+
+
+def project_lineup(team, innings=9, starter_innings=None,
+                   transitions=DEFAULT_TRANSITIONS):
+    """
+    Expected stats of each of <team>'s batters over <innings> innings
+    The batters' sp rates are already those against the opposing starter,
+        who is faced for the first <starter_innings> (default all of them)
+        before the rp rates take over.
+    Fractional innings are weighted, e.g. innings=8.5 for a home team that
+        skips the bottom of the 9th half the time.
+    transitions is the baserunning.TransitionTable the runners move by
+    Returns a DataFrame indexed by lineup slot with PROJECTION_HEADERS columns
+    """
+    if starter_innings is None:
+        starter_innings = innings
+    expectations = [half_inning_expectations(lineup_rates(team, SP_RATES),
+                                             transitions)]
+    if starter_innings < innings:
+        expectations.append(half_inning_expectations(
+            lineup_rates(team, RP_RATES), transitions))
+
+    totals = np.zeros((NUM_SLOTS, st.NUM_STATS + 1))
+    leadoff = np.zeros(NUM_SLOTS)
+    leadoff[0] = 1.0
+    inning = 0
+    while inning < innings:
+        weight = min(1.0, innings - inning)
+        vs_starter = min(1.0, max(0.0, starter_innings - inning))
+        stats = vs_starter*expectations[0][0]
+        next_leadoff = vs_starter*expectations[0][1]
+        if vs_starter < 1:
+            stats = stats + (1 - vs_starter)*expectations[1][0]
+            next_leadoff = next_leadoff + (1 - vs_starter)*expectations[1][1]
+        totals += weight*np.tensordot(leadoff, stats, axes=1)
+        leadoff = np.dot(leadoff, next_leadoff)
+        inning += 1
+
+    dk_pts = np.dot(totals[:, :st.NUM_STATS], st.DK_multiplier)
+    return pd.DataFrame(np.column_stack((totals, dk_pts)),
+                        columns=PROJECTION_HEADERS)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Opt-in store of every iteration's outcomes for analysis after a run.
+Each field of OUTCOME_FIELDS is a memory-mapped .npy file in the store's
+    directory with one row per iteration, so runs far larger than memory can
+    be written chunk by chunk and read back a slice at a time without
+    copying. Worker processes write their own rows of the same files.
+meta.json records how many iterations were run, since an adaptive run can
+    stop before filling the files. Plain .npy files and json can be read
+    outside python too, e.g. with RcppCNPy and jsonlite in R.
+"""
+
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from .accumulators import NUM_DK_SCORES
+from .pitcher import SCORED_STATS, scored_stats_array
+
+
+# (name, dtype, shape of one iteration's record)
+# The DK score rows are laid out like simulate's keep_dk_scores rows
+OUTCOME_FIELDS = (("home_dk_scores", np.float64, (NUM_DK_SCORES,)),
+                  ("away_dk_scores", np.float64, (NUM_DK_SCORES,)),
+                  ("home_runs", np.int32, ()),
+                  ("away_runs", np.int32, ()),
+                  ("home_pitcher", np.float64, (len(SCORED_STATS),)),
+                  ("away_pitcher", np.float64, (len(SCORED_STATS),)))
+
+META_FILE = "meta.json"
+
+
+def field_path(path, name):
+    return os.path.join(path, name + ".npy")
+
+
+class OutcomeStore:
+    """
+    Writes outcomes into the files of <path>, which have room for <capacity>
+        iterations. The files are only mapped when first written to, so a
+        store can be sent to worker processes.
+    """
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.columns = None
+
+    def __getstate__(self):
+        return {"path": self.path, "capacity": self.capacity, "columns": None}
+
+    def create(self):
+        """
+        Creates the store's files, overwriting any previous run in <path>
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for name, dtype, shape in OUTCOME_FIELDS:
+            open_memmap(field_path(self.path, name), mode="w+", dtype=dtype,
+                        shape=(self.capacity,) + shape)
+        self.write_meta(0)
+        return self
+
+    def open(self):
+        if self.columns is None:
+            self.columns = {name: open_memmap(field_path(self.path, name),
+                                              mode="r+")
+                            for name, _, _ in OUTCOME_FIELDS}
+        return self.columns
+
+    def write_game(self, iteration, results, home_scores, away_scores):
+        """
+        results is a boxscore from Game.get_boxscore and home_scores and
+            away_scores are its DK score rows
+        """
+        columns = self.open()
+        columns["home_dk_scores"][iteration] = home_scores
+        columns["away_dk_scores"][iteration] = away_scores
+        columns["home_runs"][iteration] = results[4]
+        columns["away_runs"][iteration] = results[5]
+        columns["home_pitcher"][iteration] = scored_stats_array(
+            results[2].get_dict())
+        columns["away_pitcher"][iteration] = scored_stats_array(
+            results[3].get_dict())
+
+    def write_batch(self, first_iteration, results, home_scores, away_scores):
+        """
+        results is the output of BatchGame.simulate_games and home_scores
+            and away_scores hold one DK score row per game
+        """
+        columns = self.open()
+        rows = slice(first_iteration, first_iteration + len(home_scores))
+        columns["home_dk_scores"][rows] = home_scores
+        columns["away_dk_scores"][rows] = away_scores
+        columns["home_runs"][rows] = results['home_score']
+        columns["away_runs"][rows] = results['away_score']
+        columns["home_pitcher"][rows] = scored_stats_array(
+            results['home_pitcher'])
+        columns["away_pitcher"][rows] = scored_stats_array(
+            results['away_pitcher'])
+
+    def flush(self):
+        if self.columns is not None:
+            for column in self.columns.values():
+                column.flush()
+
+    def write_meta(self, num_iterations):
+        meta = {"num_iterations": int(num_iterations),
+                "capacity": self.capacity,
+                "fields": [name for name, _, _ in OUTCOME_FIELDS],
+                "pitcher_stats": list(SCORED_STATS)}
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+
+def load_outcomes(path):
+    """
+    Returns a dict of the outcomes stored in <path>, each a read only memory
+        map of the iterations that were run
+    """
+    with open(os.path.join(path, META_FILE)) as f:
+        num_iterations = json.load(f)["num_iterations"]
+    return {name: np.load(field_path(path, name), mmap_mode="r")[:num_iterations]
+            for name, _, _ in OUTCOME_FIELDS}
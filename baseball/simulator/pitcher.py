@@ -3,12 +3,35 @@
 import numpy as np
 
 
+# Stats tracked for every pitcher, all zeroed at the start of a game
+PITCHER_STATS = ('IP', 'SO', 'W', 'ER', 'H', 'BB', 'HBP', 'CG', 'CGSO', 'NH',
+                 'dk_score')
+# Stats that score fantasy points, i.e. all of PITCHER_STATS but the score
+SCORED_STATS = PITCHER_STATS[:-1]
+
+# DK points weighting for each stat corresponding to SCORED_STATS
+DK_multiplier = [2.25, 2, 4, -2, -.6, -.6, -.6, 2.5, 2.5, 5]
+
+
+def scored_stats_array(stats):
+    """
+    Stacks the SCORED_STATS of <stats>, a Pitcher's stats dict or a dict of
+        per game arrays, along a new last axis
+    """
+    return np.stack([np.asarray(stats[key], dtype=float)
+                     for key in SCORED_STATS], axis=-1)
+
+
 class Pitcher:
+    __slots__ = ("role", "pid", "hand", "batting_pos", "pitch_limit", "stats",
+                 "num_pitches", "meets_win_requirements", "lead_changes")
+
     def __init__(self, role="Default", pid="Default", hand="R", pitch_limit=95):
         self.role = role
         self.pid = pid
         self.hand = hand
         self.batting_pos = None
+        self.stats = dict.fromkeys(PITCHER_STATS, 0)
         self.reset()
 
         # NOTE: We shift pitch_limit down by 3 to account for a manager pulling
@@ -46,17 +69,13 @@ class Pitcher:
         return self
 
     def reset(self):
-        self.stats = {'IP': 0.0,
-                      'SO': 0,
-                      'W': 0,
-                      'ER': 0,
-                      'H': 0,
-                      'BB': 0,
-                      'HBP': 0,
-                      'CG': 0,
-                      'CGSO': 0,
-                      'NH': 0,
-                      'dk_score': 0}
+        """
+        Zeroes the stats in place for a new game
+        """
+        stats = self.stats
+        for key in stats:
+            stats[key] = 0
+        stats['IP'] = 0.0
         self.num_pitches = 0
         self.meets_win_requirements = False
         self.lead_changes = 0
@@ -130,11 +149,8 @@ class Pitcher:
         """
         Calculates the draftkings score and stores it in self.stats['dk_score']
         """
-        # TODO: convert stats into array like batter stats and use dot product
         stats = self.stats
-        dk_points = 2.25*stats["IP"] + 2*stats["SO"] - 2*stats["ER"] + \
-                    4*stats["W"] - .6*stats["H"] - \
-                    .6*stats["BB"] - .6*stats["HBP"] + \
-                    2.5*stats["CG"] + 2.5*stats["CGSO"] + 5*stats["NH"]
+        dk_points = float(np.dot([stats[key] for key in SCORED_STATS],
+                                 DK_multiplier))
         self.stats['dk_score'] = dk_points
         return dk_points
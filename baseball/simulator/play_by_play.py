@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Opt-in play-by-play log of simulated games, for when the aggregates look
+    off and single games need to be looked at.
+Every plate appearance the game engine plays becomes a fixed width
+    RECORD_DTYPE record. Records are buffered CHUNK_RECORDS at a time,
+    compressed with zlib and appended to a .pbp file in the log's
+    directory. Each chunk of iterations writes its own file, named after
+    its first iteration, so worker processes don't share files. A chunk is
+    its compressed size as a little-endian uint32 followed by the zlib data
+    of its raw records.
+meta.json maps the batter and pitcher columns back to pids: batter is the
+    lineup slot of the batting team and pitcher is 0 for the fielding
+    team's starter and 1 for its reliever. top is 1 when the away team bats.
+Only the Game instances a writer is attached to record anything, as a
+    plate appearance hook, every other game plays without it.
+"""
+
+import glob
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from . import batting_rates_index as br
+
+
+RECORD_DTYPE = np.dtype([("iteration", "<u4"), ("inning", "u1"),
+                         ("top", "u1"), ("outs", "u1"), ("base_state", "u1"),
+                         ("batter", "u1"), ("pitcher", "u1"),
+                         ("event", "u1"), ("runs", "u1"), ("pitches", "u1")])
+
+# Index of each batting event in the event column
+EVENT_INDEX = {event: i for i, event in enumerate(br.batting_events)}
+
+# Records compressed together, about 13KB raw
+CHUNK_RECORDS = 1024
+
+FILE_PATTERN = "iterations_{:010d}.pbp"
+META_FILE = "meta.json"
+CHUNK_HEADER = struct.Struct("<I")
+
+
+def record_play_by_play(game, writer):
+    """
+    Makes <game> append a record of each plate appearance it plays to
+        <writer>, at the writer's current iteration
+    Only this game instance is changed, others play without recording. A
+        game can only record to one writer.
+    """
+    for hook in game.plate_appearance_hooks:
+        if isinstance(hook, PlayByPlayRecorder):
+            raise ValueError("The game already records play by play")
+    game.add_plate_appearance_hook(PlayByPlayRecorder(writer))
+
+
+class PlayByPlayRecorder:
+    """
+    Plate appearance hook of a Game, see Game.add_plate_appearance_hook,
+        that appends a record of each plate appearance to <writer>
+    """
+    def __init__(self, writer):
+        self.writer = writer
+
+    def before_event(self, game, event):
+        batting_team = game.batting_team
+        pitcher = game.pitcher
+        self.batting_team = batting_team
+        self.score = batting_team.score
+        self.pitches = pitcher.num_pitches
+        self.state = (self.writer.iteration, game.inning_num,
+                      game.away_at_bat, game.outs, game.get_base_state(),
+                      batting_team.at_bat_index,
+                      pitcher is not game.fielding_team.starter)
+        self.pitcher = pitcher
+
+    def after_event(self, game, event):
+        self.writer.append(self.state + (
+            EVENT_INDEX[event], self.batting_team.score - self.score,
+            self.pitcher.num_pitches - self.pitches))
+
+
+class PlayByPlayWriter:
+    """
+    Appends compressed chunks of records to the file <path>
+    """
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.records = np.zeros(CHUNK_RECORDS, dtype=RECORD_DTYPE)
+        self.size = 0
+        self.iteration = 0
+
+    def append(self, record):
+        self.records[self.size] = record
+        self.size += 1
+        if self.size == CHUNK_RECORDS:
+            self.write_chunk()
+
+    def write_chunk(self):
+        if self.size == 0:
+            return
+        data = zlib.compress(self.records[:self.size].tobytes())
+        self.file.write(CHUNK_HEADER.pack(len(data)))
+        self.file.write(data)
+        self.size = 0
+
+    def close(self):
+        self.write_chunk()
+        self.file.close()
+
+
+class PlayByPlayLog:
+    """
+    The directory <path> a run's play-by-play is written to. It only holds
+        the path, so a log can be sent to worker processes.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def create(self, home_team, away_team):
+        """
+        Empties the directory of any previous run and writes meta.json for
+            the run of <home_team> against <away_team>
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for old_file in glob.glob(os.path.join(self.path, "*.pbp")):
+            os.remove(old_file)
+        meta = {"fields": list(RECORD_DTYPE.names),
+                "events": list(br.batting_events)}
+        for side, team in (("home", home_team), ("away", away_team)):
+            meta[side + "_lineup"] = [player.pid for player in team.lineup]
+            meta[side + "_starter"] = team.starter.pid
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(meta, f)
+        return self
+
+    def writer(self, first_iteration):
+        """
+        Returns a PlayByPlayWriter for the chunk of iterations starting at
+            <first_iteration>
+        """
+        return PlayByPlayWriter(os.path.join(
+            self.path, FILE_PATTERN.format(first_iteration)))
+
+
+def read_play_by_play_file(path):
+    """
+    Returns the records of the .pbp file <path>
+    """
+    chunks = []
+    with open(path, "rb") as f:
+        header = f.read(CHUNK_HEADER.size)
+        while header:
+            size, = CHUNK_HEADER.unpack(header)
+            chunks.append(np.frombuffer(zlib.decompress(f.read(size)),
+                                        dtype=RECORD_DTYPE))
+            header = f.read(CHUNK_HEADER.size)
+    if not chunks:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.concatenate(chunks)
+
+
+def load_play_by_play(path):
+    """
+    Returns every record in the directory <path> as one RECORD_DTYPE
+        structured array in iteration order
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.pbp")))
+    if not files:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.concatenate([read_play_by_play_file(name) for name in files])
+
+
+def load_play_by_play_meta(path):
+    """
+    Returns the meta.json of the directory <path>: the lineups and starters
+        the batter and pitcher columns refer to and the batting events
+    """
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
@@ -6,9 +6,20 @@ from . import stat_index as st
 from . import batting_rates_index as br
 from . import misc_rates_index as mr
 
+from .sampling import CategoricalTable
+
+import numpy as np
 import pandas as pd
 
 
+# Each batter has a set of rates against the starter, against relievers
+#   and for when he's pinch hit for
+SP_RATES = 0
+RP_RATES = 1
+PINCH_RATES = 2
+NUM_RATE_MODES = 3
+
+
 def default_batting_event_rates():
     return pd.Series([0.0]*br.NUM_RATES,
                      index=br.batting_events)
@@ -23,26 +34,54 @@ def normalize_batting_rates(batting_rates):
     batting_rates[br.OUT] = 1.0 - sum(batting_rates[:-1])
 
 
+def batting_rates_array(rates):
+    """
+    Returns <rates> as an array in batting_events order. A pd.Series indexed
+        by the event names is reordered by them, anything else is taken in order
+    """
+    if isinstance(rates, pd.Series) and set(br.batting_events) <= set(rates.index):
+        rates = rates[list(br.batting_events)]
+    return np.asarray(rates, dtype=float)
+
+
 class Player:
+    """
+    A batter's info, batting rates and game stats
+    rates is the (NUM_RATES, NUM_RATE_MODES) array of his three sets of rates,
+        sp_batting_rates, rp_batting_rates and pinch_hitter_rates are views
+        of its columns and stats is an array of NUM_STATS.
+    Once the player is in a lineup his rates and stats are views into the
+        arrays of his Team (see bind) so they should only be updated in place
+    """
+    __slots__ = ("age", "pid", "position", "bat_hand", "switch_hitter",
+                 "rates", "stats", "misc_rates", "sp_batting_rates",
+                 "rp_batting_rates", "pinch_hitter_rates", "rate_mode",
+                 "batting_rates", "tables", "batting_table", "expected_pts",
+                 "facing_starter", "resp_pitcher")
+
+    # Derived from rates by bind so they aren't pickled
+    VIEWS = ("sp_batting_rates", "rp_batting_rates", "pinch_hitter_rates",
+             "batting_rates")
+
     def __init__(self, age=-1, pid="", position="",
                  bat_hand="", switch_hitter=False):
-        self.stats = [0]*st.NUM_STATS
         self.age = age
         self.pid = pid
         self.position = position
         self.bat_hand = bat_hand
         self.switch_hitter = switch_hitter
-        # The batting rates against sp_pitcher (starting pitcher)
-        self.sp_batting_rates = default_batting_event_rates()
-        # Against rp_pitcher (generic reliever pitcher)
-        self.rp_batting_rates = default_batting_event_rates()
-        self.pinch_hitter_rates = default_batting_event_rates()
+        self.rate_mode = SP_RATES
+        self.tables = None
+        self.bind(np.zeros((br.NUM_RATES, NUM_RATE_MODES)),
+                  np.zeros(st.NUM_STATS))
         self.reset()
 
         self.misc_rates = default_misc_event_rates()
-        # TODO: should we do CDF method?
-        normalize_batting_rates(self.batting_rates)
+        normalize_batting_rates(self.sp_batting_rates)
+        normalize_batting_rates(self.rp_batting_rates)
+        normalize_batting_rates(self.pinch_hitter_rates)
         assert(sum(self.batting_rates) == 1)
+        self.compile_rates()
 
     def __str__(self):
         return str(self.stats) + "\nstarter rates: " + str(self.sp_batting_rates)
@@ -50,31 +89,89 @@ class Player:
     def __repr__(self):
         return "mlb_id: {}".format(self.pid)
 
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if name not in self.VIEWS and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.bind(self.rates, self.stats)
+
+    def bind(self, rates, stats):
+        """
+        Moves the player's rates and stats into the arrays <rates> and
+            <stats>, e.g. his rows of his Team's arrays, and points the
+            views at them
+        """
+        if hasattr(self, "rates") and rates is not self.rates:
+            rates[:] = self.rates
+            stats[:] = self.stats
+        self.rates = rates
+        self.stats = stats
+        self.sp_batting_rates = rates[:, SP_RATES]
+        self.rp_batting_rates = rates[:, RP_RATES]
+        self.pinch_hitter_rates = rates[:, PINCH_RATES]
+        self.batting_rates = rates[:, self.rate_mode]
+
     def reset(self):
         """
         Resets player for a new game
         """
-        self.stats = [0]*st.NUM_STATS
-        # Reference to whichever rates are currently relevant
+        self.stats.fill(0)
+        self.reset_state()
+
+    def reset_state(self):
+        """
+        Resets everything but the stats for a new game
+        """
+        # Sum of the expected DK points of each plate appearance's rates,
+        #   only kept by a Game that track_expected_pts
+        self.expected_pts = 0.0
+        # Tracks whichever rates are currently relevant
         self.facing_starter = True
-        self.batting_rates = self.sp_batting_rates
+        self.set_rate_mode(SP_RATES)
+
+    def set_rate_mode(self, mode):
+        self.rate_mode = mode
+        self.batting_rates = self.rates[:, mode]
+        if self.tables is not None:
+            self.batting_table = self.tables[mode]
+
+    def compile_rates(self):
+        """
+        Compiles each set of batting rates into a CategoricalTable for the
+            game engine to sample from. batting_table tracks batting_rates.
+        Each table's mean is the expected DK points of the batting event.
+        Called by every rates setter so the tables never go stale.
+        """
+        self.tables = tuple(CategoricalTable(br.batting_events,
+                                             self.rates[:, mode],
+                                             br.DK_points)
+                            for mode in range(NUM_RATE_MODES))
+        self.batting_table = self.tables[self.rate_mode]
 
     def get_batting_rates(self):
-        return self.batting_rates
+        """
+        Returns a copy of the current rates as a pd.Series indexed by event
+        """
+        return pd.Series(self.batting_rates, index=br.batting_events)
+
+    def set_rates(self, mode, rates):
+        # Update in place so that the views and the Team's rates stay
+        #   connected instead of severing the connection
+        self.rates[:, mode] = batting_rates_array(rates)
+        normalize_batting_rates(self.rates[:, mode])
+        self.compile_rates()
 
     def set_rp_batting_rates(self, rates):
-        self.rp_batting_rates[:] = rates
-        normalize_batting_rates(self.rp_batting_rates)
+        self.set_rates(RP_RATES, rates)
 
     def set_sp_batting_rates(self, rates):
-        # Update in place so that batting_rates still points to the correct
-        # version of sp_batting_rates instead of severing the connection
-        self.sp_batting_rates[:] = rates
-        normalize_batting_rates(self.sp_batting_rates)
+        self.set_rates(SP_RATES, rates)
 
     def set_pinch_hitter_rates(self, rates):
-        self.pinch_hitter_rates[:] = rates
-        normalize_batting_rates(self.pinch_hitter_rates)
+        self.set_rates(PINCH_RATES, rates)
 
     def set_facing_reliever(self):
         # Only change stats if currently facing a starter
@@ -82,14 +179,14 @@ class Player:
         # TODO: if switch_hitter set bat_hand to be S?
         if self.facing_starter:
             self.facing_starter = False
-            self.batting_rates = self.rp_batting_rates
+            self.set_rate_mode(RP_RATES)
 
     def set_pinch_hitter_sub(self):
         # WARNING: Not technically true but necessary to prevent overwriting
         # TODO: this will mess up the average DK pts by spot in lineup even if we
         # throw out the stats for the batting pitcher at the end
         self.facing_starter = False
-        self.batting_rates = self.pinch_hitter_rates
+        self.set_rate_mode(PINCH_RATES)
 
     def set_misc_rates(self, rates):
         self.misc_rates = rates
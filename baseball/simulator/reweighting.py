@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Projections under modified batting rates without simulating again.
+Everything in a game but the plate appearance outcomes is drawn the same
+    way whatever the batting rates, so the likelihood ratio of a simulated
+    game under new rates q against the rates p it was played with only
+    depends on how often each batter drew each event with each of his sets
+    of rates: prod (q/p)^count. Recording those counts with every game's DK
+    scores lets the scores be reweighted to any new rates, e.g. those of a
+    PlayerCustomizations.adjust_rates tweak, and gives the derivative of
+    every mean score with respect to each rate.
+The reweighted means are only as good as the effective sample size of the
+    weights, which drops fast as the rates move away from p. Below
+    MIN_EFFECTIVE_FRACTION of the iterations a warning says to simulate
+    again. Rates that were 0 when simulating can't be raised at all.
+Only the game engine records the counts: the batch engine draws the plate
+    appearances in bulk and the cached engine replays them.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from .accumulators import DK_SCORE_HEADERS, NUM_DK_SCORES
+from .pitcher import SCORED_STATS, scored_stats_array
+from .player import NUM_RATE_MODES, SP_RATES
+from . import batting_rates_index as br
+
+
+# Reweighted projections warn when the effective sample size is a smaller
+#   fraction of the iterations than this
+MIN_EFFECTIVE_FRACTION = 0.1
+
+# Index of each batting event as returned by the batters' batting_tables
+EVENT_INDEX = {event: i for i, event in enumerate(br.batting_events)}
+
+SIDES = ("home", "away")
+
+# Headers of a side's DK score rows: its batters, own and opposing pitcher
+SCORE_HEADERS = DK_SCORE_HEADERS + ["opp pitcher"]
+
+
+def count_plate_appearances(game, counts):
+    """
+    Makes <game> add one to counts[side, slot, event, rate mode] for the
+        batter of each plate appearance it plays, side 0 being home
+    Only this game instance is changed, others play without counting
+    """
+    game.add_plate_appearance_hook(PlateAppearanceCounter(counts))
+
+
+class PlateAppearanceCounter:
+    """
+    Plate appearance hook of a Game, see Game.add_plate_appearance_hook,
+        that counts the plate appearances into <counts>
+    """
+    def __init__(self, counts):
+        self.counts = counts
+
+    def before_event(self, game, event):
+        self.counts[int(game.away_at_bat), game.batting_team.at_bat_index,
+                    EVENT_INDEX[event], game.at_bat.rate_mode] += 1
+
+    def after_event(self, game, event):
+        pass
+
+
+def team_rates(home_team, away_team):
+    """
+    (2, 9, NUM_RATES, NUM_RATE_MODES) rates of the home and then away batters
+    """
+    return np.array([home_team.rates, away_team.rates], dtype=float)
+
+
+class PlateAppearanceRecord:
+    """
+    Per iteration plate appearance counts and DK scores of a run, played
+        with the rates of team_rates. Partial records merge with +=
+    counts[iteration] is indexed like the rates, by side, slot, event and
+        rate mode, scores[iteration] holds the home and away DK score rows
+        laid out like simulate's keep_dk_scores rows and
+        pitcher_stats[iteration] the SCORED_STATS of the home and away
+        starters
+    """
+    def __init__(self, rates):
+        self.rates = np.array(rates, dtype=float)
+        self.counts = []
+        self.scores = []
+        self.pitcher_stats = []
+
+    def __add__(self, other):
+        """
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        self.finish()
+        other.finish()
+        self.counts = np.concatenate((self.counts, other.counts))
+        self.scores = np.concatenate((self.scores, other.scores))
+        self.pitcher_stats = np.concatenate((self.pitcher_stats,
+                                             other.pitcher_stats))
+        return self
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add_game(self, counts, boxscore, home_scores, away_scores):
+        """
+        boxscore is the game's Game.get_boxscore and home_scores and
+            away_scores its DK score rows
+        """
+        self.counts.append(counts.copy())
+        self.scores.append((home_scores, away_scores))
+        self.pitcher_stats.append(
+            (scored_stats_array(boxscore[2].get_dict()),
+             scored_stats_array(boxscore[3].get_dict())))
+
+    def finish(self):
+        """
+        Packs the games added so far into arrays
+        """
+        self.counts = np.reshape(np.array(self.counts, dtype=np.int16),
+                                 (-1, 2, 9, br.NUM_RATES, NUM_RATE_MODES))
+        self.scores = np.reshape(np.array(self.scores, dtype=float),
+                                 (-1, 2, NUM_DK_SCORES))
+        self.pitcher_stats = np.reshape(
+            np.array(self.pitcher_stats, dtype=float),
+            (-1, 2, len(SCORED_STATS)))
+        return self
+
+    def log_weights(self, rates):
+        """
+        Returns the log likelihood ratio of each iteration under <rates>,
+            shaped like team_rates, against the rates it was played with
+        """
+        self.finish()
+        rates = np.asarray(rates, dtype=float)
+        changed = rates != self.rates
+        if (changed & (self.rates == 0)).any():
+            raise ValueError("Rates that were 0 when simulating can't be "
+                             "reweighted")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_ratios = np.where(changed, np.log(rates) - np.log(self.rates),
+                                  0.0)
+        drawn = self.counts[:, changed]
+        if drawn.size == 0:
+            return np.zeros(len(self))
+        # 0 draws of an event whose rate became 0 don't change the weight
+        return np.where(drawn > 0, drawn*log_ratios[changed], 0.0).sum(axis=1)
+
+    def weights(self, rates, warn=True):
+        """
+        Returns the self-normalized weights of the iterations under <rates>,
+            shaped like team_rates, and their effective sample size
+        Warns when the effective sample size is too small to trust, unless
+            not <warn>
+        """
+        log_weights = self.log_weights(rates)
+        weights = np.exp(log_weights - log_weights.max())
+        effective_sample_size = weights.sum()**2/(weights**2).sum()
+        if warn and effective_sample_size < MIN_EFFECTIVE_FRACTION*len(self):
+            warnings.warn("Reweighted projection has an effective sample size "
+                          "of {:.0f} out of {} iterations, simulate the new "
+                          "rates instead".format(effective_sample_size,
+                                                 len(self)), RuntimeWarning)
+        return weights/weights.sum(), effective_sample_size
+
+    def reweight(self, home_team, away_team):
+        """
+        Projects the run under the current rates of <home_team> and
+            <away_team>, e.g. after PlayerCustomizations.adjust_rates
+        Returns a dict of the reweighted mean DK scores in projections, a
+            DataFrame indexed by side and SCORE_HEADERS with the change from
+            the simulated means, and the effective_sample_size of the weights
+        """
+        weights, effective_sample_size = self.weights(
+            team_rates(home_team, away_team))
+        means = np.tensordot(weights, self.scores, axes=1)
+        projections = pd.DataFrame(
+            {"DK pts pred": means.ravel(),
+             "delta": (means - self.scores.mean(axis=0)).ravel()},
+            index=pd.MultiIndex.from_product([SIDES, SCORE_HEADERS]),
+            columns=["DK pts pred", "delta"])
+        return {'projections': projections,
+                'effective_sample_size': effective_sample_size}
+
+    def rate_sensitivities(self, side, slot, mode=SP_RATES):
+        """
+        Derivatives of the mean DK scores with respect to each rate of the
+            batter in <slot> of <side> (0 home, 1 away) under rate <mode>,
+            with OUT taking up the difference as normalize_batting_rates does
+        Returns a DataFrame indexed by the other batting events with a column
+            per side and SCORE_HEADERS, nan for rates that were 0
+        """
+        self.finish()
+        rates = self.rates[side, slot, :, mode]
+        counts = self.counts[:, side, slot, :, mode]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Derivative of each iteration's log likelihood
+            scores = (counts[:, :br.OUT]/rates[:br.OUT] -
+                      (counts[:, br.OUT]/rates[br.OUT])[:, None])
+        scores[:, rates[:br.OUT] == 0] = np.nan
+        dk_scores = self.scores.reshape(len(self), -1)
+        covariances = (np.dot(scores.T, dk_scores)/len(self) -
+                       np.outer(scores.mean(axis=0), dk_scores.mean(axis=0)))
+        return pd.DataFrame(covariances, index=br.batting_events[:br.OUT],
+                            columns=pd.MultiIndex.from_product(
+                                [SIDES, SCORE_HEADERS]))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Fast sampling of the categorical distributions used by the game engines.
+Distributions are compiled into cdf tables once and then sampled with
+    uniforms that are drawn from numpy a block at a time.
+Also derives the seeded random substreams the engines draw from.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+
+
+# Number of uniforms prefetched from numpy per refill
+BLOCK_SIZE = 4096
+# Smaller blocks for buffers that are reseeded every game
+GAME_BLOCK_SIZE = 128
+
+# Keys that keep the substreams derived from one seed apart
+CHUNK_STREAM = 0
+GAME_STREAM = 1
+# Within a game the plate appearance outcomes get their own stream so that an
+#   extra draw for a steal or pitch count doesn't shift every later PA draw
+PA_DRAWS = 0
+OTHER_DRAWS = 1
+
+
+def compile_cdf(probs):
+    """
+    Returns the cdf of <probs> as a numpy array.
+    The final total is forced to exactly 1 so that rounding in the input
+        can't cause a draw to fall off the end. Trailing zero probability
+        outcomes can never be drawn.
+    """
+    cdf = np.cumsum(np.asarray(probs, dtype=float))
+    cdf[cdf >= cdf[-1]] = 1.0
+    return cdf
+
+
+def sample_cdf(cdfs, uniforms):
+    """
+    Vectorized inverse cdf sampling.
+    cdfs is a 2d array where each row is the cdf used for that draw
+    Returns the index of the first entry in each row >= the uniform
+    """
+    return np.minimum((uniforms[:, None] > cdfs).sum(axis=1),
+                      cdfs.shape[1] - 1)
+
+
+def substream(seed, *keys):
+    """
+    Returns a RandomState for the substream of <seed> identified by <keys>
+    The keys are mixed into the Mersenne Twister seeding so every
+        combination gives a different, reproducible stream
+    """
+    return np.random.RandomState(substream_key(seed, *keys))
+
+
+def substream_key(seed, *keys):
+    """
+    The seed array of the substream, can be passed to RandomState.seed
+    NOTE: reseeding an existing RandomState is >10x faster than making one
+    """
+    return [seed] + list(keys)
+
+
+class RandomStreams:
+    """
+    Hands out the random substreams of a single seed.
+    Chunks of iterations draw from the stream of their first iteration so a
+        run is reproducible for a given split of the work.
+    With common_random_numbers every game also gets its own substreams keyed
+        by its iteration number. Two runs with the same seed then play game i
+        on the same draws however the iterations are split, which makes the
+        difference between two configurations far less noisy.
+    """
+    def __init__(self, seed, common_random_numbers=False, keys=()):
+        self.seed = seed
+        self.common_random_numbers = common_random_numbers
+        self.keys = tuple(keys)
+
+    def __repr__(self):
+        return "RandomStreams(seed={}, crn={}, keys={})".format(
+            self.seed, self.common_random_numbers, self.keys)
+
+    def child(self, key):
+        """
+        Returns the streams of a sub-run, e.g. one game on a slate
+        """
+        return RandomStreams(self.seed, self.common_random_numbers,
+                             self.keys + (key,))
+
+    def key(self, *keys):
+        return substream_key(self.seed, *(self.keys + keys))
+
+    def stream(self, *keys):
+        return substream(self.seed, *(self.keys + keys))
+
+    def chunk_stream(self, first_iteration):
+        return self.stream(CHUNK_STREAM, first_iteration)
+
+    def game_keys(self, iteration):
+        """
+        Returns the seed arrays of the (plate appearance, everything else)
+            streams of a game
+        """
+        return (self.key(GAME_STREAM, iteration, PA_DRAWS),
+                self.key(GAME_STREAM, iteration, OTHER_DRAWS))
+
+
+class UniformBuffer:
+    """
+    Hands out uniform [0, 1) floats one at a time from a prefetched block
+        so the hot loop doesn't pay for a numpy call on every draw
+    rng is a RandomState, defaults to numpy's global random state
+    """
+    def __init__(self, rng=None, block_size=BLOCK_SIZE):
+        self.rng = np.random if rng is None else rng
+        self.block_size = block_size
+        self.refill()
+
+    def reseed(self, seed):
+        """
+        Reseeds the rng, dropping anything already prefetched
+        """
+        self.rng.seed(seed)
+        self.refill()
+
+    def refill(self):
+        block = self.rng.random_sample(self.block_size).tolist()
+        self._next = iter(block).__next__
+
+    def preload(self, uniforms):
+        """
+        Hands out <uniforms> first, then goes back to drawing from the rng
+        """
+        self._next = iter(uniforms).__next__
+
+    def next(self):
+        try:
+            return self._next()
+        except StopIteration:
+            self.refill()
+            return self._next()
+
+
+class CategoricalTable:
+    """
+    A categorical distribution over <outcomes> compiled into a cdf table
+    PREREQUISITES: probs sums to 1 (up to rounding)
+    values optionally gives each outcome a value, their expectation is mean
+    """
+    def __init__(self, outcomes, probs, values=None):
+        assert(len(outcomes) == len(probs)), (outcomes, probs)
+        self.outcomes = tuple(outcomes)
+        self.cdf = compile_cdf(probs).tolist()
+        self.mean = None
+        if values is not None:
+            self.mean = float(np.dot(probs, values))
+
+    def __repr__(self):
+        return "CategoricalTable({}, cdf={})".format(self.outcomes, self.cdf)
+
+    def sample(self, uniforms):
+        """
+        Draws an outcome using the next uniform from the UniformBuffer
+        """
+        return self.outcomes[bisect_left(self.cdf, uniforms.next())]
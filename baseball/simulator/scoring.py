@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Fantasy scoring rules of the sites we project.
+A RuleSet declares a site's points as weights on the batter stats of
+    stat_index and the pitcher stats of pitcher.SCORED_STATS, plus bonuses
+    for stat lines that clear thresholds like FanDuel's quality start.
+A Scorer stacks the weights of several rule sets into matrices, so every
+    site is scored with one np.dot per game or per batch of games and a
+    single simulation run projects all of them.
+"""
+
+import numpy as np
+
+from . import stat_index as st
+from . import pitcher as pt
+
+
+# IP is summed in thirds so thresholds are compared with some slack
+STAT_TOLERANCE = 1e-6
+
+
+def stat_weights(points, columns):
+    """
+    Returns the array of <points>, a dict of points per stat, in the order
+        of <columns>. Stats that aren't listed score nothing.
+    """
+    unknown = set(points) - set(columns)
+    if unknown:
+        raise ValueError("Stats can't be scored: " +
+                         ", ".join(sorted(unknown)))
+    return np.array([points.get(stat, 0) for stat in columns], dtype=float)
+
+
+class Bonus:
+    """
+    <points> awarded to each stat line with at least the value of every stat
+        in <at_least> and at most the value of every stat in <at_most>
+    """
+    def __init__(self, points, at_least=None, at_most=None):
+        self.points = points
+        self.at_least = at_least or {}
+        self.at_most = at_most or {}
+
+    def awarded(self, stats, columns):
+        """
+        stats is an array whose last axis is indexed by <columns>
+        Returns whether each stat line earns the bonus
+        """
+        awarded = np.ones(stats.shape[:-1], dtype=bool)
+        for stat, value in self.at_least.items():
+            column = stats[..., columns.index(stat)]
+            awarded &= column >= value - STAT_TOLERANCE
+        for stat, value in self.at_most.items():
+            column = stats[..., columns.index(stat)]
+            awarded &= column <= value + STAT_TOLERANCE
+        return awarded
+
+
+class RuleSet:
+    """
+    A site's scoring. batter_points and pitcher_points are dicts of the
+        points per stat, named as in stat_index.stats and pitcher.SCORED_STATS
+    """
+    def __init__(self, name, batter_points, pitcher_points, batter_bonuses=(),
+                 pitcher_bonuses=()):
+        self.name = name
+        self.batter_weights = stat_weights(batter_points, st.stats)
+        self.pitcher_weights = stat_weights(pitcher_points, pt.SCORED_STATS)
+        self.batter_bonuses = tuple(batter_bonuses)
+        self.pitcher_bonuses = tuple(pitcher_bonuses)
+
+    def __repr__(self):
+        return "RuleSet: {}".format(self.name)
+
+
+DRAFTKINGS = RuleSet("DK", dict(zip(st.stats, st.DK_multiplier)),
+                     dict(zip(pt.SCORED_STATS, pt.DK_multiplier)))
+
+FANDUEL = RuleSet("FD",
+                  {'RBI': 3.5, 'RUN': 3.2, 'SINGLE': 3, 'DOUBLE': 6,
+                   'TRIPLE': 9, 'HR': 12, 'BB': 3, 'HBP': 3, 'SB': 6},
+                  {'IP': 3, 'SO': 3, 'W': 6, 'ER': -3},
+                  pitcher_bonuses=[Bonus(4, at_least={'IP': 6},
+                                         at_most={'ER': 3})])
+
+RULE_SETS = {rule_set.name: rule_set for rule_set in (DRAFTKINGS, FANDUEL)}
+
+
+def get_rule_sets(rule_sets):
+    """
+    Returns the RuleSets of <rule_sets>, which can also be given by name
+    """
+    try:
+        return [RULE_SETS[rule_set] if isinstance(rule_set, str) else rule_set
+                for rule_set in rule_sets]
+    except KeyError as missing:
+        raise ValueError("Unknown rule set: " + str(missing))
+
+
+class Scorer:
+    """
+    Scores stats under every one of <rule_sets> at once
+    The scores have the shape of the stat lines with a last axis that is
+        indexed like rule_sets
+    """
+    def __init__(self, rule_sets):
+        self.rule_sets = get_rule_sets(rule_sets)
+        self.names = [rule_set.name for rule_set in self.rule_sets]
+        self.batter_weights = np.column_stack(
+            [rule_set.batter_weights for rule_set in self.rule_sets])
+        self.pitcher_weights = np.column_stack(
+            [rule_set.pitcher_weights for rule_set in self.rule_sets])
+
+    def __len__(self):
+        return len(self.rule_sets)
+
+    def batter_scores(self, stats):
+        """
+        stats is an array of batter stat lines, e.g. a (9, NUM_STATS) boxscore
+            or the (num_games, 9, NUM_STATS) player stats of a batch
+        """
+        scores = np.dot(stats, self.batter_weights)
+        self.add_bonuses(scores, stats, st.stats, "batter_bonuses")
+        return scores
+
+    def pitcher_scores(self, stats):
+        """
+        stats is a Pitcher's stats dict or a dict of per game arrays
+        """
+        stats = pt.scored_stats_array(stats)
+        scores = np.dot(stats, self.pitcher_weights)
+        self.add_bonuses(scores, stats, pt.SCORED_STATS, "pitcher_bonuses")
+        return scores
+
+    def add_bonuses(self, scores, stats, columns, kind):
+        for i, rule_set in enumerate(self.rule_sets):
+            for bonus in getattr(rule_set, kind):
+                scores[..., i] += bonus.points*bonus.awarded(stats, columns)
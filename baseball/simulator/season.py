@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Projects the final standings from the remaining schedule.
+Each remaining game is simulated with its probable lineups and pitchers for
+    its home win probability, once per distinct matchup since the same
+    teams often meet with the same starters. Whole seasons are then sampled
+    in bulk from those probabilities: one uniform per game and season, and a
+    matrix product adds up each team's wins. Ties in the standings are
+    broken by a coin flip.
+Teams are identified by their team_id, the retrosheet codes of MLB_DIVISIONS
+"""
+
+import numpy as np
+import pandas as pd
+
+from .slate import simulate_slate
+from .utils import MLB_DIVISIONS, MLB_LEAGUES
+
+
+# Playoff spots of each league besides its division winners
+WILD_CARDS = 2
+
+# Seasons sampled at once, bounds the (seasons, games) uniforms in memory
+SEASON_CHUNK = 1000
+
+# Columns of the standings projection
+WIN_QUANTILES = (0.1, 0.5, 0.9)
+STANDINGS_HEADERS = ("wins", "P10 wins", "P50 wins", "P90 wins", "division",
+                     "playoffs")
+
+
+def matchup_key(home_team, away_team):
+    """
+    Games between the same lineups and starters have the same win probability
+    """
+    return tuple((team.team_id, team.starter.pid,
+                  tuple(player.pid for player in team.lineup))
+                 for team in (home_team, away_team))
+
+
+def win_probabilities(schedule, num_iterations, engine="batch", workers=1,
+                      seed=None, cache=None):
+    """
+    schedule lists the (home_team, away_team) Teams of the remaining games
+    Returns the home win probability of each game. Each distinct matchup is
+        simulated <num_iterations> times, all of them as one slate, see
+        slate.simulate_slate. A game still tied after 20 innings is
+        split evenly between the two teams.
+    cache is a dict of the probabilities of matchup_keys simulated before,
+        e.g. by an earlier projection. Its matchups aren't simulated again and
+        the new ones are added to it.
+    """
+    if cache is None:
+        cache = {}
+    keys = [matchup_key(home_team, away_team)
+            for home_team, away_team in schedule]
+    matchups = {}
+    for key, teams in zip(keys, schedule):
+        if key not in cache:
+            matchups.setdefault(key, teams)
+
+    slate_results = simulate_slate(matchups.values(), num_iterations,
+                                   engine=engine, workers=workers, seed=seed)
+    for key, info in zip(matchups, slate_results):
+        cache[key] = (info['avg_results']['prob_home_win'] +
+                      0.5*info['prob_tie'])
+    return np.array([cache[key] for key in keys], dtype=float)
+
+
+def check_standings(wins, divisions, leagues):
+    for league, league_divisions in leagues.items():
+        for division in league_divisions:
+            if division not in divisions:
+                raise ValueError("League {} has unknown division {}".format(
+                    league, division))
+    missing = set(team for teams in divisions.values()
+                  for team in teams) - set(wins)
+    if missing:
+        raise ValueError("No standings for: " + ", ".join(sorted(missing)))
+
+
+class SeasonTotals:
+    """
+    Counts over simulated seasons of each team's final wins, division titles
+        and playoff spots. Teams are indexed like <team_ids>
+    """
+    def __init__(self, team_ids, max_wins):
+        self.team_ids = list(team_ids)
+        self.num_seasons = 0
+        self.win_counts = np.zeros((len(team_ids), max_wins + 1))
+        self.division_counts = np.zeros(len(team_ids))
+        self.playoff_counts = np.zeros(len(team_ids))
+
+    def add_seasons(self, wins, division_winners, playoff_teams):
+        """
+        wins is the (num_seasons, num_teams) final wins of each season and
+            division_winners and playoff_teams hold the team indexes of each
+            season's division winners and playoff teams
+        """
+        self.num_seasons += len(wins)
+        for team in range(len(self.team_ids)):
+            self.win_counts[team] += np.bincount(
+                wins[:, team], minlength=self.win_counts.shape[1])
+        self.division_counts += np.bincount(division_winners.ravel(),
+                                            minlength=len(self.team_ids))
+        self.playoff_counts += np.bincount(playoff_teams.ravel(),
+                                           minlength=len(self.team_ids))
+
+    def win_distribution(self):
+        """
+        Probability of each team finishing with each number of wins
+        """
+        return pd.DataFrame(self.win_counts/self.num_seasons,
+                            index=self.team_ids)
+
+    def standings(self):
+        distribution = self.win_counts/self.num_seasons
+        cdfs = np.cumsum(distribution, axis=1)
+        quantiles = [(cdfs < quantile - 1e-9).sum(axis=1)
+                     for quantile in WIN_QUANTILES]
+        mean_wins = np.dot(distribution, np.arange(distribution.shape[1]))
+        columns = ([mean_wins] + quantiles +
+                   [self.division_counts/self.num_seasons,
+                    self.playoff_counts/self.num_seasons])
+        return pd.DataFrame(np.column_stack(columns), index=self.team_ids,
+                            columns=STANDINGS_HEADERS)
+
+
+def simulate_seasons(wins, schedule_ids, home_win_probs, num_seasons,
+                     divisions=MLB_DIVISIONS, leagues=MLB_LEAGUES,
+                     wild_cards=WILD_CARDS, seed=None):
+    """
+    wins is a dict of each team's wins so far and schedule_ids the
+        (home_team_id, away_team_id) of each remaining game, which the home
+        team wins with the probability in <home_win_probs>
+    divisions maps each division to its team_ids and leagues each league to
+        its divisions. Every league sends its division winners and its
+        <wild_cards> best other teams to the playoffs.
+    seed makes the seasons reproducible. Without it numpy's global state is
+        used
+    Returns the SeasonTotals of <num_seasons> simulated seasons
+    """
+    check_standings(wins, divisions, leagues)
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    team_ids = sorted(wins)
+    index = {team_id: i for i, team_id in enumerate(team_ids)}
+    current_wins = np.array([wins[team_id] for team_id in team_ids], dtype=int)
+
+    # (games, teams) indicators of who plays at home and away in each game
+    home_games = np.zeros((len(schedule_ids), len(team_ids)))
+    away_games = np.zeros((len(schedule_ids), len(team_ids)))
+    for game, (home_id, away_id) in enumerate(schedule_ids):
+        home_games[game, index[home_id]] = 1
+        away_games[game, index[away_id]] = 1
+    home_win_probs = np.asarray(home_win_probs, dtype=float)
+
+    division_teams = {division: np.array([index[team_id]
+                                          for team_id in teams])
+                      for division, teams in divisions.items()}
+    totals = SeasonTotals(team_ids, current_wins.max() + len(schedule_ids))
+    for start in range(0, num_seasons, SEASON_CHUNK):
+        size = min(SEASON_CHUNK, num_seasons - start)
+        home_won = rng.random_sample((size, len(schedule_ids))) < home_win_probs
+        season_wins = (current_wins + np.dot(home_won, home_games) +
+                       np.dot(~home_won, away_games)).astype(int)
+        # Random fractions below 1 win only reorder teams that are tied
+        ranks = season_wins + rng.random_sample(season_wins.shape)
+
+        division_winners = {}
+        for division, teams in division_teams.items():
+            division_winners[division] = teams[ranks[:, teams].argmax(axis=1)]
+        playoff_teams = []
+        for league_divisions in leagues.values():
+            winners = np.column_stack([division_winners[division]
+                                       for division in league_divisions])
+            teams = np.concatenate([division_teams[division]
+                                    for division in league_divisions])
+            league_ranks = np.full((size, len(team_ids)), -np.inf)
+            league_ranks[:, teams] = ranks[:, teams]
+            league_ranks[np.arange(size)[:, None], winners] = -np.inf
+            wild_card_teams = np.argsort(-league_ranks, axis=1)[:, :wild_cards]
+            playoff_teams.extend([winners, wild_card_teams])
+
+        totals.add_seasons(season_wins,
+                           np.column_stack(list(division_winners.values())),
+                           np.column_stack(playoff_teams))
+    return totals
+
+
+def project_season(wins, schedule, num_seasons, num_iterations,
+                   engine="batch", workers=1, seed=None, cache=None,
+                   divisions=MLB_DIVISIONS, leagues=MLB_LEAGUES,
+                   wild_cards=WILD_CARDS):
+    """
+    Projects the rest of the season from the standings <wins> and <schedule>,
+        the (home_team, away_team) Teams of each remaining game with their
+        probable lineups and starters
+    Each game's win probability comes from <num_iterations> simulations, see
+        win_probabilities for engine, workers and cache, and then
+        <num_seasons> seasons are sampled, see simulate_seasons
+    Returns a dict with the projected standings DataFrame of each team's mean
+        and P10/P50/P90 wins and its division and playoff odds, the
+        win_distribution over final win totals and each game's
+        win_probabilities
+    """
+    home_win_probs = win_probabilities(schedule, num_iterations, engine,
+                                       workers, seed, cache)
+    schedule_ids = [(home_team.team_id, away_team.team_id)
+                    for home_team, away_team in schedule]
+    totals = simulate_seasons(wins, schedule_ids, home_win_probs, num_seasons,
+                              divisions, leagues, wild_cards, seed)
+    return {'standings': totals.standings(),
+            'win_distribution': totals.win_distribution(),
+            'win_probabilities': home_win_probs}
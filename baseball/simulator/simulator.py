@@ -3,9 +3,26 @@
 # cython: profile=True
 
 from . import game
-from .team import Team
+from .batch_game import BatchGame
+from .half_innings import CachedGame
+from .accumulators import (SimulationTotals, DK_SCORE_HEADERS,
+                           SKETCH_HEADERS, QUANTILE_HEADERS)
+from .sampling import RandomStreams
+from .scoring import Scorer
+from .outcomes import OutcomeStore
+from .instrumentation import EngineStats, check_instrument, format_report
+from .reweighting import (PlateAppearanceRecord, count_plate_appearances,
+                          team_rates)
+from .play_by_play import PlayByPlayLog, record_play_by_play
+from . import variance
 from . import stat_index as st
 
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import logging
+import math
+import time
+
 import pandas as pd
 import numpy as np
 
@@ -81,42 +98,247 @@ class GameResults():
         return self.results.items()
 
 
-def simulate(home_team, away_team, num_iterations=1):
+# Number of games the batch engine plays in lock-step at a time
+BATCH_SIZE = 10000
+
+ENGINES = ("game", "batch", "cached")
+
+# Adaptive runs always simulate at least this many iterations
+MIN_ITERATIONS = 200
+
+# Normal quantile of the two sided 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+# Columns of compare_batting_orders
+ORDER_HEADERS = ("DK pts pred", "delta", "delta low", "delta high")
+# Smallest number of iterations simulated between two convergence checks
+MIN_ROUND_SIZE = 100
+
+
+def simulate(home_team, away_team, num_iterations=1, engine="game", workers=1,
+             keep_dk_scores=False, seed=None, common_random_numbers=False,
+             variance_reduction=None, target_error=None,
+             min_iterations=MIN_ITERATIONS, rule_sets=None, outcome_dir=None,
+             start_state=None, instrument=None, keep_pa_counts=False,
+             play_by_play_dir=None):
     """
     PRECONDITIONS: teams must be of type Team
     Simulate takes in two teams and simulates <num_iterations> times
-    returns GameResult object of average game stats
+    engine is either "game" to play each game with Game, "batch" to play
+        them in lock-step with BatchGame or "cached" to assemble them in
+        lock-step from half innings cached by half_innings.CachedGame. The
+        cached mode samples its libraries for every chunk and adaptive round
+        (see compare_engines for their noise), so it pays off on long fixed
+        runs, and doesn't support variance_reduction.
+    workers > 1 splits the iterations across a pool of processes
+    keep_dk_scores also returns every iteration's DK scores. Off by default
+        since the covariances are accumulated without them.
+    seed makes the run reproducible. Without it numpy's global state is used
+    common_random_numbers plays game i of every run with the same seed on the
+        same draws, see sampling.RandomStreams. Requires a seed.
+    variance_reduction is one of variance.VARIANCE_REDUCTIONS or None. The
+        effective sample size of each player is reported either way.
+    target_error stops simulating once the standard error of every player's
+        mean DK score is below it. The games are then simulated in rounds,
+        at least <min_iterations> and at most <num_iterations> in total.
+    rule_sets are scoring.RuleSets or their names, e.g. ["DK", "FD"]. Every
+        player's mean points under each of them are reported in
+        site_projections, all scored from the same simulated games.
+    outcome_dir stores every iteration's DK scores, runs and pitcher stats
+        in memory-mapped files in that directory, see outcomes.load_outcomes.
+        Unlike keep_dk_scores nothing is held in memory.
+    start_state is a game.GameState, e.g. of a live game, to simulate the rest
+        of the game from. Every iteration restores it in place, and the
+        results are of the whole game including the stats so far. The batch
+        engine can't start from a state.
+    instrument is one of instrumentation.INSTRUMENT_LEVELS to count the plate
+        appearances, steal attempts, pitcher subs and extra innings of the
+        games and time the engine, "timers" also times each of its phases.
+        The per game counts and games per second are reported in
+        engine_stats and logged.
+    keep_pa_counts records how often each batter drew each event in every
+        iteration with its DK scores, returned as the
+        reweighting.PlateAppearanceRecord pa_record. Its reweight projects
+        the run under modified batting rates without simulating again. Only
+        the game engine supports it.
+    play_by_play_dir logs every plate appearance of every iteration in
+        compressed files in that directory, see
+        play_by_play.load_play_by_play. Only the game engine supports it.
+    returns GameResult object of average game stats. The iterations run and
+        the largest standard error are also reported, as are the P10, P50
+        and P90 DK scores of each team's players and total in score_quantiles
+        and the ScoreHistograms they come from in score_sketches.
+        score_variances holds the variance of each home and away DK score
+        row, its batters, own pitcher and opposing pitcher.
+    """
+    check_engine(engine, variance_reduction, start_state, keep_pa_counts,
+                 play_by_play_dir)
+    check_instrument(instrument)
+    variance.check_variance_reduction(variance_reduction,
+                                      common_random_numbers)
+    streams = make_streams(seed, common_random_numbers)
+
+    outcomes = make_outcome_store(outcome_dir, num_iterations)
+    play_by_play = make_play_by_play(play_by_play_dir, home_team, away_team)
+
+    totals = simulate_rounds(home_team, away_team, num_iterations,
+                             engine=engine, workers=workers,
+                             keep_dk_scores=keep_dk_scores, streams=streams,
+                             variance_reduction=variance_reduction,
+                             target_error=target_error,
+                             min_iterations=min_iterations,
+                             rule_sets=rule_sets, outcomes=outcomes,
+                             start_state=start_state, instrument=instrument,
+                             keep_pa_counts=keep_pa_counts,
+                             play_by_play=play_by_play)
+    finish_outcome_store(outcomes, totals)
+
+    return summarize_totals(home_team, away_team, totals)
+
+
+def check_engine(engine, variance_reduction=None, start_state=None,
+                 keep_pa_counts=False, play_by_play_dir=None):
+    if engine not in ENGINES:
+        raise ValueError("Unknown simulation engine: " + str(engine))
+    if engine != "game" and keep_pa_counts:
+        raise ValueError("Only the game engine keeps plate appearance counts")
+    if engine != "game" and play_by_play_dir is not None:
+        raise ValueError("Only the game engine records play by play")
+    if engine == "batch" and start_state is not None:
+        raise ValueError("The batch engine can't start from a game state")
+    if engine == "cached" and variance_reduction is not None:
+        raise ValueError("The cached engine doesn't support variance "
+                         "reduction")
+
+
+def make_streams(seed, common_random_numbers=False):
+    """
+    Returns the RandomStreams for <seed> or None to use numpy's global state
     """
-    # Initializes the cum_results aggregator to all 0s
-    cum_results = game.Game(Team(), Team()).get_boxscore()
-    # add column to boxscore for fantasy scores
-    cum_results[0] = np.hstack((cum_results[0], np.zeros(9)[:, None]))
-    cum_results[1] = np.hstack((cum_results[1], np.zeros(9)[:, None]))
+    if seed is None:
+        if common_random_numbers:
+            raise ValueError("common_random_numbers requires a seed")
+        return None
+    return RandomStreams(seed, common_random_numbers)
 
-    curr_game = game.Game(home_team, away_team)
 
-    # for writeout
-    headers = ["p1", "p2", "p3", "p4", "p5", "p6", "p7", "p8", "p9", "pitcher"]
-    home_dk_scores = [headers]
-    away_dk_scores = [headers]
+def make_outcome_store(outcome_dir, num_iterations):
+    """
+    Returns a new OutcomeStore in <outcome_dir> or None to not store outcomes
+    """
+    if outcome_dir is None:
+        return None
+    return OutcomeStore(outcome_dir, num_iterations).create()
 
-    for iteration in range(num_iterations):
-        curr_game.reset_game()
 
-        results = curr_game.simulate_game()
+def finish_outcome_store(outcomes, totals):
+    if outcomes is not None:
+        outcomes.write_meta(totals.num_iterations)
+
+
+def make_play_by_play(play_by_play_dir, home_team, away_team):
+    """
+    Returns a new PlayByPlayLog in <play_by_play_dir> or None to not log
+    """
+    if play_by_play_dir is None:
+        return None
+    return PlayByPlayLog(play_by_play_dir).create(home_team, away_team)
+
+
+def simulate_totals(home_team, away_team, num_iterations, engine="game",
+                    keep_dk_scores=False, streams=None, first_iteration=0,
+                    variance_reduction=None, rule_sets=None, outcomes=None,
+                    start_state=None, instrument=None, keep_pa_counts=False,
+                    play_by_play=None):
+    """
+    Simulates <num_iterations> games and returns their SimulationTotals
+    streams is a RandomStreams or None to use numpy's global random state.
+        first_iteration is the iteration number of the first game in the run
+        so that chunks of a larger run pick the right substreams.
+    Each game is also scored under all of <rule_sets> at once, if any, and
+        written to the OutcomeStore <outcomes> at its iteration number
+    Each game is played from <start_state> if given, see Game.restore
+    With <instrument> the games are counted and timed in the totals'
+        engine_stats
+    With <keep_pa_counts> the totals' pa_record gets every game's plate
+        appearance counts and DK scores
+    With a PlayByPlayLog <play_by_play> every plate appearance is logged to
+        the log's file for <first_iteration>
+    """
+    if engine in ("batch", "cached"):
+        return simulate_batch_totals(home_team, away_team, num_iterations,
+                                     keep_dk_scores=keep_dk_scores,
+                                     streams=streams,
+                                     first_iteration=first_iteration,
+                                     variance_reduction=variance_reduction,
+                                     rule_sets=rule_sets, outcomes=outcomes,
+                                     instrument=instrument, engine=engine,
+                                     start_state=start_state)
+
+    scorer = make_scorer(rule_sets)
+    totals = SimulationTotals(home_team.starter, away_team.starter,
+                              keep_dk_scores,
+                              variance.VarianceTotals(variance_reduction),
+                              site_names(scorer))
+    rng = None
+    if streams is not None:
+        rng = streams.chunk_stream(first_iteration)
+    curr_game = game.Game(home_team, away_team, rng)
+    use_controls = variance_reduction == "control_variates"
+    if use_controls:
+        curr_game.track_expected_pts()
+    engine_stats = totals.engine_stats = make_engine_stats(instrument)
+    if engine_stats is not None:
+        engine_stats.time_game(curr_game)
+    if keep_pa_counts:
+        totals.pa_record = PlateAppearanceRecord(team_rates(home_team,
+                                                            away_team))
+        pa_counts = np.zeros(totals.pa_record.rates.shape, dtype=int)
+        count_plate_appearances(curr_game, pa_counts)
+    if play_by_play is not None:
+        pbp_writer = play_by_play.writer(first_iteration)
+        record_play_by_play(curr_game, pbp_writer)
+    per_game_streams = streams is not None and streams.common_random_numbers
+    group_size = variance.group_size(variance_reduction)
+    home_controls = away_controls = None
+
+    for iteration in range(num_iterations):
+        if per_game_streams:
+            curr_game.reseed_streams(*streams.game_keys(first_iteration +
+                                                        iteration))
+        if group_size > 1:
+            if iteration % group_size == 0:
+                pa_draws = variance.coupled_pa_draws(
+                    curr_game.uniforms.rng, variance_reduction,
+                    min(group_size, num_iterations - iteration)).tolist()
+            curr_game.preload_pa_draws(pa_draws[iteration % group_size])
+        if keep_pa_counts:
+            pa_counts.fill(0)
+        if play_by_play is not None:
+            pbp_writer.iteration = first_iteration + iteration
+        if engine_stats is not None:
+            started = time.perf_counter()
+        if start_state is None:
+            curr_game.reset_game()
+        else:
+            curr_game.restore(start_state)
+
+        # Every result is added before the next game resets the stats
+        results = curr_game.simulate_game(copy_stats=False)
+        if engine_stats is not None:
+            engine_stats.count_game(curr_game,
+                                    time.perf_counter() - started)
+        if use_controls:
+            home_controls = (variance.get_batters_event_pts(results[0]) -
+                             [p.expected_pts for p in home_team.lineup])
+            away_controls = (variance.get_batters_event_pts(results[1]) -
+                             [p.expected_pts for p in away_team.lineup])
         # DK scores
         home_scores = get_batters_dk_scores(results[0])
         away_scores = get_batters_dk_scores(results[1])
         home_pitcher_score = results[2].update_draftkings_score()
         away_pitcher_score = results[3].update_draftkings_score()
 
-        # Attach fantasy scores column to boxscore
-        results[0] = np.hstack((results[0], home_scores[:, None]))
-        results[1] = np.hstack((results[1], away_scores[:, None]))
-
-        for i in range(len(cum_results)):
-            cum_results[i] += results[i]
-
         home_scores = home_scores.tolist() + [home_pitcher_score]
         away_scores = away_scores.tolist() + [away_pitcher_score]
 
@@ -124,19 +346,441 @@ def simulate(home_team, away_team, num_iterations=1):
         home_scores.append(away_pitcher_score)
         away_scores.append(home_pitcher_score)
 
-        home_dk_scores.append(home_scores)
-        away_dk_scores.append(away_scores)
+        totals.add_game(results, home_scores, away_scores)
+        if keep_pa_counts:
+            totals.pa_record.add_game(pa_counts, results, home_scores,
+                                      away_scores)
+        totals.variance.add_game(home_scores, away_scores, home_controls,
+                                 away_controls)
+        if scorer is not None:
+            totals.add_site_points(
+                get_site_points(scorer, results[0], results[2].get_dict()),
+                get_site_points(scorer, results[1], results[3].get_dict()))
+        if outcomes is not None:
+            outcomes.write_game(first_iteration + iteration, results,
+                                home_scores, away_scores)
+
+    totals.variance.flush()
+    if outcomes is not None:
+        outcomes.flush()
+    if play_by_play is not None:
+        pbp_writer.close()
+    return totals
+
+
+def simulate_batch_totals(home_team, away_team, num_iterations,
+                          keep_dk_scores=False, streams=None,
+                          first_iteration=0, variance_reduction=None,
+                          rule_sets=None, outcomes=None, instrument=None,
+                          engine="batch", start_state=None):
+    """
+    Same as simulate_totals but plays the games in lock-step with BatchGame,
+        <BATCH_SIZE> games at a time, or with CachedGame for the "cached"
+        <engine>, which can start from <start_state>
+    With common random numbers each batch draws from the plate appearance
+        stream of its first game. Games only line up draw for draw while
+        they stay in step, so the game engine gives tighter pairing.
+    """
+    rng = None
+    if streams is not None:
+        rng = streams.chunk_stream(first_iteration)
+    if engine == "cached":
+        batch_game = CachedGame(home_team, away_team, rng,
+                                start_state=start_state)
+    else:
+        batch_game = BatchGame(home_team, away_team, rng, variance_reduction)
+    per_batch_streams = streams is not None and streams.common_random_numbers
+    scorer = make_scorer(rule_sets)
+    totals = SimulationTotals(home_team.starter, away_team.starter,
+                              keep_dk_scores,
+                              variance.VarianceTotals(variance_reduction),
+                              site_names(scorer))
+    engine_stats = totals.engine_stats = make_engine_stats(instrument)
+    if engine_stats is not None:
+        engine_stats.time_batch(batch_game)
+
+    for start in range(0, num_iterations, BATCH_SIZE):
+        num_games = min(BATCH_SIZE, num_iterations - start)
+        if per_batch_streams:
+            batch_game.rng.seed(streams.game_keys(first_iteration + start)[0])
+        if engine_stats is not None:
+            started = time.perf_counter()
+        results = batch_game.simulate_games(num_games)
+        if engine_stats is not None:
+            engine_stats.count_batch(batch_game, results,
+                                     time.perf_counter() - started)
+
+        home_pitcher_scores = results['home_pitcher']['dk_score']
+        away_pitcher_scores = results['away_pitcher']['dk_score']
+        # Same layout as simulate: batters, own pitcher, opposing pitcher
+        home_scores = np.column_stack(
+            (get_batters_dk_scores(results['home_playerstats']),
+             home_pitcher_scores, away_pitcher_scores))
+        away_scores = np.column_stack(
+            (get_batters_dk_scores(results['away_playerstats']),
+             away_pitcher_scores, home_pitcher_scores))
+
+        totals.add_batch(results, home_scores, away_scores)
+        totals.variance.add_batch(
+            home_scores, away_scores,
+            (variance.get_batters_event_pts(results['home_playerstats']) -
+             results['home_expected_pts']),
+            (variance.get_batters_event_pts(results['away_playerstats']) -
+             results['away_expected_pts']))
+        if scorer is not None:
+            totals.add_site_points(
+                get_site_points(scorer, results['home_playerstats'],
+                                results['home_pitcher']),
+                get_site_points(scorer, results['away_playerstats'],
+                                results['away_pitcher']))
+        if outcomes is not None:
+            outcomes.write_batch(first_iteration + start, results,
+                                 home_scores, away_scores)
+
+    if outcomes is not None:
+        outcomes.flush()
+    return totals
+
+
+def make_engine_stats(instrument):
+    """
+    Returns an empty EngineStats for <instrument> or None to not instrument
+    """
+    if instrument is None:
+        return None
+    return EngineStats(instrument)
+
+
+def simulate_chunk(home_team, away_team, num_iterations, **options):
+    """
+    Simulates a chunk of iterations in a worker process.
+    <options> are the keyword arguments of simulate_totals, the chunk draws
+        from the substreams of their streams for their first_iteration
+    """
+    return simulate_totals(home_team, away_team, num_iterations, **options)
+
+
+def split_iterations(num_iterations, workers, multiple=1):
+    """
+    Splits <num_iterations> into <workers> chunks that differ by at most 1
+    With <multiple> every chunk but the last is a multiple of it, so groups
+        of coupled games aren't split up
+    """
+    num_groups = -(-num_iterations // multiple)
+    chunk, remainder = divmod(num_groups, workers)
+    chunks = [(chunk + (i < remainder))*multiple for i in range(workers)]
+    chunks[remainder - 1 if chunk == 0 else -1] -= (num_groups*multiple -
+                                                    num_iterations)
+    return chunks
+
+
+def chunk_starts(chunks):
+    """
+    Returns the iteration number each chunk of iterations starts at
+    """
+    return np.cumsum([0] + chunks[:-1]).tolist()
+
+
+def submit_chunks(executor, home_team, away_team, num_iterations, num_chunks,
+                  first_iteration=0, **options):
+    """
+    Splits <num_iterations> starting at <first_iteration> into <num_chunks>
+        chunks and submits them to <executor>
+    <options> are the other keyword arguments of simulate_totals
+    Returns the futures in iteration order
+    """
+    group_size = variance.group_size(options.get("variance_reduction"))
+    chunks = [n for n in split_iterations(num_iterations, num_chunks,
+                                          group_size)
+              if n > 0]
+    return [executor.submit(simulate_chunk, home_team, away_team, chunk,
+                            first_iteration=first_iteration + start,
+                            **options)
+            for chunk, start in zip(chunks, chunk_starts(chunks))]
+
+
+def merge_chunks(futures, totals=None):
+    """
+    Merges the SimulationTotals of <futures> in order into <totals>
+    """
+    for future in futures:
+        if totals is None:
+            totals = future.result()
+        else:
+            totals += future.result()
+    return totals
+
+
+def simulate_rounds(home_team, away_team, max_iterations, engine="game",
+                    workers=1, keep_dk_scores=False, streams=None,
+                    variance_reduction=None, target_error=None,
+                    min_iterations=MIN_ITERATIONS, rule_sets=None,
+                    outcomes=None, start_state=None, instrument=None,
+                    keep_pa_counts=False, totals=None, play_by_play=None):
+    """
+    Simulates in rounds until next_round_size says to stop, without a
+        target_error that is a single round of <max_iterations>
+    totals continues an earlier run of the same game, e.g. a pilot, from its
+        num_iterations. It is merged into and returned
+    play_by_play is a PlayByPlayLog, see simulate_totals
+    With workers > 1 each round is split across a pool of processes and
+        their SimulationTotals are merged in iteration order. Each chunk draws
+        from its own substream of <streams>. Without streams they are seeded
+        from the parent's random state so seeding numpy before calling this
+        makes the run reproducible
+    """
+    if workers > 1 and streams is None:
+        streams = RandomStreams(np.random.randint(2**31 - 1))
+    group_size = variance.group_size(variance_reduction)
+    options = dict(engine=engine, keep_dk_scores=keep_dk_scores,
+                   streams=streams, variance_reduction=variance_reduction,
+                   rule_sets=rule_sets, outcomes=outcomes,
+                   start_state=start_state, instrument=instrument,
+                   keep_pa_counts=keep_pa_counts, play_by_play=play_by_play)
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        size = next_round_size(totals, max_iterations, target_error,
+                               min_iterations, group_size)
+        while size > 0:
+            start = 0 if totals is None else totals.num_iterations
+            if executor is None:
+                round_totals = simulate_totals(home_team, away_team, size,
+                                               first_iteration=start,
+                                               **options)
+                totals = merge_totals(totals, round_totals)
+            else:
+                totals = merge_chunks(
+                    submit_chunks(executor, home_team, away_team, size,
+                                  workers, first_iteration=start, **options),
+                    totals)
+            size = next_round_size(totals, max_iterations, target_error,
+                                   min_iterations, group_size)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return totals
+
+
+def merge_totals(totals, other):
+    if totals is None:
+        return other
+    totals += other
+    return totals
+
+
+def next_round_size(totals, max_iterations, target_error=None,
+                    min_iterations=MIN_ITERATIONS, group_size=1):
+    """
+    Returns how many more iterations to simulate, 0 once the run is done
+    Without a target_error that is everything up to <max_iterations>.
+    Otherwise the next round is sized from the current standard error to
+        reach <target_error>, but at most doubles the run since early error
+        estimates are noisy. Rounds are whole groups of coupled games.
+    """
+    done = 0 if totals is None else totals.num_iterations
+    if done >= max_iterations:
+        return 0
+    if target_error is None:
+        size = max_iterations - done
+    elif done < min_iterations:
+        size = min_iterations - done
+    else:
+        error = max_standard_error(totals)
+        if error <= target_error:
+            return 0
+        needed = int(math.ceil(done*(error/target_error)**2))
+        size = max(MIN_ROUND_SIZE, min(done, needed - done))
+    size = -(-size // group_size)*group_size
+    return min(size, max_iterations - done)
+
+
+def standard_errors(totals):
+    """
+    Returns the standard errors of the mean DK scores of the 9 batters and
+        the pitcher of the home and then the away team
+    """
+    if totals.num_iterations < 2:
+        return np.full(10, np.inf), np.full(10, np.inf)
+    sizes = totals.variance.effective_sample_sizes(
+        totals.home_moments, totals.away_moments, totals.num_iterations)
+    return [np.sqrt(np.diag(moments.cov())[:10]/ess)
+            for moments, ess in zip((totals.home_moments,
+                                     totals.away_moments), sizes)]
+
 
+def max_standard_error(totals):
+    return max(errors.max() for errors in standard_errors(totals))
+
+
+def compare_engines(home_team, away_team, num_iterations,
+                    engines=("game", "cached"), seed=None):
+    """
+    Reports the accuracy and speed of <engines> against each other, e.g. of
+        the approximate cached engine against the full one, by simulating
+        the teams <num_iterations> times with each
+    Returns (means, errors, seconds_per_game):
+        means and errors are DataFrames of the mean DK scores and their
+            standard errors, indexed by team ("home" or "away") and
+            DK_SCORE_HEADERS, with one column per engine
+        seconds_per_game has each engine's run time per game, including
+            building the cached engine's libraries
+    """
+    means = {}
+    errors = {}
+    seconds_per_game = {}
+    for engine in engines:
+        check_engine(engine)
+        start = time.perf_counter()
+        totals = simulate_totals(home_team, away_team, num_iterations,
+                                 engine=engine, streams=make_streams(seed))
+        seconds_per_game[engine] = ((time.perf_counter() - start) /
+                                    num_iterations)
+        means[engine] = np.concatenate((totals.home_moments.mean()[:10],
+                                        totals.away_moments.mean()[:10]))
+        errors[engine] = np.concatenate(standard_errors(totals))
+
+    index = pd.MultiIndex.from_product((("home", "away"), DK_SCORE_HEADERS))
+    return (pd.DataFrame(means, index=index, columns=engines),
+            pd.DataFrame(errors, index=index, columns=engines),
+            seconds_per_game)
+
+
+def compare_batting_orders(team, opponent, orders, num_iterations,
+                           home=True, seed=0):
+    """
+    Projects <team>'s players against <opponent> under each of the batting
+        <orders>, given as the team's current lineup slots in their new order
+        (see Team.reorder). <team> is the home team if <home>.
+    Every order plays game i on the same common random numbers, and each
+        batter keeps his own plate appearance draws wherever he bats, so the
+        changes from the current order are far less noisy than the
+        difference of separate simulate runs
+    Returns a DataFrame of ORDER_HEADERS indexed by the order's number and
+        the player's current slot (DK_SCORE_HEADERS): his mean DK score under
+        the order and its change from the current order with its confidence
+        interval. The team is back in its current order afterwards.
+    """
+    current = list(team.lineup)
+    streams = RandomStreams(seed, common_random_numbers=True)
+    baseline = None
+    rows = []
+    try:
+        for order in [list(range(len(current)))] + list(orders):
+            team.reorder([team.lineup.index(current[slot]) for slot in order])
+            scores = order_scores(team, opponent, num_iterations, home,
+                                  streams, current)
+            if baseline is None:
+                baseline = scores
+                continue
+            deltas = scores - baseline
+            error = CONFIDENCE_Z*deltas.std(axis=0, ddof=1)/np.sqrt(
+                num_iterations)
+            rows.append(np.column_stack((scores.mean(axis=0),
+                                         deltas.mean(axis=0),
+                                         deltas.mean(axis=0) - error,
+                                         deltas.mean(axis=0) + error)))
+    finally:
+        team.reorder([team.lineup.index(player) for player in current])
+
+    index = pd.MultiIndex.from_product((range(len(rows)), DK_SCORE_HEADERS))
+    return pd.DataFrame(np.concatenate(rows), index=index,
+                        columns=ORDER_HEADERS)
+
+
+def order_scores(team, opponent, num_iterations, home, streams, players):
+    """
+    Simulates <team> in its current batting order and returns the
+        (num_iterations, 10) DK scores of <players> and the team's pitcher
+    The plate appearance draws of game i are indexed by the side and the
+        player's position in <players>, so they follow him around the order
+    """
+    home_team, away_team = (team, opponent) if home else (opponent, team)
+    side = 0 if home else 1
+    curr_game = game.Game(home_team, away_team)
+    positions = [players.index(player) for player in team.lineup]
+    pa_rng = np.random.RandomState()
+    scores = np.zeros((num_iterations, 10))
+    for iteration in range(num_iterations):
+        pa_key, other_key = streams.game_keys(iteration)
+        pa_rng.seed(pa_key)
+        draws = pa_rng.random_sample((2, 9, variance.PA_DRAWS_PER_BATTER))
+        draws[side] = draws[side][positions]
+        curr_game.reseed_streams(pa_key, other_key)
+        curr_game.preload_pa_draws(draws.tolist())
+        curr_game.reset_game()
+
+        results = curr_game.simulate_game(copy_stats=False)
+        batter_scores = get_batters_dk_scores(results[side])
+        scores[iteration, positions] = batter_scores
+        scores[iteration, 9] = results[2 + side].update_draftkings_score()
+    return scores
+
+
+def summarize_totals(home_team, away_team, totals):
+    """
+    Turns SimulationTotals into the info dict returned by simulate
+    """
     # TODO: pitcher bats in NL might lead to subtle bugs? doesn't always bat 9th
+    home_pid = home_team.starter.pid
+    away_pid = away_team.starter.pid
+    home_ids = [player.pid for player in home_team.lineup] + [home_pid, away_pid]
+    away_ids = [player.pid for player in away_team.lineup] + [away_pid, home_pid]
 
-    # The coviariance matrixes where each column is treated as a predictor.
-    home_covs = np.cov(np.array(home_dk_scores[1:]).transpose())
-    away_covs = np.cov(np.array(away_dk_scores[1:]).transpose())
+    info = {}
+    # GameResults divides in place, copying leaves totals free to grow
+    info['avg_results'] = (GameResults(copy.deepcopy(totals.boxscore)) /
+                           totals.num_iterations)
+    home_covs = totals.home_moments.cov()
+    away_covs = totals.away_moments.cov()
+    info['cov_dict'] = build_cov_dict(home_ids, away_ids, home_covs, away_covs)
+    info['score_variances'] = {'home': np.diag(home_covs).copy(),
+                               'away': np.diag(away_covs).copy()}
+
+    adjusted_means = totals.variance.adjusted_batter_means()
+    if adjusted_means is not None:
+        avg_results = info['avg_results']
+        avg_results['home_playerstats']['DK pts pred'] = adjusted_means[0]
+        avg_results['away_playerstats']['DK pts pred'] = adjusted_means[1]
+    home_ess, away_ess = totals.variance.effective_sample_sizes(
+        totals.home_moments, totals.away_moments, totals.num_iterations)
+    info['effective_sample_size'] = dict(zip(home_ids, home_ess))
+    info['effective_sample_size'].update(zip(away_ids, away_ess))
+    info['num_iterations'] = totals.num_iterations
+    info['prob_tie'] = totals.ties / totals.num_iterations
+    info['standard_error'] = max_standard_error(totals)
+    info['score_sketches'] = {'home': totals.home_sketch,
+                              'away': totals.away_sketch}
+    info['score_quantiles'] = {
+        side: pd.DataFrame(sketch.quantiles(), index=SKETCH_HEADERS,
+                           columns=QUANTILE_HEADERS)
+        for side, sketch in info['score_sketches'].items()}
+    if totals.site_names:
+        info['site_projections'] = build_site_projections(totals)
+    if totals.keep_dk_scores:
+        info['home_dk_scores'] = [DK_SCORE_HEADERS] + totals.home_dk_scores
+        info['away_dk_scores'] = [DK_SCORE_HEADERS] + totals.away_dk_scores
+    if totals.engine_stats is not None:
+        info['engine_stats'] = totals.engine_stats.report()
+        logging.getLogger(__name__).info(
+            "%s @ %s: %s", home_team.team_id, away_team.team_id,
+            format_report(info['engine_stats']))
+    if totals.pa_record is not None:
+        info['pa_record'] = totals.pa_record.finish()
 
-    home_ids = [home_team.lineup[i].pid for i in range(9)] + [results[2].pid]
-    home_ids.append(results[3].pid)
-    away_ids = [away_team.lineup[i].pid for i in range(9)] + [results[3].pid]
-    away_ids.append(results[2].pid)
+    return info
+
+
+def build_cov_dict(home_ids, away_ids, home_covs, away_covs):
+    """
+    home_covs is the covariance matrix of the DK scores of the 9 home
+        batters, the home pitcher and then the away pitcher. The ids are in
+        the same order. Likewise for away.
+    Returns nested dict of the covariances between players in the game
+    """
     cov_dict = {}
 
     for i in range(9+1):
@@ -146,30 +790,40 @@ def simulate(home_team, away_team, num_iterations=1):
         cov_dict[away_ids[i]] = dict(zip(away_ids, away_covs[i]))
 
     # Add covariances of away_pitcher to home_batters and vice versa
-    cov_dict[results[3].pid].update(dict(zip(home_ids, home_covs[10])))
-    cov_dict[results[2].pid].update(dict(zip(away_ids, away_covs[10])))
+    cov_dict[home_ids[10]].update(dict(zip(home_ids, home_covs[10])))
+    cov_dict[away_ids[10]].update(dict(zip(away_ids, away_covs[10])))
 
-    info = {}
-    info['avg_results'] = GameResults(cum_results)/num_iterations
-    info['cov_dict'] = cov_dict
-    info['home_dk_scores'] = home_dk_scores
-    info['away_dk_scores'] = away_dk_scores
-
-    return info
+    return cov_dict
 
 
 def get_batters_dk_scores(stats):
     return np.dot(stats, st.DK_multiplier)
 
 
-if __name__ == "__main__":
-    raise Exception("Main not implemented")
+def make_scorer(rule_sets):
+    return Scorer(rule_sets) if rule_sets else None
 
 
-"""
-Improvements for future:
-    Is it faster to use numpy array or just 2d int array?
-    Bring player functionality into Team. Keep player rates in 2d array
-     in team, saving all the dictionary acceses (prob around a 1.5x speedup)
-    Declare the type of the numpy array
-"""
+def site_names(scorer):
+    return () if scorer is None else tuple(scorer.names)
+
+
+def get_site_points(scorer, playerstats, pitcher_stats):
+    """
+    Returns the points of the 9 batters and then the pitcher under each of
+        <scorer>'s rule sets, for one game or a batch of them
+    """
+    pitcher_points = scorer.pitcher_scores(pitcher_stats)
+    return np.concatenate((scorer.batter_scores(playerstats),
+                           pitcher_points[..., np.newaxis, :]), axis=-2)
+
+
+def build_site_projections(totals):
+    """
+    Returns a dict with a DataFrame of the mean points of the home and of the
+        away batters and pitcher, one column per site
+    """
+    return {side: pd.DataFrame(points/totals.num_iterations,
+                               index=DK_SCORE_HEADERS,
+                               columns=totals.site_names)
+            for side, points in zip(("home", "away"), totals.site_points)}
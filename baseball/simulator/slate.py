@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Simulates every game on a slate, spreading the work over a process pool.
+"""
+
+from .simulator import (simulate_rounds, summarize_totals, submit_chunks,
+                        merge_chunks, next_round_size, make_streams,
+                        make_outcome_store, finish_outcome_store,
+                        check_engine, MIN_ITERATIONS)
+from .instrumentation import check_instrument
+from .sampling import RandomStreams
+from . import variance
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+
+import numpy as np
+
+
+# Used to pick how many chunks each game is split into when the number of
+#   games isn't known ahead of time
+TYPICAL_SLATE_SIZE = 15
+
+# Iterations of every game before simulate_slate_budget splits the rest
+PILOT_ITERATIONS = 500
+
+
+def default_chunks_per_game(workers):
+    """
+    Enough chunks that a typical slate gives each worker at least 2 tasks.
+    Small tasks let idle workers pick up the slack from long games.
+    """
+    return max(1, -(-2*workers // TYPICAL_SLATE_SIZE))
+
+
+def game_streams(streams, index):
+    """
+    Returns the substreams of the <index>th game on the slate
+    """
+    return None if streams is None else streams.child(index)
+
+
+def game_outcome_store(outcome_dir, index, num_iterations):
+    """
+    Returns the OutcomeStore of the <index>th game on the slate, if any
+    """
+    if outcome_dir is None:
+        return None
+    return make_outcome_store(os.path.join(outcome_dir, "game_" + str(index)),
+                              num_iterations)
+
+
+class GameRun:
+    """
+    The rounds of iterations of one game on the slate that are in flight
+    """
+    def __init__(self, home_team, away_team, streams, max_iterations,
+                 outcomes=None):
+        self.home_team = home_team
+        self.away_team = away_team
+        self.streams = streams
+        self.max_iterations = max_iterations
+        self.outcomes = outcomes
+        self.totals = None
+        self.futures = []
+
+    def num_iterations(self):
+        return 0 if self.totals is None else self.totals.num_iterations
+
+    def round_done(self):
+        return all(future.done() for future in self.futures)
+
+    def collect(self):
+        self.totals = merge_chunks(self.futures, self.totals)
+        self.futures = []
+
+
+class SlateRunner:
+    """
+    Simulates the GameRuns of a slate, on a pool of <workers> processes if
+        there are more than 1. See simulate_slate for the other arguments.
+    A game is simulated up to its run's max_iterations by run_games, which
+        can be called again after raising them to continue the runs
+    """
+    def __init__(self, engine, workers, chunks_per_game, streams,
+                 variance_reduction, target_error, min_iterations, rule_sets,
+                 instrument):
+        self.engine = engine
+        self.variance_reduction = variance_reduction
+        self.target_error = target_error
+        self.min_iterations = min_iterations
+        self.rule_sets = rule_sets
+        self.instrument = instrument
+        self.group_size = variance.group_size(variance_reduction)
+        self.runs = []
+
+        self.executor = None
+        if workers > 1:
+            if streams is None:
+                streams = RandomStreams(np.random.randint(2**31 - 1))
+            if chunks_per_game is None:
+                chunks_per_game = default_chunks_per_game(workers)
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.streams = streams
+        self.chunks_per_game = chunks_per_game
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def add_game(self, home_team, away_team, max_iterations, outcomes=None):
+        """
+        Starts simulating the next game on the slate. Without a pool the game
+            is simulated before returning, with one its first round is
+            submitted
+        """
+        run = GameRun(home_team, away_team,
+                      game_streams(self.streams, len(self.runs)),
+                      max_iterations, outcomes)
+        self.runs.append(run)
+        if self.executor is None:
+            self.simulate_run(run)
+        else:
+            self.submit_next_round(run)
+        return run
+
+    def simulate_run(self, run):
+        run.totals = simulate_rounds(
+            run.home_team, run.away_team, run.max_iterations,
+            engine=self.engine, streams=run.streams,
+            variance_reduction=self.variance_reduction,
+            target_error=self.target_error,
+            min_iterations=self.min_iterations, rule_sets=self.rule_sets,
+            outcomes=run.outcomes, instrument=self.instrument,
+            totals=run.totals)
+
+    def submit_next_round(self, run):
+        size = next_round_size(run.totals, run.max_iterations,
+                               self.target_error, self.min_iterations,
+                               self.group_size)
+        if size > 0:
+            run.futures = submit_chunks(
+                self.executor, run.home_team, run.away_team, size,
+                self.chunks_per_game, first_iteration=run.num_iterations(),
+                engine=self.engine, streams=run.streams,
+                variance_reduction=self.variance_reduction,
+                rule_sets=self.rule_sets, outcomes=run.outcomes,
+                instrument=self.instrument)
+
+    def run_games(self):
+        """
+        Simulates every game up to its run's max_iterations. With a pool a
+            game's next round is submitted as soon as its last one is merged.
+        """
+        if self.executor is None:
+            for run in self.runs:
+                self.simulate_run(run)
+            return
+
+        for run in self.runs:
+            if not run.futures:
+                self.submit_next_round(run)
+        running = [run for run in self.runs if run.futures]
+        while running:
+            wait([future for run in running for future in run.futures],
+                 return_when=FIRST_COMPLETED)
+            for run in running:
+                if run.round_done():
+                    run.collect()
+                    self.submit_next_round(run)
+            running = [run for run in self.runs if run.futures]
+
+    def num_iterations(self):
+        return sum(run.num_iterations() for run in self.runs)
+
+    def results(self):
+        """
+        Returns the simulate info dict of each game so far in slate order
+        """
+        return [summarize_totals(run.home_team, run.away_team, run.totals)
+                for run in self.runs]
+
+
+def simulate_slate(matchups, num_iterations, engine="game", workers=1,
+                   chunks_per_game=None, seed=None,
+                   common_random_numbers=False, variance_reduction=None,
+                   target_error=None, min_iterations=MIN_ITERATIONS,
+                   rule_sets=None, outcome_dir=None, instrument=None):
+    """
+    matchups is an iterable of (home_team, away_team) pairs. It can be a
+        generator: each game is submitted to the pool as soon as its teams
+        are built so building the rest of the slate overlaps with simulating.
+    Each round of a game is split into <chunks_per_game> chunks of iterations
+        that are scheduled on <workers> processes and merged back per game.
+    seed, common_random_numbers, variance_reduction, target_error,
+        min_iterations and rule_sets are as in simulate. Each game draws from
+        the substreams keyed by its position on the slate. With an
+        outcome_dir the <index>th game stores its outcomes in its
+        game_<index> directory. With a target_error a game's next round is
+        submitted as soon as its last one is merged, so games that converge
+        early free up the workers for the rest.
+    instrument is as in simulate, each game reports and logs its own
+        engine_stats
+    Returns a list with the simulate info dict of each game in matchup order
+    """
+    check_engine(engine, variance_reduction)
+    check_instrument(instrument)
+    variance.check_variance_reduction(variance_reduction,
+                                      common_random_numbers)
+    runner = SlateRunner(engine, workers, chunks_per_game,
+                         make_streams(seed, common_random_numbers),
+                         variance_reduction, target_error, min_iterations,
+                         rule_sets, instrument)
+    try:
+        for index, (home_team, away_team) in enumerate(matchups):
+            runner.add_game(home_team, away_team, num_iterations,
+                            game_outcome_store(outcome_dir, index,
+                                               num_iterations))
+        runner.run_games()
+    finally:
+        runner.close()
+
+    for run in runner.runs:
+        finish_outcome_store(run.outcomes, run.totals)
+    return runner.results()
+
+
+def split_budget(num_iterations, weights, group_size=1):
+    """
+    Splits <num_iterations> between games in proportion to their <weights>,
+        in whole groups of <group_size> coupled games. Leftover groups go to
+        the largest remainders. Evenly if every weight is 0
+    """
+    weights = np.asarray(weights, dtype=float)
+    if (weights < 0).any() or not np.isfinite(weights).all():
+        raise ValueError("Budget weights must be finite and >= 0")
+    if weights.sum() == 0:
+        weights = np.ones(len(weights))
+    num_groups = num_iterations // group_size
+    shares = num_groups*weights/weights.sum()
+    groups = np.floor(shares).astype(int)
+    leftover = num_groups - groups.sum()
+    groups[np.argsort(groups - shares, kind="stable")[:leftover]] += 1
+    return groups*group_size
+
+
+def simulate_slate_budget(matchups, budget, allocate,
+                          pilot_iterations=PILOT_ITERATIONS, engine="game",
+                          workers=1, chunks_per_game=None, seed=None,
+                          common_random_numbers=False,
+                          variance_reduction=None, rule_sets=None,
+                          instrument=None):
+    """
+    Spends a <budget> of iterations over the whole slate on the games where
+        they matter most, instead of the same number on each game
+    Every game first runs a pilot of <pilot_iterations>. allocate is called
+        with the pilot's list of simulate info dicts and returns a weight per
+        game, the rest of the budget is split between the games in
+        proportion, see split_budget, and each game's run continues from its
+        pilot. The other arguments are as in simulate_slate.
+    matchups can be a generator like in simulate_slate, each pilot is
+        submitted as soon as its teams are built. Only the allocation waits
+        for the whole slate.
+    Returns a list with the simulate info dict of each game in matchup order
+    """
+    check_engine(engine, variance_reduction)
+    check_instrument(instrument)
+    variance.check_variance_reduction(variance_reduction,
+                                      common_random_numbers)
+    group_size = variance.group_size(variance_reduction)
+    pilot_iterations = -(-pilot_iterations // group_size)*group_size
+
+    runner = SlateRunner(engine, workers, chunks_per_game,
+                         make_streams(seed, common_random_numbers),
+                         variance_reduction, None, MIN_ITERATIONS, rule_sets,
+                         instrument)
+    try:
+        for home_team, away_team in matchups:
+            if pilot_iterations*(len(runner.runs) + 1) > budget:
+                raise ValueError("A budget of {} iterations can't cover "
+                                 "pilots of {} for {} games".format(
+                                     budget, pilot_iterations,
+                                     len(runner.runs) + 1))
+            runner.add_game(home_team, away_team, pilot_iterations)
+        runner.run_games()
+
+        weights = allocate(runner.results())
+        if len(weights) != len(runner.runs):
+            raise ValueError("allocate returned {} weights for {} "
+                             "games".format(len(weights), len(runner.runs)))
+        for run, size in zip(runner.runs,
+                             split_budget(budget - runner.num_iterations(),
+                                          weights, group_size)):
+            run.max_iterations += size
+        runner.run_games()
+    finally:
+        runner.close()
+    return runner.results()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Surrogate projections, learned from simulated games instead of simulating.
+Every game simulated for the surrogate adds a row per batter and per starter:
+    features of the player, his lineup, the opposing starter and the park,
+    and as targets the simulated mean and log variance of his DK score. A
+    ridge regression per role is fit on them, and project gives a game's
+    projections in about 10 microseconds per player.
+A share of the games is held out of the fit and the surrogate is scored on
+    them, next to the standard error the simulations themselves had. It is
+    only as good as the games it was trained on, so keep adding games, e.g.
+    from every slate build_predictions simulates, and pickle the projector
+    between runs.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .accumulators import DK_SCORE_HEADERS
+from .player import SP_RATES, RP_RATES
+from .slate import simulate_slate
+from .utils import MLB_TEAMS
+
+
+ROLES = ("batter", "pitcher")
+SIDES = ("home", "away")
+
+# Parks are one-hot encoded by their home team_id, others are all zeros
+PARKS = list(MLB_TEAMS)
+
+# Penalty of the ridge regressions on the standardized features
+DEFAULT_RIDGE = 1.0
+# Share of the games added that are held out to measure the error
+HOLDOUT_FRACTION = 0.2
+
+PREDICTION_HEADERS = ("DK pts pred", "DK pts var")
+PREDICTION_INDEX = pd.MultiIndex.from_product([SIDES, DK_SCORE_HEADERS])
+ERROR_HEADERS = ("held-out players", "RMSE", "sim error", "var ratio")
+
+
+def park_features(home_team):
+    features = np.zeros(len(PARKS))
+    if home_team.team_id in PARKS:
+        features[PARKS.index(home_team.team_id)] = 1
+    return features
+
+
+def starter_features(pitcher):
+    return np.array([pitcher.pitch_limit/100.0, pitcher.hand == "L"],
+                    dtype=float)
+
+
+def lineup_features(team):
+    """
+    Mean rates of <team>'s batters against starters
+    """
+    return team.rates[:, :, SP_RATES].mean(axis=0)
+
+
+def player_features(home_team, away_team):
+    """
+    Returns the (18, num features) features of the home and then away
+        batters in lineup order and the (2, num features) features of the
+        home and then away starter
+    """
+    park = park_features(home_team)
+    batters = []
+    pitchers = []
+    for home, team, opponent in ((1, home_team, away_team),
+                                 (0, away_team, home_team)):
+        game = np.concatenate((starter_features(opponent.starter), [home],
+                               park))
+        lineup = lineup_features(team)
+        batters.append(np.hstack((team.rates[:, :, SP_RATES],
+                                  team.rates[:, :, RP_RATES], np.eye(9),
+                                  np.tile(np.concatenate((lineup, game)),
+                                          (9, 1)))))
+        pitchers.append(np.concatenate((lineup_features(opponent), lineup,
+                                        starter_features(team.starter),
+                                        [home], park)))
+    return np.vstack(batters), np.array(pitchers)
+
+
+def simulated_targets(info):
+    """
+    Returns the simulated mean DK score, its variance and the variance of the
+        mean of each home and away batter and of each starter in <info>,
+        returned by simulate, laid out like player_features
+    """
+    results = info['avg_results']
+    batters = []
+    pitchers = []
+    for side in SIDES:
+        means = np.append(
+            results[side + '_playerstats']["DK pts pred"].values[:9],
+            results[side + '_pitcher'].get_stat('dk_score'))
+        variances = info['score_variances'][side][:10]
+        targets = np.column_stack((means, variances,
+                                   variances/info['num_iterations']))
+        batters.append(targets[:9])
+        pitchers.append(targets[9])
+    return np.vstack(batters), np.array(pitchers)
+
+
+class RidgeFit:
+    """
+    Ridge regression of the columns of <targets> on standardized <features>
+        with an unpenalized intercept
+    """
+    def __init__(self, features, targets, ridge=DEFAULT_RIDGE):
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        self.intercept = targets.mean(axis=0)
+        standardized = (features - self.mean)/self.scale
+        gram = np.dot(standardized.T, standardized)
+        gram[np.diag_indices_from(gram)] += ridge
+        self.coef = np.linalg.solve(gram, np.dot(standardized.T,
+                                                 targets - self.intercept))
+
+    def predict(self, features):
+        return self.intercept + np.dot((features - self.mean)/self.scale,
+                                       self.coef)
+
+
+class SurrogateProjector:
+    """
+    Learns each batter's and starter's simulated DK score mean and variance
+        from the games added with add_game, see the module docstring
+    Each game is held out with probability <holdout_fraction>, drawn from
+        <seed>. Projectors with the same settings merge with +=
+    """
+    def __init__(self, ridge=DEFAULT_RIDGE, holdout_fraction=HOLDOUT_FRACTION,
+                 seed=None):
+        self.ridge = ridge
+        self.holdout_fraction = holdout_fraction
+        self.rng = np.random.RandomState(seed)
+        # Per role and split, the (features, targets) of every game added
+        self.samples = {(role, holdout): ([], [])
+                        for role in ROLES for holdout in (False, True)}
+        self.fits = None
+
+    def __add__(self, other):
+        """
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        for key, (features, targets) in other.samples.items():
+            self.samples[key][0].extend(features)
+            self.samples[key][1].extend(targets)
+        self.fits = None
+        return self
+
+    def num_games(self, holdout=False):
+        return len(self.samples[("pitcher", holdout)][0])
+
+    def add_game(self, home_team, away_team, info):
+        """
+        Adds a game simulated by simulate with the current rates of
+            <home_team> and <away_team>, whose info dict is <info>
+        """
+        holdout = self.rng.random_sample() < self.holdout_fraction
+        features = player_features(home_team, away_team)
+        targets = simulated_targets(info)
+        for role, role_features, role_targets in zip(ROLES, features,
+                                                     targets):
+            self.samples[(role, holdout)][0].append(role_features)
+            self.samples[(role, holdout)][1].append(role_targets)
+        self.fits = None
+
+    def stacked(self, role, holdout=False):
+        features, targets = self.samples[(role, holdout)]
+        return np.vstack(features), np.vstack(targets)
+
+    def fit(self):
+        """
+        Fits the mean and log variance of every role on the training games.
+            Called by predict when games were added since the last fit.
+        """
+        if self.num_games() == 0:
+            raise ValueError("SurrogateProjector has no training games")
+        self.fits = {}
+        for role in ROLES:
+            features, targets = self.stacked(role)
+            self.fits[role] = RidgeFit(
+                features, np.column_stack((targets[:, 0],
+                                           np.log(targets[:, 1] + 1e-9))),
+                self.ridge)
+        return self
+
+    def predict_features(self, role, features):
+        """
+        Returns the (num players, 2) projected mean and variance of the DK
+            scores of <role> players with <features>
+        """
+        if self.fits is None:
+            self.fit()
+        predictions = self.fits[role].predict(features)
+        predictions[:, 1] = np.exp(predictions[:, 1])
+        return predictions
+
+    def project(self, home_team, away_team):
+        """
+        Projects a game without simulating it
+        Returns the (2, 10, 2) projected mean and variance of the DK scores
+            of the 9 batters and the starter of the home and then away team
+        """
+        batter_features, pitcher_features = player_features(home_team,
+                                                            away_team)
+        batters = self.predict_features("batter", batter_features)
+        pitchers = self.predict_features("pitcher", pitcher_features)
+        return np.concatenate((batters.reshape(2, 9, 2),
+                               pitchers.reshape(2, 1, 2)), axis=1)
+
+    def predict(self, home_team, away_team):
+        """
+        project as a DataFrame indexed by side and DK_SCORE_HEADERS with
+            PREDICTION_HEADERS columns
+        """
+        return pd.DataFrame(self.project(home_team, away_team).reshape(20, 2),
+                            index=PREDICTION_INDEX,
+                            columns=PREDICTION_HEADERS)
+
+    def holdout_error(self):
+        """
+        Scores the surrogate on the held-out games
+        Returns a DataFrame indexed by ROLES with ERROR_HEADERS columns: the
+            players held out, the RMSE of the projected means against the
+            simulated ones, the root mean squared standard error of the
+            simulated means themselves, which bounds how small the RMSE can
+            get, and the mean ratio of projected to simulated variance
+        """
+        errors = []
+        for role in ROLES:
+            if self.num_games(holdout=True) == 0:
+                errors.append([0, np.nan, np.nan, np.nan])
+                continue
+            features, targets = self.stacked(role, holdout=True)
+            predictions = self.predict_features(role, features)
+            errors.append([len(targets),
+                           np.sqrt(np.mean((predictions[:, 0] -
+                                            targets[:, 0])**2)),
+                           np.sqrt(np.mean(targets[:, 2])),
+                           np.mean(predictions[:, 1]/targets[:, 1])])
+        return pd.DataFrame(errors, index=ROLES, columns=ERROR_HEADERS)
+
+    def projection_errors(self):
+        """
+        Returns a dict of the held-out RMSE of each role, nan without
+            held-out games
+        """
+        return self.holdout_error()["RMSE"].to_dict()
+
+
+def train_surrogate(projector, matchups, num_iterations, engine="batch",
+                    workers=1, seed=None):
+    """
+    Simulates every (home_team, away_team) of <matchups> <num_iterations>
+        times as a slate, see slate.simulate_slate, and adds the games to
+        <projector>
+    Returns the refit projector
+    """
+    matchups = list(matchups)
+    slate_results = simulate_slate(matchups, num_iterations, engine=engine,
+                                   workers=workers, seed=seed)
+    for (home_team, away_team), info in zip(matchups, slate_results):
+        projector.add_game(home_team, away_team, info)
+    return projector.fit()
@@ -8,10 +8,11 @@ STUFF = "hi"
 import numpy as np
 import pandas as pd
 
-from .player import Player
+from .player import Player, NUM_RATE_MODES
 from .pitcher import Pitcher
 
 from . import batting_rates_index as br
+from . import stat_index as st
 
 
 class Team:
@@ -22,6 +23,9 @@ class Team:
     lineup_ids is a list of mlb_ids
     fielding_lineup indicates each corresponding player's fielding position
     Tracks who is at bat, and what the score is
+    The lineup's rates and stats live in two arrays the players are views of:
+        rates is indexed by [slot, batting event, rate mode]
+        stats is indexed by [slot, stat] and zeroed in place every game
     """
     def __init__(self, lineup=None,
                  team_id="TEAM_NAME", starting_pitcher="DEFAULT"):
@@ -31,6 +35,9 @@ class Team:
             for i in range(9):
                 lineup.append(Player())
         self.lineup = lineup
+        self.rates = np.zeros((len(lineup), br.NUM_RATES, NUM_RATE_MODES))
+        self.stats = np.zeros((len(lineup), st.NUM_STATS))
+        self.bind_lineup()
 
         if starting_pitcher == "DEFAULT":
             # TODO: this makes the SB model print out lots of stuff
@@ -48,9 +55,44 @@ class Team:
     def __str__(self):
         return str(self.team_info_dataframe())
 
+    def __setstate__(self, state):
+        # Unpickled players hold copies of the rows, point them back
+        self.__dict__.update(state)
+        self.bind_lineup()
+
+    def bind_lineup(self):
+        """
+        Makes each player's rates and stats views of his slot in the team's
+            arrays, keeping their current values
+        WARNING: a player can only be bound to one team at a time
+        """
+        for slot, player in enumerate(self.lineup):
+            player.bind(self.rates[slot], self.stats[slot])
+
     def __repr__(self):
         return str(self)
 
+    def reorder(self, order):
+        """
+        Changes the batting order to <order>, the current lineup slots in
+            their new order, e.g. [1, 0, 2, ..., 8] swaps the top two
+        The players keep their rates and stats and a pitcher who bats moves
+            with his slot. The team's arrays are replaced, not updated.
+        """
+        if sorted(order) != list(range(len(self.lineup))):
+            raise ValueError("Not a batting order: " + str(order))
+        lineup = [self.lineup[slot] for slot in order]
+        rates = np.zeros_like(self.rates)
+        stats = np.zeros_like(self.stats)
+        for slot, player in enumerate(lineup):
+            player.bind(rates[slot], stats[slot])
+        self.lineup = lineup
+        self.rates = rates
+        self.stats = stats
+        pitcher_slot = self.starter.batting_pos
+        if pitcher_slot is not None:
+            self.starter.batting_pos = list(order).index(pitcher_slot)
+
     def team_info_dataframe(self):
         """
         Packs team player/pitcher rate stats and info into a DataFrame
@@ -81,17 +123,25 @@ class Team:
         Sets all the player stats back to 0.
         Resets all pitcher stats
         """
+        self.stats.fill(0)
         for player in self.lineup:
-            player.reset()
+            player.reset_state()
         self.starter.reset()
         self.reliever.reset()
         self.reset_state()
 
     def get_boxscore(self):
-        boxscore = []
-        for player in self.lineup:
-            boxscore.append(player.get_stats())
-        return np.array(boxscore)
+        """
+        Returns a copy of the lineup's (9, NUM_STATS) stats
+        """
+        return self.stats.copy()
+
+    def stats_view(self):
+        """
+        Returns the lineup's stats array itself, which the next reset zeroes,
+            for the engine to read without copying
+        """
+        return self.stats
 
     def at_bat(self):
         """
@@ -13,6 +13,20 @@ import logging
 import sys
 
 
+# Retrosheet team_ids of each division and the divisions of each league
+MLB_DIVISIONS = {"AL East": ("BAL", "BOS", "NYA", "TBA", "TOR"),
+                 "AL Central": ("CHA", "CLE", "DET", "KCA", "MIN"),
+                 "AL West": ("ANA", "HOU", "OAK", "SEA", "TEX"),
+                 "NL East": ("ATL", "MIA", "NYN", "PHI", "WAS"),
+                 "NL Central": ("CHN", "CIN", "MIL", "PIT", "SLN"),
+                 "NL West": ("ARI", "COL", "LAN", "SDN", "SFN")}
+MLB_LEAGUES = {"AL": ("AL East", "AL Central", "AL West"),
+               "NL": ("NL East", "NL Central", "NL West")}
+# Every team_id, each also naming its home park
+MLB_TEAMS = tuple(sorted(team_id for teams in MLB_DIVISIONS.values()
+                         for team_id in teams))
+
+
 def normalize_stats(stats):
         """
         Takes cumulative integer statistics and normalizes so sum is 1
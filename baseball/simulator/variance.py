@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Author: Emanuel Schorsch
+
+"""
+Variance reduction for simulate.
+    antithetic: games are played in pairs, the second drawing 1 - u for every
+        plate appearance outcome the first drew u for
+    stratified: groups of STRATUM_SIZE games split the [0, 1) interval of each
+        plate appearance draw between them (a Latin hypercube per group)
+    Draws are coupled per batter: the k-th plate appearance of the batter in
+        a lineup slot is paired across the group however the games unfold.
+    control_variates: each batter's points from batting events minus the
+        analytically expected points of the plate appearances he got has mean
+        0, so regressing the DK scores on it removes that noise
+Only plate appearance outcomes are coupled, steals, baserunning and pitch
+    counts are drawn as usual.
+Every run reports the effective sample size of each player's DK score, the
+    number of plain Monte Carlo iterations that would give the same error.
+"""
+
+import numpy as np
+
+from .accumulators import CoMoments, NUM_DK_SCORES
+
+VARIANCE_REDUCTIONS = ("antithetic", "stratified", "control_variates")
+
+# Games per group sharing a stratified set of draws
+STRATUM_SIZE = 16
+
+# Coupled draws per batter, plate appearances after that are drawn as usual
+PA_DRAWS_PER_BATTER = 12
+
+# DK multiplier restricted to the batting events. A batter's other points
+#   (R, RBI, SB) depend on the game state and have no analytic mean.
+EVENT_DK_MULTIPLIER = [0, 0, 3, 5, 8, 10, 2, 2, 0, 0, 0]
+
+
+def check_variance_reduction(variance_reduction, common_random_numbers=False):
+    if variance_reduction not in (None, ) + VARIANCE_REDUCTIONS:
+        raise ValueError("Unknown variance reduction: " +
+                         str(variance_reduction))
+    if common_random_numbers and group_size(variance_reduction) > 1:
+        raise ValueError("Coupled draws can't be combined with "
+                         "common_random_numbers")
+
+
+def group_size(variance_reduction):
+    """
+    Number of consecutive games whose draws are coupled
+    """
+    if variance_reduction == "antithetic":
+        return 2
+    if variance_reduction == "stratified":
+        return STRATUM_SIZE
+    return 1
+
+
+def coupled_uniforms(rng, variance_reduction, num_games, num_draws):
+    """
+    Returns a (num_games, num_draws) array of uniforms for consecutive games
+        coupled within groups of group_size(variance_reduction). Each column
+        is one draw so every game's row is still a uniform sample.
+    """
+    size = group_size(variance_reduction)
+    if size == 1:
+        return rng.random_sample((num_games, num_draws))
+
+    uniforms = np.empty((num_games, num_draws))
+    for start in range(0, num_games, size):
+        games = min(size, num_games - start)
+        if variance_reduction == "antithetic":
+            draws = rng.random_sample(num_draws)
+            uniforms[start] = draws
+            if games == 2:
+                uniforms[start + 1] = 1 - draws
+        else:
+            strata = np.argsort(rng.random_sample((games, num_draws)), axis=0)
+            uniforms[start:start + games] = (
+                (strata + rng.random_sample((games, num_draws)))/games)
+    return uniforms
+
+
+def coupled_pa_draws(rng, variance_reduction, num_games):
+    """
+    Returns coupled uniforms indexed by [game, side, slot, plate appearance]
+    """
+    return coupled_uniforms(rng, variance_reduction, num_games,
+                            2*9*PA_DRAWS_PER_BATTER).reshape(
+                                (num_games, 2, 9, PA_DRAWS_PER_BATTER))
+
+
+def get_batters_event_pts(stats):
+    return np.dot(stats, EVENT_DK_MULTIPLIER)
+
+
+class VarianceTotals:
+    """
+    The moments needed to estimate the error of a run for both teams
+    With coupled draws the means of each group of games are independent, so
+        their spread estimates the error of the overall mean.
+    With control variates the DK score rows are accumulated together with
+        the 9 batters' controls.
+    WARNING: groups are formed from consecutive games so flush must be called
+        at the end of each chunk of games
+    """
+    def __init__(self, variance_reduction=None):
+        self.variance_reduction = variance_reduction
+        self.group_size = group_size(variance_reduction)
+        size = NUM_DK_SCORES
+        if variance_reduction == "control_variates":
+            size += 9
+        self.home_moments = CoMoments(size)
+        self.away_moments = CoMoments(size)
+        self.pending = []
+
+    def __add__(self, other):
+        """
+        WARNING: This modifies self and doesn't return a new instance
+        """
+        self.home_moments += other.home_moments
+        self.away_moments += other.away_moments
+        return self
+
+    def rows(self, home_scores, away_scores, home_controls, away_controls):
+        if self.variance_reduction == "control_variates":
+            return (np.column_stack((home_scores, home_controls)),
+                    np.column_stack((away_scores, away_controls)))
+        return np.asarray(home_scores), np.asarray(away_scores)
+
+    def add_game(self, home_scores, away_scores, home_controls=None,
+                 away_controls=None):
+        if self.variance_reduction is None:
+            return
+        home_row, away_row = self.rows(np.atleast_2d(home_scores),
+                                       np.atleast_2d(away_scores),
+                                       np.atleast_2d(home_controls),
+                                       np.atleast_2d(away_controls))
+        self.pending.append((home_row[0], away_row[0]))
+        if len(self.pending) == self.group_size:
+            self.flush()
+
+    def add_batch(self, home_scores, away_scores, home_controls=None,
+                  away_controls=None):
+        """
+        Rows are one game each, the batch should start at a group boundary
+        """
+        if self.variance_reduction is None:
+            return
+        home_rows, away_rows = self.rows(home_scores, away_scores,
+                                         home_controls, away_controls)
+        full = len(home_rows) - len(home_rows) % self.group_size
+        for moments, rows in ((self.home_moments, home_rows),
+                              (self.away_moments, away_rows)):
+            if full > 0:
+                groups = rows[:full].reshape((-1, self.group_size,
+                                              rows.shape[1]))
+                moments.add_rows(groups.mean(axis=1))
+            if full < len(rows):
+                moments.add(rows[full:].mean(axis=0))
+
+    def flush(self):
+        """
+        Adds the mean of any partial group of games
+        """
+        if self.pending:
+            home_rows, away_rows = zip(*self.pending)
+            self.home_moments.add(np.mean(home_rows, axis=0))
+            self.away_moments.add(np.mean(away_rows, axis=0))
+            self.pending = []
+
+    def control_fit(self, moments):
+        """
+        Regresses each batter's DK score on the 9 controls
+        Returns the coefficients (9 batters, 9 controls) and the residual
+            variance of each batter
+        """
+        cov = moments.cov()
+        score_cov = cov[:9, :9]
+        cross_cov = cov[:9, NUM_DK_SCORES:]
+        control_cov = cov[NUM_DK_SCORES:, NUM_DK_SCORES:]
+        coefs = np.dot(cross_cov, np.linalg.pinv(control_cov))
+        residual = np.diag(score_cov) - (coefs*cross_cov).sum(axis=1)
+        return coefs, np.maximum(residual, 0)
+
+    def adjusted_batter_means(self):
+        """
+        Returns the control variate estimates of the home and away batters'
+            mean DK scores, or None if control variates aren't used
+        """
+        if self.variance_reduction != "control_variates":
+            return None
+        adjusted = []
+        for moments in (self.home_moments, self.away_moments):
+            coefs, _ = self.control_fit(moments)
+            means = moments.mean()
+            adjusted.append(means[:9] -
+                            np.dot(coefs, means[NUM_DK_SCORES:]))
+        return adjusted
+
+    def effective_sample_sizes(self, home_moments, away_moments,
+                               num_iterations):
+        """
+        home_moments and away_moments are the plain CoMoments of the DK score
+            rows used to get each player's variance
+        Returns the home and away arrays with the effective sample size of
+            the 9 batters and each team's pitcher
+        """
+        sizes = []
+        for plain, moments in ((home_moments, self.home_moments),
+                               (away_moments, self.away_moments)):
+            variances = np.diag(plain.cov())[:10]
+            if self.variance_reduction is None or moments.count < 2:
+                errors = variances/num_iterations
+            elif self.variance_reduction == "control_variates":
+                errors = variances/num_iterations
+                _, residual = self.control_fit(moments)
+                errors[:9] = residual/num_iterations
+            else:
+                errors = np.diag(moments.cov())[:10]/moments.count
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ess = np.where(errors > 0, variances/errors, num_iterations)
+            sizes.append(ess)
+        return sizes
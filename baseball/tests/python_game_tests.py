@@ -2,13 +2,18 @@
 # Copyright (C) 2015 Author: Emanuel Schorsch
 
 import unittest
+import os
+import tempfile
 
 import numpy as np
 import pandas as pd
 
 from baseball.simulator.team import Team
-from baseball.simulator.game import Game
+from baseball.simulator.game import Game, GameState, TeamState
 from baseball.simulator import stat_index as st
+from baseball.simulator.sampling import CategoricalTable, UniformBuffer, compile_cdf
+from baseball.simulator.baserunning import (TransitionTable, load_advances,
+                                            HOME_PLATE, SB, CS)
 
 from baseball.tests.python_simulator_tests import initDoubleTeams
 
@@ -260,6 +265,88 @@ class TestGame(unittest.TestCase):
 
         return stats
 
+    def testSnapshotRestore(self):
+        """
+        A game restored from a snapshot should carry on exactly as the
+            original did
+        """
+        home_team, away_team = initDoubleTeams()
+        curr_game = Game(home_team, away_team)
+        for event in ["BB", "OUT", "OUT", "OUT", "BB", "BB"]:
+            curr_game.handle_event(event)
+        state = curr_game.snapshot()
+        assert(state.runners == (1, 0, None))
+        curr_game.handle_event("HR")
+        # The boxscore is a copy, so the reset doesn't change it
+        expected_stats = curr_game.get_boxscore()[:2]
+        expected_state = curr_game.game_state()
+
+        curr_game.reset_game()
+        curr_game.restore(state)
+        curr_game.handle_event("HR")
+        stats = curr_game.get_boxscore()
+        np.testing.assert_array_equal(expected_stats[0], stats[0])
+        np.testing.assert_array_equal(expected_stats[1], stats[1])
+        assert(curr_game.game_state() == expected_state)
+        assert(curr_game.get_away_pitcher().get_stat('ER') == 3)
+
+        self.assertRaises(ValueError, GameState, outs=3)
+        self.assertRaises(ValueError, TeamState, at_bat_index=9)
+
+    def testStealLogic(self):
+        home_team, away_team = initDoubleTeams()
+        curr_game = Game(home_team, away_team)
+        curr_game.handle_event("BB")
+        curr_game.handle_event("BB")
+        runner = curr_game.second_base
+        curr_game.advance_sb_failure(curr_game.get_base_state())
+        assert(curr_game.get_base_state() == 2)
+        assert(curr_game.outs == 1)
+        assert(runner.get_stats()[st.CS] == 1)
+        runner = curr_game.second_base
+        curr_game.advance_sb_success(curr_game.get_base_state())
+        assert(curr_game.get_base_state() == 4)
+        assert(runner.get_stats()[st.SB] == 1)
+        self.assertRaises(ValueError, curr_game.advance_sb_success, 4)
+
+    def testLoadedAdvances(self):
+        """
+        A csv advancement model should replace just the plays it lists
+        """
+        rows = pd.DataFrame({"event": ["SINGLE"]*3, "base_state": [1]*3,
+                             "outs": [0, 1, 2], "probability": [2.0]*3,
+                             "batter": [1]*3, "first": [HOME_PLATE]*3,
+                             "second": [0]*3, "third": [0]*3})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "advances.csv")
+            rows.to_csv(csv_path, index=False)
+            transitions = TransitionTable(load_advances(csv_path))
+        assert(transitions.cdfs[0][1][2] == [1.0])
+
+        home_team, away_team = initDoubleTeams()
+        curr_game = Game(home_team, away_team, transitions=transitions)
+        curr_game.handle_event("BB")
+        curr_game.handle_event("SINGLE")
+        curr_game.handle_event("HR")
+        state = curr_game.game_state()
+        assert(state['away_score'] == 3)
+        assert(transitions.outs_made[SB].sum() == 0)
+        assert(transitions.outs_made[CS, 3, 0, 0] == 1)
+
+
+class TestSampling(unittest.TestCase):
+    def testCompileCdf(self):
+        # Rounding error in the input shouldn't let a draw fall off the end
+        cdf = compile_cdf([0.2, 0.3, 0.4999, 0.0])
+        np.testing.assert_array_almost_equal(cdf, [0.2, 0.5, 1.0, 1.0])
+
+    def testCategoricalTable(self):
+        uniforms = UniformBuffer(block_size=7)
+        table = CategoricalTable(("A", "B", "C"), (0.0, 0.25, 0.75))
+        draws = [table.sample(uniforms) for i in range(4000)]
+        assert("A" not in draws)
+        assert(0.2 < draws.count("B")/4000.0 < 0.3)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,15 +2,39 @@
 # Copyright (C) 2015 Author: Emanuel Schorsch
 
 import unittest
+import tempfile
+import json
+import pickle
 
 import numpy as np
 import pandas as pd
 
 from baseball.simulator.team import Team
-from baseball.simulator.simulator import simulate
+from baseball.simulator.simulator import (simulate, split_iterations,
+                                          compare_engines,
+                                          compare_batting_orders)
+from baseball.simulator.accumulators import CoMoments, ScoreHistogram
+from baseball.simulator.slate import (simulate_slate, simulate_slate_budget,
+                                      split_budget)
+from baseball.simulator.variance import coupled_uniforms, STRATUM_SIZE
+from baseball.simulator.scoring import Scorer, FANDUEL
+from baseball.simulator.outcomes import load_outcomes
+from baseball.simulator.play_by_play import (load_play_by_play, EVENT_INDEX,
+                                             PlayByPlayLog,
+                                             record_play_by_play)
+from baseball.simulator.game import Game, GameState, TeamState
+from baseball.simulator.benchmark import (run_suite, benchmark_matchups,
+                                          synthetic_team)
+from baseball.simulator.season import (matchup_key, project_season,
+                                       simulate_seasons)
+from baseball.simulator.bonus_sampling import estimate_bonuses
+from baseball.simulator.surrogate import SurrogateProjector, train_surrogate
 
 from baseball.simulator import batting_rates_index as br
+from baseball.simulator import stat_index as st
+from baseball.simulator import markov
 from baseball.simulator import utils
+from baseball.sbModel.stolen_bases import shared_stolen_bases
 
 
 def initDoubleTeams():
@@ -31,12 +55,12 @@ def initDoubleTeams():
     return home_team, away_team
 
 
-def sanityChecks(home_team, away_team):
+def sanityChecks(home_team, away_team, engine="game"):
     """
     Run simulator enough times that we can make assertions about what we expect
         certain stats to be. Verifies that CG, CGSO, W, num_pitches are tracked.
     """
-    simulated_results = simulate(home_team, away_team, 500)
+    simulated_results = simulate(home_team, away_team, 500, engine=engine)
     results = simulated_results['avg_results']
     np.testing.assert_array_less(np.zeros((9, 12)) - .00001,
                                     np.array(results["home_playerstats"]))
@@ -71,6 +95,641 @@ class TestSimulator(unittest.TestCase):
         home_team, away_team = initDoubleTeams()
         print("steal team\n", sanityChecks(home_team, away_team))
 
+    def testBatchSimpleDoubleTeam(self):
+        home_team, away_team = initDoubleTeams()
+        print("batch double team\n", sanityChecks(home_team, away_team, "batch"))
+
+    def testCachedSimpleDoubleTeam(self):
+        home_team, away_team = initDoubleTeams()
+        print("cached double team\n", sanityChecks(home_team, away_team,
+                                                   "cached"))
+
+    def testCompareEngines(self):
+        """
+        The cached engine's means should be within noise of the full engine's
+        """
+        home_team, away_team = initDoubleTeams()
+        means, errors, seconds_per_game = compare_engines(home_team, away_team,
+                                                          500, seed=3)
+        assert(list(means.columns) == ["game", "cached"])
+        assert(set(seconds_per_game) == set(["game", "cached"]))
+        differences = (means["cached"] - means["game"]).abs()
+        assert((differences <= 4*np.sqrt((errors**2).sum(axis=1)) +
+                1e-9).all())
+        assert((means.loc["away"].iloc[:9] == 0).all().all())
+
+    def testBatchEndCondition(self):
+        """
+        Teams that always get out should play 20 innings in every batch game
+        """
+        simulated_results = simulate(Team(), Team(), 50, engine="batch")
+        results = simulated_results['avg_results']
+        assert(results["home_score"] == 0)
+        assert(results["away_score"] == 0)
+        assert(results["prob_home_win"] == 0)
+        assert(simulated_results["prob_tie"] == 1)
+        for team in ["home_playerstats", "away_playerstats"]:
+            outs = np.array(results[team]["OUT"])
+            np.testing.assert_array_equal(outs, [7]*6 + [6]*3)
+        for pitcher in ["home_pitcher", "away_pitcher"]:
+            assert(results[pitcher].get_stat('CG') == 1)
+            assert(results[pitcher].get_stat('NH') == 1)
+            assert(results[pitcher].get_stat('W') == 0)
+            assert(results[pitcher].get_num_pitches() > 95)
+        self.assertAlmostEqual(results["home_pitcher"].get_stat('IP'), 20)
+
+    def testUnknownEngine(self):
+        home_team, away_team = initDoubleTeams()
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          "cython")
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          "cached", variance_reduction="antithetic")
+
+    def testParallelWorkers(self):
+        """
+        Iterations split across workers should merge back into one result
+        """
+        home_team, away_team = initDoubleTeams()
+        simulated_results = simulate(home_team, away_team, 301,
+                                     engine="batch", workers=3,
+                                     keep_dk_scores=True)
+        results = simulated_results['avg_results']
+        assert(len(simulated_results['home_dk_scores']) == 301 + 1)
+        assert(results["away_score"] == 0)
+        assert(0.9 <= results["home_pitcher"].get_stat('W') <= 1.0)
+        assert(split_iterations(301, 3) == [101, 100, 100])
+
+    def testSimulateSlate(self):
+        """
+        Slate results should come back in game order whatever finishes first
+        """
+        def matchups():
+            home_team, away_team = initDoubleTeams()
+            yield home_team, away_team
+            home_team, away_team = initDoubleTeams()
+            yield away_team, home_team
+
+        slate_results = simulate_slate(matchups(), 100, engine="batch",
+                                       workers=2, chunks_per_game=3)
+        assert(len(slate_results) == 2)
+        assert(slate_results[0]['avg_results']["away_score"] == 0)
+        assert(slate_results[0]['avg_results']["home_score"] > 0)
+        assert(slate_results[1]['avg_results']["home_score"] == 0)
+        assert('away_dk_scores' not in slate_results[1])
+
+    def testSeededRuns(self):
+        """
+        Runs with the same seed should repeat exactly on either engine
+        """
+        home_team, away_team = initDoubleTeams()
+        for engine in ("game", "batch"):
+            first = simulate(home_team, away_team, 200, engine=engine, seed=7)
+            second = simulate(home_team, away_team, 200, engine=engine, seed=7)
+            assert(first['avg_results']["home_score"] ==
+                   second['avg_results']["home_score"])
+            np.testing.assert_array_equal(
+                first['avg_results']["home_playerstats"],
+                second['avg_results']["home_playerstats"])
+
+    def testCommonRandomNumbers(self):
+        """
+        Game i should get the same draws however the iterations are split
+        """
+        home_team, away_team = initDoubleTeams()
+        serial = simulate(home_team, away_team, 200, seed=7,
+                          common_random_numbers=True)
+        parallel = simulate(home_team, away_team, 200, workers=2, seed=7,
+                            common_random_numbers=True)
+        np.testing.assert_array_almost_equal(
+            serial['avg_results']["home_playerstats"],
+            parallel['avg_results']["home_playerstats"])
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          common_random_numbers=True)
+
+    def testVarianceReduction(self):
+        """
+        Every mode should agree with the plain DK projections and report an
+            effective sample size for every player
+        """
+        home_team, away_team = initDoubleTeams()
+        plain = simulate(home_team, away_team, 2000, engine="batch")
+        plain_pts = plain['avg_results']['home_playerstats']['DK pts pred']
+        for mode in ("antithetic", "stratified", "control_variates"):
+            for engine in ("game", "batch"):
+                results = simulate(home_team, away_team, 200, engine=engine,
+                                   variance_reduction=mode)
+                pts = results['avg_results']['home_playerstats']['DK pts pred']
+                np.testing.assert_allclose(pts, plain_pts, rtol=.25)
+                ess = results['effective_sample_size']
+                assert(ess[home_team.starter.pid] > 0)
+                assert(ess[away_team.lineup[0].pid] > 0)
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          variance_reduction="sobol")
+
+    def testAdaptiveStopping(self):
+        """
+        Should stop at the minimum once precise enough and run to the
+            maximum otherwise, in whole rounds either way
+        """
+        home_team, away_team = initDoubleTeams()
+        loose = simulate(home_team, away_team, 1000, target_error=10.0,
+                         min_iterations=200)
+        assert(loose['num_iterations'] == 200)
+        assert(loose['standard_error'] <= 10.0)
+
+        strict = simulate(home_team, away_team, 1000, engine="batch",
+                          workers=2, target_error=0.001, min_iterations=200)
+        assert(strict['num_iterations'] == 1000)
+        assert(strict['standard_error'] > 0.001)
+
+        target = simulate(home_team, away_team, 20000, engine="batch",
+                          target_error=0.2)
+        assert(200 < target['num_iterations'] < 20000)
+        assert(target['standard_error'] <= 0.2)
+
+    def testAdaptiveSlate(self):
+        def matchups():
+            for i in range(2):
+                home_team, away_team = initDoubleTeams()
+                yield home_team, away_team
+
+        slate_results = simulate_slate(matchups(), 5000, engine="batch",
+                                       workers=2, target_error=0.3,
+                                       min_iterations=100)
+        for results in slate_results:
+            assert(100 <= results['num_iterations'] < 5000)
+            assert(results['standard_error'] <= 0.3)
+
+    def testSlateBudget(self):
+        """
+        The budget left after the pilots should be split by the weights
+        """
+        np.testing.assert_array_equal(split_budget(10, [1, 1, 1], 2),
+                                      [4, 4, 2])
+        np.testing.assert_array_equal(split_budget(10, [0, 0]), [5, 5])
+
+        def allocate(pilot_results):
+            assert([results['num_iterations'] for results in pilot_results] ==
+                   [200, 200])
+            return [3, 1]
+
+        for workers in (1, 2):
+            matchups = [initDoubleTeams(), initDoubleTeams()[::-1]]
+            slate_results = simulate_slate_budget(iter(matchups), 2000,
+                                                  allocate, 200,
+                                                  engine="batch",
+                                                  workers=workers, seed=7)
+            assert([results['num_iterations'] for results in slate_results] ==
+                   [1400, 600])
+            assert(slate_results[0]['avg_results']["home_score"] > 0)
+            assert(slate_results[1]['avg_results']["home_score"] == 0)
+        with self.assertRaises(ValueError):
+            simulate_slate_budget(matchups, 300, allocate, 200)
+
+    def testCoupledUniforms(self):
+        rng = np.random.RandomState(3)
+        pairs = coupled_uniforms(rng, "antithetic", 6, 5)
+        np.testing.assert_array_almost_equal(pairs[0::2] + pairs[1::2],
+                                             np.ones((3, 5)))
+        strata = coupled_uniforms(rng, "stratified", STRATUM_SIZE, 5)
+        for column in strata.T:
+            np.testing.assert_array_equal(
+                np.sort(np.floor(column*STRATUM_SIZE)),
+                np.arange(STRATUM_SIZE))
+
+    def testCoMomentsMerge(self):
+        scores = np.random.normal(size=(200, 11))
+        first = CoMoments()
+        first.add_rows(scores[:120])
+        second = CoMoments()
+        for row in scores[120:]:
+            second.add(row)
+        first += second
+        np.testing.assert_array_almost_equal(first.cov(), np.cov(scores.T))
+        np.testing.assert_array_almost_equal(first.mean(), scores.mean(axis=0))
+
+    def testCoMomentsLargeOffset(self):
+        """
+        Centered moments shouldn't lose the covariance under a large mean
+        """
+        scores = np.random.normal(size=(500, 11)) + 1e8
+        moments = CoMoments()
+        for start in range(0, 500, 50):
+            moments.add_rows(scores[start:start+50])
+        np.testing.assert_array_almost_equal(moments.cov(), np.cov(scores.T),
+                                             decimal=6)
+
+    def testScoreHistogram(self):
+        """
+        Sketches built row by row or in chunks should merge to the same counts
+            and give quantiles within a bin of the exact ones, exact ones for
+            scores on the bin edges
+        """
+        rng = np.random.RandomState(3)
+        scores = np.column_stack((rng.poisson(6, 5000),
+                                  rng.normal(12, 6, 5000)))
+        sketch = ScoreHistogram(2)
+        for row in scores[:1000]:
+            sketch.add(row.tolist())
+        for start in range(1000, 5000, 1000):
+            chunk = ScoreHistogram(2)
+            chunk.add_rows(scores[start:start + 1000])
+            sketch += chunk
+        assert(sketch.count() == 5000)
+        expected = np.percentile(scores, [10, 50, 90], axis=0,
+                                 interpolation="lower").T
+        np.testing.assert_array_equal(sketch.quantiles()[0], expected[0])
+        np.testing.assert_allclose(sketch.quantiles()[1], expected[1],
+                                   atol=0.5)
+        # Mostly scoreless batters don't get fractional quantiles
+        scoreless = ScoreHistogram(1)
+        scoreless.add_rows(np.array([[0.0]]*60 + [[3.0]]*30 + [[7.0]]*10))
+        np.testing.assert_array_equal(scoreless.quantiles(), [[0, 0, 3]])
+        np.testing.assert_allclose(sketch.exceedance(10),
+                                   (scores >= 10).mean(axis=0))
+
+    def testScoreQuantiles(self):
+        home_team, away_team = initDoubleTeams()
+        simulated_results = simulate(home_team, away_team, 100,
+                                     engine="batch", seed=2)
+        home_quantiles = simulated_results['score_quantiles']['home']
+        away_quantiles = simulated_results['score_quantiles']['away']
+        assert((home_quantiles["P10"] <= home_quantiles["P50"]).all())
+        assert((home_quantiles["P50"] <= home_quantiles["P90"]).all())
+        assert(home_quantiles.loc["team", "P50"] > 0)
+        # The away batters never score
+        np.testing.assert_allclose(away_quantiles.values[:9], 0, atol=0.5)
+
+    def testOutcomeStore(self):
+        """
+        Stored outcomes should match the DK score rows and averages of the run
+            whether they're written by one process or by several
+        """
+        home_team, away_team = initDoubleTeams()
+        for engine, workers in (("game", 1), ("batch", 2)):
+            with tempfile.TemporaryDirectory() as outcome_dir:
+                simulated_results = simulate(home_team, away_team, 101,
+                                             engine=engine, workers=workers,
+                                             seed=4, keep_dk_scores=True,
+                                             outcome_dir=outcome_dir)
+                outcomes = load_outcomes(outcome_dir)
+                results = simulated_results['avg_results']
+                assert(len(outcomes["home_runs"]) == 101)
+                np.testing.assert_allclose(
+                    outcomes["home_dk_scores"],
+                    simulated_results['home_dk_scores'][1:])
+                self.assertAlmostEqual(outcomes["home_runs"].mean(),
+                                       results['home_score'])
+                assert((outcomes["away_runs"] == 0).all())
+                self.assertAlmostEqual(outcomes["home_pitcher"][:, 0].mean(),
+                                       results['home_pitcher'].get_stat('IP'))
+
+    def testPlayByPlay(self):
+        """
+        The logged plate appearances should add up to the run's averages
+            whether they're written by one process or by several
+        """
+        home_team, away_team = initDoubleTeams()
+        for workers in (1, 2):
+            with tempfile.TemporaryDirectory() as play_by_play_dir:
+                simulated_results = simulate(home_team, away_team, 101,
+                                             workers=workers, seed=4,
+                                             play_by_play_dir=play_by_play_dir)
+                records = load_play_by_play(play_by_play_dir)
+                results = simulated_results['avg_results']
+                np.testing.assert_array_equal(np.unique(records["iteration"]),
+                                              np.arange(101))
+                assert((np.diff(records["iteration"].astype(int)) >= 0).all())
+                assert((records["outs"] < 3).all())
+
+                home = records[records["top"] == 0]
+                away = records[records["top"] == 1]
+                self.assertAlmostEqual(home["runs"].sum()/101.0,
+                                       results['home_score'])
+                self.assertAlmostEqual(
+                    (home["event"] == EVENT_INDEX["DOUBLE"]).sum()/101.0,
+                    results['home_playerstats']["DOUBLE"].sum())
+                assert((away["event"] == EVENT_INDEX["OUT"]).all())
+                assert(len(away) == 101*27)
+                assert((records["pitches"] > 0).all())
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          "batch", play_by_play_dir=play_by_play_dir)
+
+        # A game only records to one writer
+        curr_game = Game(home_team, away_team)
+        with tempfile.TemporaryDirectory() as play_by_play_dir:
+            writer = PlayByPlayLog(play_by_play_dir).writer(0)
+            record_play_by_play(curr_game, writer)
+            self.assertRaises(ValueError, record_play_by_play, curr_game,
+                              writer)
+            writer.close()
+
+    def testMarkovProjection(self):
+        """
+        The Markov chain expectations should match the simulated averages
+        The lineup hits well enough that extra innings are negligible
+        """
+        batting_event_rates = utils.lineup_zeroed_batting_rates()
+        batting_event_rates.loc[:, "SINGLE"] = 0.25
+        batting_event_rates.loc[:, "DOUBLE"] = np.linspace(0, 0.08, 9)
+        batting_event_rates.loc[:, "HR"] = 0.05
+        batting_event_rates.loc[:, "BB"] = 0.1
+        batting_event_rates.loc[:, "OUT"] = 0.5
+        away_team = Team(utils.lineup_from_batting_rates(batting_event_rates),
+                         team_id="NYA")
+        home_team = Team(team_id="ANA")
+
+        # markov leaves out steals, so the simulated runners never attempt one
+        runner_effects = shared_stolen_bases().ranef["attempt"]["runner"]
+        try:
+            for slot, player in enumerate(away_team.lineup):
+                player.pid = "no_steals_{}".format(slot)
+                runner_effects[player.pid] = -np.inf
+            projection = markov.project_lineup(away_team)
+            simulated_results = simulate(home_team, away_team, 3000,
+                                         engine="batch", seed=7)
+        finally:
+            for player in away_team.lineup:
+                runner_effects.pop(player.pid, None)
+        stats = simulated_results['avg_results']['away_playerstats']
+        assert(stats["SB"].sum() == 0 and stats["CS"].sum() == 0)
+        plate_appearances = stats[["SINGLE", "DOUBLE", "TRIPLE", "HR", "BB",
+                                   "HBP", "OUT"]].sum(axis=1)
+        np.testing.assert_allclose(projection["PA"], plate_appearances,
+                                   atol=0.1)
+        np.testing.assert_allclose(projection["RUN"], stats["RUN"], atol=0.1)
+        np.testing.assert_allclose(projection["RBI"], stats["RBI"], atol=0.1)
+        np.testing.assert_allclose(projection["DK pts pred"],
+                                   stats["DK pts pred"], atol=0.6)
+        assert(abs(projection["RUN"].sum() - projection["RBI"].sum()) < 1e-9)
+
+    def testStartState(self):
+        """
+        Games simulated from the top of the 9th with two outs should only
+            add the away team's last out to the stats so far
+        """
+        home_team, away_team = initDoubleTeams()
+        home_stats = np.zeros((9, 11))
+        home_stats[:, 1] = 2
+        state = GameState(9, True, 2, (None, None, None),
+                          home=TeamState(3, 5, home_stats,
+                                         {'IP': 8 + 2/3.0}, 90),
+                          away=TeamState(0, 4, starter_stats={'H': 12},
+                                         starter_pitches=120,
+                                         reliever_in=True))
+        for engine in ["game", "cached"]:
+            simulated_results = simulate(home_team, away_team, 50,
+                                         engine=engine, start_state=state)
+            results = simulated_results['avg_results']
+            assert(results["home_score"] == 3)
+            assert(results["away_score"] == 0)
+            assert(results["prob_home_win"] == 1)
+            np.testing.assert_array_equal(
+                results["home_playerstats"].iloc[:, :11], home_stats)
+            assert(results["away_playerstats"]["OUT"].tolist() ==
+                   [0]*4 + [1] + [0]*4)
+            self.assertAlmostEqual(results["home_pitcher"].get_stat('IP'), 9)
+            assert(results["home_pitcher"].get_stat('CGSO') == 1)
+            assert(results["away_pitcher"].get_stat('H') == 12)
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          "batch", start_state=state)
+
+    def testInstrumentation(self):
+        """
+        Instrumented runs should count every plate appearance without
+            changing the seeded results
+        """
+        home_team, away_team = initDoubleTeams()
+        for engine in ["game", "batch"]:
+            plain = simulate(home_team, away_team, 100, engine=engine, seed=3)
+            timed = simulate(home_team, away_team, 100, engine=engine, seed=3,
+                             instrument="timers")
+            results = timed['avg_results']
+            pd.testing.assert_frame_equal(
+                results["home_playerstats"],
+                plain['avg_results']["home_playerstats"])
+            engine_stats = timed['engine_stats']
+            assert(engine_stats['games'] == 100)
+            assert(engine_stats['games_per_sec'] > 0)
+            assert(engine_stats['handle_steals_ns_per_game'] > 0)
+            plate_appearances = sum(
+                results[side][stat].sum() for side in ["home_playerstats",
+                                                       "away_playerstats"]
+                for stat in ["SINGLE", "DOUBLE", "BB", "OUT"])
+            self.assertAlmostEqual(engine_stats['plate_appearances_per_game'],
+                                   plate_appearances)
+            steal_attempts = sum(
+                results[side][stat].sum() for side in ["home_playerstats",
+                                                       "away_playerstats"]
+                for stat in ["SB", "CS"])
+            self.assertAlmostEqual(engine_stats['steal_attempts_per_game'],
+                                   steal_attempts)
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          instrument="profile")
+
+    def testBenchmarkSuite(self):
+        """
+        The quick benchmark suite should run without a database and come
+            back as JSON
+        """
+        results = json.loads(json.dumps(run_suite(quick=True)))
+        for name in ["AL", "NL", "steal_heavy"]:
+            assert(results["simulate_game"][name]["games_per_sec"] > 0)
+            assert(results["simulate_game"][name]["peak_bytes_per_game"] > 0)
+        assert([run["iterations"] for run in results["simulate"]["batch"]] ==
+               [50, 200])
+        assert(results["choice"]["ns_per_call"] > 0)
+        home_team = benchmark_matchups()["NL"][0]
+        assert(home_team.starter.batting_pos == 8)
+        assert(home_team.lineup[8].pinch_hitter_rates[br.SO] <
+               home_team.lineup[8].sp_batting_rates[br.SO])
+
+    def testSeasonProjection(self):
+        """
+        A team that always wins should win out and take its division, games
+            that always end tied should be coin flips, and coin flip seasons
+            should hand out every playoff spot
+        """
+        home_team, away_team = initDoubleTeams()
+        away_team.team_id = "BOS"
+        ana, oak = Team(team_id="ANA"), Team(team_id="OAK")
+        schedule = [(home_team, away_team), (away_team, home_team)]*3
+        schedule += [(ana, oak)]*4
+        wins = {"NYA": 10, "BOS": 12, "ANA": 11, "OAK": 5}
+        divisions = {"East": ("NYA", "BOS"), "West": ("ANA", "OAK")}
+        leagues = {"AL": ("East", "West")}
+        cache = {}
+        projection = project_season(wins, schedule, 500, 20, seed=1,
+                                    cache=cache, divisions=divisions,
+                                    leagues=leagues, wild_cards=1)
+        assert(len(cache) == 3)
+        assert(cache[matchup_key(ana, oak)] == 0.5)
+        standings = projection['standings']
+        projected = standings["wins"]
+        assert(projected[["BOS", "NYA"]].to_dict() == {"BOS": 12, "NYA": 16})
+        self.assertAlmostEqual(projected["ANA"] + projected["OAK"], 20)
+        assert(standings["division"].to_dict() ==
+               {"ANA": 1, "BOS": 0, "NYA": 1, "OAK": 0})
+        assert(standings.loc["BOS", "playoffs"] == 1)
+        assert(projection['win_distribution'].loc["NYA", 16] == 1)
+
+        totals = simulate_seasons(wins, [("NYA", "BOS"), ("ANA", "OAK")]*20,
+                                  [0.5]*40, 2000, divisions, leagues, 1,
+                                  seed=2)
+        standings = totals.standings()
+        self.assertAlmostEqual(standings["division"].sum(), 2)
+        self.assertAlmostEqual(standings["playoffs"].sum(), 3)
+        assert(abs(standings.loc["OAK", "wins"] - 15) < 0.5)
+        self.assertRaises(ValueError, simulate_seasons, {"NYA": 0}, [], [],
+                          10, divisions, leagues)
+
+    def testPlateAppearanceReweighting(self):
+        """
+        Reweighting the recorded plate appearances should move the
+            projections toward the new rates and warn when they moved too far
+        """
+        home_team, away_team = initDoubleTeams()
+        simulated_results = simulate(home_team, away_team, 500, seed=4,
+                                     keep_pa_counts=True)
+        record = simulated_results['pa_record']
+        assert(len(record) == 500)
+        stats = simulated_results['avg_results']["home_playerstats"]
+        self.assertAlmostEqual(record.counts[:, 0].sum()/500.0,
+                               (stats["DOUBLE"] + stats["OUT"]).sum())
+        unchanged = record.reweight(home_team, away_team)
+        self.assertAlmostEqual(unchanged['effective_sample_size'], 500)
+        assert((unchanged['projections']["delta"].abs() < 1e-9).all())
+
+        rates = home_team.lineup[0].get_batting_rates()
+        rates["DOUBLE"] = 0.55
+        home_team.lineup[0].set_sp_batting_rates(rates)
+        projections = record.reweight(home_team, away_team)['projections']
+        assert(projections.loc[("home", "p1"), "delta"] > 0)
+        assert((projections.loc["away", "delta"].iloc[:9] == 0).all())
+        sensitivities = record.rate_sensitivities(0, 0)
+        assert(sensitivities.loc["DOUBLE", ("home", "p1")] > 0)
+        assert(np.isnan(sensitivities.loc["SINGLE", ("home", "p1")]))
+
+        rates["DOUBLE"] = 0.9
+        for player in home_team.lineup:
+            player.set_sp_batting_rates(rates)
+        self.assertWarns(RuntimeWarning, record.reweight, home_team,
+                         away_team)
+        rates["SINGLE"] = 0.01
+        home_team.lineup[0].set_sp_batting_rates(rates)
+        self.assertRaises(ValueError, record.reweight, home_team, away_team)
+        self.assertRaises(ValueError, simulate, home_team, away_team, 1,
+                          "batch", keep_pa_counts=True)
+
+    def testBonusImportanceSampling(self):
+        """
+        Tilted and reweighted games should estimate the away starter's no
+            hitter odds against a lineup that doubles 10% of the time like
+            plain simulations do, and leave the lineup's rates alone
+        """
+        batting_event_rates = utils.lineup_zeroed_batting_rates()
+        batting_event_rates.loc[:, "DOUBLE"] = 0.1
+        home_team = Team(utils.lineup_from_batting_rates(batting_event_rates),
+                         team_id="NYA")
+        away_team = Team(team_id="ANA")
+        rates = home_team.rates.copy()
+
+        estimates = estimate_bonuses(away_team, home_team, 400, home=False,
+                                     seed=6)['bonuses']
+        np.testing.assert_array_equal(home_team.rates, rates)
+        plain = simulate(home_team, away_team, 1000, seed=7)
+        no_hitters = plain['avg_results']["away_pitcher"].get_stat('NH')
+        error = np.sqrt(estimates.loc["NH", "standard error"]**2 +
+                        no_hitters*(1 - no_hitters)/1000)
+        assert(abs(estimates.loc["NH", "probability"] - no_hitters) <
+               4*error)
+        assert(estimates.loc["NH", "effective iterations"] > 400)
+        self.assertAlmostEqual(estimates.loc["NH", "DK pts"],
+                               5*estimates.loc["NH", "probability"])
+
+    def testSurrogateProjector(self):
+        """
+        A surrogate trained on synthetic games should project the held-out
+            ones better than their mean does and survive pickling
+        """
+        rng = np.random.RandomState(0)
+        matchups = [(synthetic_team(rng, "NYA"), synthetic_team(rng, "BOS"))
+                    for i in range(30)]
+        projector = train_surrogate(SurrogateProjector(seed=0), matchups,
+                                    200, seed=1)
+        assert(projector.num_games() + projector.num_games(True) == 30)
+
+        errors = projector.holdout_error()
+        for role in ("batter", "pitcher"):
+            targets = projector.stacked(role, holdout=True)[1]
+            assert(errors.loc[role, "RMSE"] < targets[:, 0].std())
+            assert(0.5 < errors.loc[role, "var ratio"] < 2)
+
+        home_team, away_team = matchups[0]
+        projection = projector.predict(home_team, away_team)
+        assert(projection.shape == (20, 2))
+        assert((projection["DK pts var"] > 0).all())
+        np.testing.assert_array_equal(
+            pickle.loads(pickle.dumps(projector)).project(home_team,
+                                                          away_team),
+            projection.values.reshape(2, 10, 2))
+
+        merged = SurrogateProjector()
+        merged += projector
+        assert(merged.num_games() == projector.num_games())
+
+    def testBattingOrders(self):
+        """
+        Moving the only hitter from 9th to leadoff gets him more plate
+            appearances, the current order shouldn't change anything
+        """
+        batting_event_rates = utils.lineup_zeroed_batting_rates()
+        batting_event_rates.loc[8, "DOUBLE"] = 0.5
+        team = Team(utils.lineup_from_batting_rates(batting_event_rates),
+                    team_id="NYA")
+        players = list(team.lineup)
+        leadoff = [8, 0, 1, 2, 3, 4, 5, 6, 7]
+        results = compare_batting_orders(team, Team(team_id="ANA"),
+                                         [list(range(9)), leadoff], 200,
+                                         home=False, seed=4)
+        assert((results.loc[0, ["delta", "delta low", "delta high"]] ==
+                0).all().all())
+        assert(results.loc[(1, "p9"), "delta low"] > 0)
+        assert((results.loc[1, "DK pts pred"].iloc[:8] == 0).all())
+        assert(team.lineup == players)
+        assert(team.rates[8, br.DOUBLE, 0] == 0.5)
+        assert(np.shares_memory(players[8].rates, team.rates))
+        self.assertRaises(ValueError, team.reorder, [0]*9)
+
+    def testSiteProjections(self):
+        """
+        Every rule set should be scored from the same simulated games
+        """
+        home_team, away_team = initDoubleTeams()
+        for engine in ("game", "batch"):
+            simulated_results = simulate(home_team, away_team, 200,
+                                         engine=engine, seed=5,
+                                         rule_sets=["DK", "FD"])
+            results = simulated_results['avg_results']
+            projections = simulated_results['site_projections']['home']
+            stats = results['home_playerstats']
+            np.testing.assert_allclose(projections["DK"][:9],
+                                       stats["DK pts pred"])
+            np.testing.assert_allclose(
+                projections["FD"][:9],
+                np.dot(stats[list(st.stats)], FANDUEL.batter_weights))
+            self.assertAlmostEqual(projections["DK"]["pitcher"],
+                                   results['home_pitcher'].get_stat('dk_score'))
+
+    def testQualityStartBonus(self):
+        scorer = Scorer(["DK", "FD"])
+        stats = {'IP': np.array([18/3.0, 17/3.0, 7.0]),
+                 'ER': np.array([3, 0, 4])}
+        for key in ('SO', 'W', 'H', 'BB', 'HBP', 'CG', 'CGSO', 'NH'):
+            stats[key] = np.zeros(3)
+        np.testing.assert_allclose(scorer.pitcher_scores(stats),
+                                   [[7.5, 13], [12.75, 17], [7.75, 9]])
+
     def testSimpleStealTeam(self):
         pass
         # TODO: implement a test which does basic testing of the SB module